@@ -0,0 +1,2176 @@
+# File: cas_bench.py
+# Offline benchmarks for the live link. Runs with plain Python, no Cascadeur or Max needed.
+#   python cas_bench.py            -> run everything
+#   python cas_bench.py wire       -> run only the named benchmarks
+import sys
+import os
+import json
+import math
+import time
+import random
+import socket
+import struct
+import threading
+import itertools
+import collections
+from array import array
+
+import cas_protocol
+import cas_stream
+import cas_capture
+import cas_stats
+import max_scene
+import max_stream
+
+
+def fake_pose(joints, seed=1):
+    rnd = random.Random(seed)
+    names = tuple(f"Character:Joint_{i:03d}" for i in range(joints))
+    pos = [rnd.uniform(-100.0, 100.0) for _ in range(joints * 3)]
+    rot = [rnd.uniform(-1.0, 1.0) for _ in range(joints * 4)]
+    return names, pos, rot
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def report(label, seconds, size=None):
+    line = f"  {label:<28} {seconds * 1e6:10.1f} us"
+    if size is not None:
+        line += f"   {size:8d} bytes"
+    print(line)
+
+
+# --- Fake Max Scene ---
+# Just enough of pymxs.runtime for the max_scene helpers, with a counter for
+# every call that would cross the pymxs bridge.
+class FakeNode:
+    _handles = itertools.count(1)
+
+    def __init__(self, name, rt=None, parent=None):
+        object.__setattr__(self, "handle", next(FakeNode._handles))
+        object.__setattr__(self, "props", {})
+        object.__setattr__(self, "_rt", rt)
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "parent", parent)
+        object.__setattr__(self, "pos", None)
+        object.__setattr__(self, "rotation", None)
+        object.__setattr__(self, "transform", None)
+        object.__setattr__(self, "baseObject", None)
+        object.__setattr__(self, "modifiers", ())
+
+    @property
+    def inode(self):
+        return self
+
+    @property
+    def children(self):
+        scene = getattr(self._rt, "scene", None)
+        nodes = scene.values() if scene is not None else (self._rt.objects if self._rt is not None else ())
+        return [node for node in nodes if node.parent is self]
+
+    def __setattr__(self, key, value):
+        # Property writes from Python cross the bridge
+        if self._rt is not None:
+            self._rt.calls += 1
+        object.__setattr__(self, key, value)
+
+
+class FakeRuntime:
+    def __init__(self, node_count, bone_names=()):
+        self.calls = 0
+        self.objects = [FakeNode(f"Prop_{i:05d}", self) for i in range(node_count)]
+        # Bones form a simple chain so hierarchy order matters
+        parent = None
+        for n in bone_names:
+            parent = FakeNode(max_scene.short_name(n), self, parent)
+            object.__setattr__(parent, "transform", FakeMatrix())
+            self.objects.append(parent)
+
+    def getNodeByName(self, name):
+        self.calls += 1
+        for obj in self.objects:
+            if obj.name == name: return obj
+        return None
+
+    def delete(self, node):
+        self.calls += 1
+        self.objects.remove(node)
+        node.__dict__["deleted"] = True
+
+    def isValidNode(self, node):
+        self.calls += 1
+        return node is not None and not node.__dict__.get("deleted")
+
+    def Point3(self, *values):
+        self.calls += 1
+        return values
+
+    def Quat(self, *values):
+        self.calls += 1
+        return values
+
+    def execute(self, script):
+        self.calls += 1
+        if "casBridgeApplyPose" in script:
+            self.casBridgeApplyPose = self._apply_pose
+        if "casBridgeBakeKeys" in script:
+            self.casBridgeBakeKeys = self._bake_keys
+            self.casBridgeKeyModes = self._key_modes
+
+    def _key_modes(self, nodes):
+        # Stand-in: nodes marked "keyed" keep their own (Euler) rotation keys
+        self.calls += 1
+        return [1 if node.__dict__.get("keyed") else max_scene.KEYS_REDUCIBLE for node in nodes]
+
+    def _bake_keys(self, nodes, counts, times, values):
+        # Stand-in for the compiled MAXScript function: keys land in node.keys
+        self.calls += 1
+        k = 0
+        for node, count in zip(nodes, counts):
+            keys = node.__dict__.setdefault("keys", {})
+            for _ in range(count):
+                keys[times[k]] = values[k * 7:k * 7 + 7]
+                k += 1
+        return k
+
+    def _apply_pose(self, nodes, values):
+        # Stand-in for the compiled MAXScript function: one call per frame,
+        # deleted and "locked" nodes are reported back as failed
+        self.calls += 1
+        failed = []
+        for i, node in enumerate(nodes):
+            if node.__dict__.get("deleted") or node.__dict__.get("locked"):
+                failed.append(i + 1)
+                continue
+            object.__setattr__(node, "transform", values[i * 7:i * 7 + 7])
+        return failed
+
+
+# --- Fake Cascadeur Scene ---
+class FakeVec:
+    __slots__ = ("x", "y", "z", "w")
+
+    def __init__(self, x, y, z, w=1.0):
+        self.x, self.y, self.z, self.w = x, y, z, w
+
+
+class FakeMatrix:
+    # A Max node.transform at rest, as KeyBaker reads it
+    __slots__ = ("row4", "rotation", "scale")
+
+    def __init__(self):
+        self.row4 = FakeVec(0.0, 0.0, 0.0)
+        self.rotation = FakeVec(0.0, 0.0, 0.0, 1.0)
+        self.scale = FakeVec(1.0, 1.0, 1.0)
+
+
+class FakeTransform:
+    __slots__ = ("translation", "rotation")
+
+    def __init__(self, seed):
+        self.translation = FakeVec(seed, seed + 1.0, seed + 2.0)
+        self.rotation = FakeVec(0.0, 0.0, 0.0, 1.0)
+
+
+class FakeCscObject:
+    def __init__(self, name, id):
+        self.name = name
+        self.id = id
+        self.calls = 0
+        self._tf = FakeTransform(float(id))
+
+    def get_global_transform(self):
+        self.calls += 1
+        return self._tf
+
+
+def fake_selection(joints, others=0):
+    objects = [FakeCscObject(f"Character:Joint_{i:03d}", i) for i in range(joints)]
+    objects += [FakeCscObject(f"Character:Mesh_{i:03d}", joints + i) for i in range(others)]
+    return objects
+
+
+# --- Wire Format ---
+def bench_wire(joints=150, repeat=2000):
+    print(f"[wire] {joints} joints, {repeat} frames")
+    names, pos, rot = fake_pose(joints)
+    frame = 42
+
+    def encode_json():
+        data_list = []
+        for i, name in enumerate(names):
+            data_list.append({"n": name, "p": pos[i * 3:i * 3 + 3], "r": rot[i * 4:i * 4 + 4]})
+        return json.dumps({"command": "LIVE_DATA", "frame": frame, "data": data_list}).encode('utf-8')
+
+    json_msg = encode_json()
+
+    def decode_json():
+        packet = json.loads(json_msg.decode('utf-8'))
+        return cas_protocol.PoseFrame.from_json(packet["frame"], packet["data"])
+
+    from array import array
+    pos_f = array("f", pos)
+    rot_f = array("f", rot)
+
+    def encode_binary():
+        return cas_protocol.encode_pose(1, frame, pos_f, rot_f)
+
+    bin_msg = encode_binary()
+
+    def decode_binary():
+        return cas_protocol.decode_pose(bin_msg, names)
+
+    report("json encode", timed(encode_json, repeat), len(json_msg))
+    report("json decode", timed(decode_json, repeat))
+    report("binary encode", timed(encode_binary, repeat), len(bin_msg))
+    report("binary decode", timed(decode_binary, repeat))
+    print(f"  binary layout (sent once per joint set): {len(cas_protocol.encode_layout(1, names))} bytes")
+
+
+# --- Stream Framing ---
+def _send_fragmented(sock, data, rnd):
+    view = memoryview(data)
+    while len(view):
+        n = rnd.randint(1, 4096)
+        sock.sendall(view[:n])
+        view = view[n:]
+
+
+def _drain(reader, sock, expected, received):
+    while len(received) < expected:
+        if not reader.recv_from(sock): break
+        for channel, payload in reader.messages():
+            received.append(bytes(payload))
+
+
+def bench_framing(packets=5000, joints=150):
+    # Fires back-to-back and randomly fragmented packets through a socket pair
+    # and checks every message comes out exactly once and in order.
+    print(f"[framing] {packets} packets over a socket pair")
+    names, pos, rot = fake_pose(joints)
+    from array import array
+    pos_f = array("f", pos)
+    rot_f = array("f", rot)
+    rnd = random.Random(7)
+
+    messages = []
+    for i in range(packets):
+        if i % 3 == 0:
+            messages.append(json.dumps({"command": "PING", "seq": i}).encode('utf-8'))
+        else:
+            messages.append(cas_protocol.encode_pose(1, i, pos_f, rot_f))
+
+    for label, fragmented in (("back-to-back", False), ("fragmented", True)):
+        a, b = socket.socketpair()
+        reader = cas_protocol.FrameReader()
+        reader.framed = True
+        received = []
+        stream = b"".join(cas_protocol.frame(m) for m in messages)
+
+        start = time.perf_counter()
+        t = threading.Thread(target=_drain, args=(reader, b, len(messages), received))
+        t.start()
+        if fragmented:
+            _send_fragmented(a, stream, rnd)
+        else:
+            a.sendall(stream)
+        t.join()
+        elapsed = time.perf_counter() - start
+        a.close()
+        b.close()
+
+        lost = len(messages) - len(received)
+        intact = received == messages
+        print(f"  {label:<14} {len(received)}/{len(messages)} msgs, lost {lost}, in order {intact}, "
+              f"{reader.bytes_received / elapsed / 1e6:.1f} MB/s, "
+              f"malformed {reader.malformed}, oversized {reader.oversized}")
+
+    # Legacy unframed JSON stream (old senders, one-shot SYNC_MODEL)
+    reader = cas_protocol.FrameReader()
+    legacy = [json.dumps({"command": "LIVE_DATA", "frame": i, "data": []}).encode('utf-8') for i in range(packets)]
+    stream = b"".join(legacy)
+    view = memoryview(stream)
+    received = []
+    while len(view):
+        n = rnd.randint(1, 512)
+        reader.feed(view[:n])
+        view = view[n:]
+        for channel, payload in reader.messages():
+            received.append(bytes(payload))
+    print(f"  {'legacy json':<14} {len(received)}/{len(legacy)} msgs, in order {received == legacy}")
+
+    # A backlog of legacy messages read in one go, and one big object arriving
+    # in small chunks: the cost per message / per byte should stay flat
+    for count in (1000, 4000, 8000):
+        reader = cas_protocol.FrameReader()
+        stream = b"".join(json.dumps({"command": "LIVE_DATA", "frame": i, "data": []}).encode('utf-8') for i in range(count))
+        start = time.perf_counter()
+        reader.feed(stream)
+        got = sum(1 for _ in reader.messages())
+        elapsed = time.perf_counter() - start
+        print(f"  {'legacy backlog':<14} {got}/{count} msgs in one buffer, {elapsed / count * 1e6:.1f} us/msg")
+    for size_kb in (256, 1024):
+        reader = cas_protocol.FrameReader(max_size=4 * 1024 * 1024)
+        big = json.dumps({"command": "SYNC_MODEL", "path": "x" * (size_kb * 1024)}).encode('utf-8')
+        view = memoryview(big)
+        got = 0
+        start = time.perf_counter()
+        for i in range(0, len(big), 4096):
+            reader.feed(view[i:i + 4096])
+            got += sum(1 for _ in reader.messages())
+        elapsed = time.perf_counter() - start
+        print(f"  {'legacy chunked':<14} {size_kb} KB object in 4 KB chunks, {got} msg, {elapsed * 1000:.1f} ms")
+
+
+# --- Node Lookup ---
+def bench_nodes(bones=150, repeat=20):
+    print(f"[nodes] {bones} bones per frame")
+    names, pos, rot = fake_pose(bones)
+    for scene_size in (1000, 10000):
+        rt = FakeRuntime(scene_size, names)
+
+        def by_name():
+            for name in names:
+                if ":" in name: name = name.split(":")[-1]
+                rt.getNodeByName(name)
+
+        cache = max_scene.NodeCache(rt)
+        cache.rebuild()
+
+        def cached():
+            for name in names:
+                cache.get(name)
+
+        report(f"{scene_size} nodes getNodeByName", timed(by_name, repeat))
+        report(f"{scene_size} nodes cached", timed(cached, repeat * 50))
+        print(f"  cache stats: {cache.stats()}")
+
+    # A cache invalidated every frame (a node keeps failing) must not flood the listener
+    import io
+    import contextlib
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        for _ in range(100):
+            cache.invalidate()
+            cached()
+    print(f"  invalidated every frame x100: {cache.stats()['rebuilds']} rebuilds, {len(out.getvalue().splitlines())} lines logged")
+
+    # A node that keeps failing (locked transform) only drops its own entry;
+    # a deleted one rebuilds the index once
+    rt = FakeRuntime(1000, names)
+    cache = max_scene.NodeCache(rt)
+    applier = max_scene.PoseApplier(rt, cache)
+    rt.getNodeByName(names[-1].split(":")[-1]).__dict__["locked"] = True
+    with contextlib.redirect_stdout(out):
+        for frame in range(100):
+            if frame == 50:
+                rt.delete(rt.getNodeByName(names[0].split(":")[-1]))
+            nodes = [cache.get(name) for name in names]
+            if applier.apply(nodes, pos, rot):
+                cache.evict([names[k] for k in applier.failed])
+    print(f"  locked node x100, deleted node once: {cache.stats()['rebuilds']} rebuilds, "
+          f"{cache.stats()['invalidations']} invalidations")
+
+
+# --- Mailbox ---
+def bench_mailbox(send_hz=200, apply_ms=30, seconds=2.0):
+    # Fast synthetic sender against a slow "main thread". Compares end-to-end
+    # latency of a plain FIFO (one signal per packet) with the mailbox.
+    print(f"[mailbox] sender {send_hz} Hz, apply {apply_ms} ms, {seconds:.0f} s")
+    import queue
+
+    def sender(put, stop_at):
+        seq = 0
+        next_time = time.perf_counter()
+        while time.perf_counter() < stop_at:
+            put({"command": "LIVE_DATA", "frame": seq, "_sent": time.perf_counter()})
+            if seq % 50 == 0:
+                put({"command": "PING", "seq": seq, "_sent": time.perf_counter()})
+            seq += 1
+            next_time += 1.0 / send_hz
+            time.sleep(max(0.0, next_time - time.perf_counter()))
+
+    def apply(packet, latencies):
+        time.sleep(apply_ms / 1000.0)
+        latencies.append(time.perf_counter() - packet["_sent"])
+
+    # FIFO: every packet is applied in turn
+    fifo = queue.Queue()
+    latencies = []
+    stop_at = time.perf_counter() + seconds
+    t = threading.Thread(target=sender, args=(fifo.put, stop_at))
+    t.start()
+    while t.is_alive() or not fifo.empty():
+        try:
+            packet = fifo.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if packet["command"] == "LIVE_DATA":
+            apply(packet, latencies)
+        if time.perf_counter() > stop_at + seconds:
+            break
+    t.join()
+    print(f"  fifo     applied {len(latencies):4d}, last latency {latencies[-1] * 1000:8.1f} ms, backlog {fifo.qsize()}")
+
+    # Mailbox: wake-up only when it goes non-empty, newest pose wins
+    mailbox = max_stream.PoseMailbox()
+    wake = threading.Event()
+    latencies = []
+    commands = 0
+
+    def post(packet):
+        if mailbox.put(packet):
+            wake.set()
+
+    stop_at = time.perf_counter() + seconds
+    t = threading.Thread(target=sender, args=(post, stop_at))
+    t.start()
+    while t.is_alive():
+        if not wake.wait(0.1): continue
+        wake.clear()
+        cmds, poses = mailbox.drain()
+        commands += len(cmds)
+        for pose in poses:
+            apply(pose, latencies)
+            mailbox.mark_applied(pose)
+    t.join()
+    print(f"  mailbox  applied {len(latencies):4d}, last latency {latencies[-1] * 1000:8.1f} ms, commands {commands}")
+    print(f"  mailbox stats: {mailbox.stats()}")
+
+
+# --- Delta Streaming ---
+def fake_session(kind, joints, ticks, seed=3):
+    # idle: nothing moves, scrub: one controller drags a short chain,
+    # playback: every joint moves every tick
+    from array import array
+    names, pos, rot = fake_pose(joints, seed)
+    pos = array("f", pos)
+    rot = array("f", rot)
+    rnd = random.Random(seed)
+    for t in range(ticks):
+        if kind == "scrub":
+            for i in range(5):
+                pos[i * 3] += 0.1
+                rot[i * 4] = rnd.uniform(-1.0, 1.0)
+        elif kind == "playback":
+            for i in range(len(pos)):
+                pos[i] += rnd.uniform(-0.5, 0.5)
+            for i in range(0, len(rot), 4):
+                rot[i] = rnd.uniform(-1.0, 1.0)
+        yield t, pos, rot
+
+
+def bench_delta(joints=150, ticks=500):
+    print(f"[delta] {joints} joints, {ticks} ticks per session")
+    for kind in ("idle", "scrub", "playback"):
+        # Ticks are generated up front so only encoding and tracking are timed
+        session = [(t, array("f", pos), array("f", rot))
+                   for t, pos, rot in fake_session(kind, joints, ticks)]
+        full_bytes = 0
+        start = time.perf_counter()
+        for t, pos, rot in session:
+            full_bytes += len(cas_protocol.encode_pose(1, t, pos, rot))
+        full_time = (time.perf_counter() - start) / ticks
+
+        tracker = cas_stream.DeltaTracker()
+        delta_bytes = 0
+        packets = 0
+        start = time.perf_counter()
+        for t, pos, rot in session:
+            keyframe, indices = tracker.update(pos, rot)
+            if keyframe:
+                delta_bytes += len(cas_protocol.encode_pose(1, t, pos, rot))
+            elif indices:
+                sub_pos, sub_rot = cas_stream.pick_joints(pos, rot, indices)
+                delta_bytes += len(cas_protocol.encode_pose(1, t, sub_pos, sub_rot, indices))
+            else:
+                continue
+            packets += 1
+        delta_time = (time.perf_counter() - start) / ticks
+
+        print(f"  {kind:<9} full {full_bytes / ticks:8.0f} B/tick {full_time * 1e6:7.1f} us | "
+              f"delta {delta_bytes / ticks:8.0f} B/tick {delta_time * 1e6:7.1f} us, {packets} packets")
+
+
+# --- Joint Selection ---
+def bench_selection(joints=150, others=150, repeat=2000):
+    print(f"[selection] {joints} joints + {others} other selected objects")
+    objects = fake_selection(joints, others)
+
+    def scan():
+        return [obj for obj in objects if "Joint" in obj.name or "Center" in obj.name or "Point" in obj.name]
+
+    selection = cas_stream.JointSelection()
+
+    def cached():
+        return selection.update(objects)
+
+    assert scan() == cached()
+    report("substring scan per tick", timed(scan, repeat))
+    report("cached selection per tick", timed(cached, repeat))
+
+    # Changing the selection must rebuild, an unchanged one must not
+    rebuilds = selection.rebuilds
+    cached()
+    objects = objects[:-1]
+    picked = selection.update(objects)
+    print(f"  rebuilds: unchanged +{selection.rebuilds - rebuilds - 1}, changed +1 -> {selection.rebuilds - rebuilds}, "
+          f"joints {len(picked)}")
+
+    # Renaming a selected object (same id) must rebuild too
+    rebuilds = selection.rebuilds
+    objects[0].name = "Character:Prop_000"
+    picked = selection.update(objects)
+    print(f"  renamed joint: rebuilds +{selection.rebuilds - rebuilds}, joints {len(picked)}, "
+          f"old name gone {'Character:Joint_000' not in selection.names}")
+    objects[0].name = "Character:Joint_000"
+
+    exclude = cas_stream.JointSelection(cas_stream.JointFilter(r"Joint", ["Character:Joint_000"]))
+    print(f"  include/exclude rules: {len(exclude.update(objects))} joints kept")
+
+
+# --- Pose Sampling ---
+def _alloc_per_tick(fn, repeat):
+    import tracemalloc
+    fn()
+    tracemalloc.start()
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn()
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return peak
+
+
+def bench_sampler(repeat=500):
+    print("[sampler] time and peak bytes allocated per tick")
+    from array import array
+    for joints in (50, 200, 1000):
+        objects = fake_selection(joints)
+
+        def lists():
+            # Previous path: fresh lists/dicts per joint
+            data_list = []
+            for obj in objects:
+                tf = obj.get_global_transform()
+                p = tf.translation
+                r = tf.rotation
+                data_list.append({"n": obj.name, "p": [p.x, p.y, p.z], "r": [r.x, r.y, r.z, r.w]})
+            return data_list
+
+        def extend():
+            pos = array("f")
+            rot = array("f")
+            for obj in objects:
+                tf = obj.get_global_transform()
+                p = tf.translation
+                r = tf.rotation
+                pos.extend((p.x, p.y, p.z))
+                rot.extend((r.x, r.y, r.z, r.w))
+            return pos, rot
+
+        sampler = cas_stream.PoseSampler()
+
+        def sample():
+            return sampler.sample(objects)
+
+        for label, fn in (("dict per joint", lists), ("array.extend", extend), ("PoseSampler", sample)):
+            seconds = timed(fn, repeat)
+            peak = _alloc_per_tick(fn, 50)
+            print(f"  {joints:5d} joints {label:<16} {seconds * 1e6:9.1f} us   {peak:8d} bytes")
+
+
+# --- Axis Conversion ---
+def bench_axis(repeat=50):
+    backend = "numpy" if max_stream.numpy is not None else "array slices"
+    print(f"[axis] Cascadeur -> Max conversion ({backend})")
+    from array import array
+    for bones in (1000, 10000):
+        names, pos, rot = fake_pose(bones)
+        pose = cas_protocol.PoseFrame(0, names, array("f", pos), array("f", rot))
+        scale = 2.54
+        conversion = max_stream.AxisConversion(scale=scale)
+
+        def per_bone():
+            # Same formula update_scene_live used per bone
+            out = []
+            p_ = pose.pos
+            r_ = pose.rot
+            for i in range(bones):
+                p = i * 3
+                r = i * 4
+                out.append(((p_[p] * scale, p_[p + 2] * scale, p_[p + 1] * scale),
+                            (r_[r], r_[r + 2], -r_[r + 1], r_[r + 3])))
+            return out
+
+        def staged():
+            return conversion.convert(pose)
+
+        ref = per_bone()
+        cpos, crot = staged()
+        err = 0.0
+        for i, (p, r) in enumerate(ref):
+            err = max(err, max(abs(a - b) for a, b in zip(p, cpos[i * 3:i * 3 + 3])),
+                      max(abs(a - b) for a, b in zip(r, crot[i * 4:i * 4 + 4])))
+
+        report(f"{bones} bones per-bone", timed(per_bone, repeat))
+        report(f"{bones} bones staged", timed(staged, repeat))
+        print(f"  max abs difference vs per-bone formula: {err:.2e}")
+
+    # Deltas and per-bone offsets
+    names, pos, rot = fake_pose(10)
+    delta = cas_protocol.PoseFrame(0, names, array("f", pos[6:9]), array("f", rot[8:12]), array("H", [2]))
+    conversion = max_stream.AxisConversion(offsets={names[2]: (1.0, 2.0, 3.0)})
+    cpos, crot = conversion.convert(delta)
+    expected = [pos[6] + 1.0, pos[8] + 2.0, pos[7] + 3.0]
+    ok = max(abs(a - b) for a, b in zip(cpos, expected)) < 1e-4
+    print(f"  delta + offset matches formula: {ok}")
+
+
+# --- Pose Apply ---
+def bench_apply(bones=150, repeat=200):
+    print(f"[apply] {bones} bones, bridge calls and time per frame")
+    names, pos, rot = fake_pose(bones)
+    for mode in (max_scene.APPLY_PER_PROPERTY, max_scene.APPLY_BULK):
+        rt = FakeRuntime(0, names)
+        cache = max_scene.NodeCache(rt)
+        applier = max_scene.PoseApplier(rt, cache, mode)
+        nodes = [cache.get(name) for name in reversed(names)]
+
+        def frame():
+            applier.apply(nodes, pos, rot)
+
+        frame()
+        rt.calls = 0
+        seconds = timed(frame, repeat)
+        print(f"  {mode:<13} {rt.calls / repeat:7.1f} calls/frame {seconds * 1e6:9.1f} us")
+
+
+# --- Session ---
+def _fake_receiver(server, import_seconds, result):
+    # Mirrors ServerWorker: HELLO, then acks SYNC_MODEL after a fake import
+    client, addr = server.accept()
+    session = cas_protocol.Session(client, framed=False)
+    layouts = {}
+    frames = []
+    with client:
+        while True:
+            if not session.reader.recv_from(client): break
+            for channel, payload in session.reader.messages():
+                if cas_protocol.is_binary(payload):
+                    pose = cas_protocol.decode_binary(payload, layouts)
+                    if pose is not None:
+                        frames.append(pose.frame)
+                    continue
+                packet = json.loads(bytes(payload).decode('utf-8'))
+                if packet.get("command") == "HELLO":
+                    session.send_raw(cas_protocol.hello_reply(packet))
+                    session.reader.framed = True
+                elif packet.get("command") == "SYNC_MODEL":
+                    time.sleep(import_seconds)
+                    session.ack(packet, True)
+                else:
+                    session.dispatch(channel, packet)
+    result["frames"] = frames
+
+
+def bench_session(poses=2000, sync_every=400, import_ms=20):
+    print(f"[session] {poses} poses over one connection, SYNC_MODEL every {sync_every}")
+    from array import array
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    result = {}
+    t = threading.Thread(target=_fake_receiver, args=(server, import_ms / 1000.0, result))
+    t.start()
+
+    sock = socket.create_connection(server.getsockname())
+    sock.sendall(cas_protocol.hello_packet())
+    chosen = cas_protocol.parse_hello_reply(sock.recv(1024))
+    session = cas_protocol.Session(sock)
+    names, pos, rot = fake_pose(150)
+    pos = array("f", pos)
+    rot = array("f", rot)
+
+    session.send_raw(cas_protocol.frame(cas_protocol.encode_layout(1, names)))
+    round_trips = []
+    for i in range(poses):
+        session.send(cas_protocol.encode_pose(1, i, pos, rot))
+        if i % sync_every == sync_every - 1:
+            start = time.perf_counter()
+            request_id = session.request({"command": "SYNC_MODEL", "path": "fake.fbx"}, cas_protocol.CHANNEL_MESH)
+            if session.wait_ack(request_id, 5.0) is not None:
+                round_trips.append(time.perf_counter() - start)
+        if i % 100 == 0:
+            session.ping()
+            session.poll(0)
+    sock.close()
+    t.join()
+    server.close()
+
+    frames = result.get("frames", [])
+    avg = sum(round_trips) / len(round_trips) if round_trips else 0.0
+    print(f"  format {chosen}, poses {len(frames)}/{poses}, in order {frames == list(range(poses))}")
+    print(f"  sync acks {len(round_trips)}/{poses // sync_every}, round trip {avg * 1000:.1f} ms "
+          f"(fake import {import_ms} ms), heartbeat rtt {(session.rtt or 0) * 1000:.2f} ms")
+
+
+# --- Reconnect ---
+def _open_fds():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return -1
+
+
+def _flapping_server(port, stop, period):
+    # Listens for `period` seconds, closes everything for `period` seconds, repeat
+    while not stop.is_set():
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(("127.0.0.1", port))
+        server.listen(5)
+        server.settimeout(0.02)
+        clients = []
+        up_until = time.monotonic() + period
+        while time.monotonic() < up_until and not stop.is_set():
+            try:
+                client, addr = server.accept()
+                client.setblocking(False)
+                clients.append(client)
+            except socket.timeout:
+                pass
+            for client in clients:
+                try: client.recv(65536)
+                except OSError: pass
+        for client in clients:
+            client.close()
+        server.close()
+        stop.wait(period)
+
+
+def bench_reconnect(seconds=3.0, tick=0.02, period=0.3):
+    print(f"[reconnect] server flapping every {period}s, {tick * 1000:.0f} ms ticks for {seconds:.0f}s")
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    stop = threading.Event()
+    server = threading.Thread(target=_flapping_server, args=(port, stop, period))
+    server.start()
+    time.sleep(0.05)
+
+    states = []
+    manager = cas_stream.ConnectionManager("127.0.0.1", port, on_state=lambda state, reason: states.append(state))
+    fds_before = _open_fds()
+    worst = 0.0
+    sent = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        start = time.perf_counter()
+        sock = manager.poll()
+        if sock is not None:
+            try:
+                sock.sendall(b"x" * 512)
+                sent += 1
+            except OSError as e:
+                manager.disconnect(str(e))
+        worst = max(worst, time.perf_counter() - start)
+        time.sleep(tick)
+    manager.close()
+    stop.set()
+    server.join()
+
+    print(f"  {manager.stats()}, ticks with data {sent}")
+    print(f"  worst tick work {worst * 1000:.2f} ms, open fds before {fds_before} after {_open_fds()}")
+
+
+# --- Mesh Sync Cache ---
+def _fake_fbx(version, export, ascii=False, size=64 * 1024):
+    stamp = f"2026-10-17 10:00:{export:02d}:000".encode()
+    file_id = random.Random(export).randbytes(16)
+    body = random.Random(version).randbytes(size)
+    if ascii:
+        return (b"; FBX 7.4.0 project file\n; Created " + stamp + b"\n"
+                b"FBXHeaderExtension:  {\n\tCreationTimeStamp:  {\n\t\tSecond: " + str(export).encode() + b"\n\t}\n}\n"
+                b"FileId: \"" + file_id.hex().encode() + b"\"\nCreationTime: \"" + stamp + b"\"\n"
+                b"Objects:  {\n\tGeometry: \"" + body.hex().encode() + b"\"\n}\n")
+
+    def node(name, kind, value):
+        props = kind + struct.pack("<I", len(value)) + value
+        return struct.pack("<IIIB", 0, 1, len(props), len(name)) + name + props
+
+    out = bytearray(b"Kaydara FBX Binary  \x00\x1a\x00" + struct.pack("<I", 7400))
+    for name, kind, value in ((b"FileId", b"R", file_id), (b"CreationTime", b"S", stamp), (b"Objects", b"R", body)):
+        record = bytearray(node(name, kind, value))
+        struct.pack_into("<I", record, 0, len(out) + len(record))
+        out += record
+    out += bytes(13) + file_id + bytes(4) + stamp
+    return bytes(out)
+
+
+def bench_meshcache(import_ms=50):
+    print(f"[meshcache] fake exporter/importer, import {import_ms} ms")
+    import tempfile
+    import max_scene
+    sequence = ["A", "A", "A", "B", "B", "A", "C", "D", "E", "A"]
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = cas_stream.ExportCache(os.path.join(tmp, "cache"), max_bytes=3 * 65 * 1024)
+        mesh_cache = max_scene.MeshSyncCache()
+        scene = {"digest": None}
+
+        exports = itertools.count()
+
+        def exporter(version):
+            # Like a real export, the header differs every time: fresh file
+            # id and timestamp, same scene content
+            path = os.path.join(tmp, "cas_sync.fbx")
+            n = next(exports)
+            with open(path, "wb") as f:
+                f.write(_fake_fbx(version, n))
+            return path
+
+        def importer(digest):
+            def run(path):
+                assert os.path.exists(path)
+                time.sleep(import_ms / 1000.0)
+                scene["digest"] = digest
+            return run
+
+        start = time.perf_counter()
+        for version in sequence:
+            digest, path = cache.store(exporter(version))
+            mesh_cache.sync(path, digest, importer(digest), lambda: scene["digest"])
+        elapsed = time.perf_counter() - start
+
+        files = len(cache.entries())
+        ascii_digests = set()
+        for n in range(2):
+            path = os.path.join(tmp, "ascii.fbx")
+            with open(path, "wb") as f:
+                f.write(_fake_fbx("A", n, ascii=True))
+            ascii_digests.add(cas_stream.fbx_digest(path))
+        print(f"  {len(sequence)} syncs in {elapsed:.2f}s (uncached {len(sequence) * import_ms / 1000.0:.2f}s)")
+        print(f"  ASCII re-export of the same scene: {'same digest' if len(ascii_digests) == 1 else 'digest changed'}")
+        print(f"  export cache {cache.stats()}, files on disk {files}")
+        print(f"  receiver {mesh_cache.stats()}")
+
+
+# --- Incremental Sync ---
+class FakeSyncRuntime(FakeRuntime):
+    # Scene keyed by node handle. Base objects are (class, faces, verts,
+    # vertex edits) tuples, modifiers are class names.
+    Skin = "Skin"
+
+    def __init__(self, node_count):
+        self.calls = 0
+        self.deleted = 0
+        self.scene = {}
+        self.maxOps = self
+        for i in range(node_count):
+            self.add(FakeNode(f"Prop_{i:05d}", self))
+
+    @property
+    def objects(self):
+        # Every node wrapper crosses the bridge
+        self.calls += len(self.scene)
+        return list(self.scene.values())
+
+    def add(self, node):
+        self.scene[node.handle] = node
+        return node
+
+    def getNodeByName(self, name):
+        # Walks the scene natively, one bridge call
+        self.calls += 1
+        for node in self.scene.values():
+            if node.name == name: return node
+        return None
+
+    def Dummy(self, name="Dummy"):
+        self.calls += 1
+        return self.add(FakeNode(name, self))
+
+    def getNodeByHandle(self, handle):
+        self.calls += 1
+        return self.scene.get(handle)
+
+    def isValidNode(self, node):
+        self.calls += 1
+        return node is not None and node.handle in self.scene
+
+    def getUserProp(self, node, key):
+        self.calls += 1
+        return node.props.get(key)
+
+    def setUserProp(self, node, key, value):
+        self.calls += 1
+        node.props[key] = value
+
+    def classOf(self, value):
+        self.calls += 1
+        return value[0] if isinstance(value, tuple) else value
+
+    def execute(self, script):
+        super().execute(script)
+        if "casBridgeGeometryHash" in script:
+            self.casBridgeGeometryHash = self._geometry_hash
+
+    def _geometry_hash(self, base):
+        # Stand-in for the compiled MAXScript function: reads the content
+        self.calls += 1
+        return hash(base[1:]) if isinstance(base, tuple) else 0
+
+    def delete(self, nodes):
+        self.calls += 1
+        if isinstance(nodes, FakeNode): nodes = [nodes]
+        self.deleted += len(nodes)
+        for node in nodes:
+            self.scene.pop(node.handle, None)
+
+
+def _fake_import(rt, bones, meshes, changed=(), added=(), edited=()):
+    # Builds what an FBX import of the character would add to the scene
+    nodes = []
+    parent = None
+    for i in range(bones):
+        parent = FakeNode(f"Joint_{i:03d}", rt, parent)
+        nodes.append(parent)
+    for name in added:
+        nodes.append(FakeNode(name, rt, nodes[0]))
+    for i in range(meshes):
+        node = FakeNode(f"Mesh_{i}", rt)
+        faces = 1000 + (1 if f"Mesh_{i}" in changed else 0)
+        # edited: vertices moved, same counts
+        edits = 1 if f"Mesh_{i}" in edited else 0
+        object.__setattr__(node, "baseObject", ("Editable_Poly", faces, faces + 2, edits))
+        nodes.append(node)
+    for node in nodes:
+        rt.add(node)
+    return nodes
+
+
+def bench_incremental(props=20000, bones=150, meshes=5):
+    print(f"[incremental] {bones} bones + {meshes} meshes re-synced in a scene of {props} props")
+    cases = (("unchanged", (), (), ()), ("1 mesh changed", ("Mesh_2",), (), ()),
+             ("1 mesh edited", (), (), ("Mesh_2",)), ("1 bone added", (), ("Joint_extra",), ()))
+    for label, changed, added, edited in cases:
+        # Replace: delete the previous sync, keep the whole fresh import
+        rt = FakeSyncRuntime(props)
+        previous = _fake_import(rt, bones, meshes)
+        root = FakeNode("CAS_SCALE_ROOT", rt)
+        rt.calls = 0
+        start = time.perf_counter()
+        rt.delete(previous + [root])
+        imported = _fake_import(rt, bones, meshes, changed, added, edited)
+        root = FakeNode("CAS_SCALE_ROOT", rt)
+        for node in imported:
+            if node.parent is None: node.parent = root
+        replace_time = time.perf_counter() - start
+        replace = (rt.deleted, len(imported), rt.calls)
+        rt.calls = 0
+
+        rt = FakeSyncRuntime(props)
+        previous = _fake_import(rt, bones, meshes)
+        root = FakeNode("CAS_SCALE_ROOT", rt)
+        for node in previous:
+            if node.parent is None: node.parent = root
+        sync = max_scene.IncrementalSync(rt)
+        rt.calls = 0
+        start = time.perf_counter()
+        imported = _fake_import(rt, bones, meshes, changed, added, edited)
+        kept = sync.merge(previous, imported, root)
+        for node in kept:
+            if node.parent is None: node.parent = root
+        incremental_time = time.perf_counter() - start
+        survived = sum(1 for node in previous if node.handle in rt.scene)
+        # Every mesh in the scene must now carry the imported content
+        fresh = {node.name: node.baseObject for node in imported}
+        stale = [node.name for node in previous if node.handle in rt.scene and node.baseObject != fresh.get(node.name)]
+
+        print(f"  {label:15s} replace:     {replace[0]} deleted, {replace[1]} new nodes kept, 0 synced nodes survive, {replace[2]} calls, {replace_time * 1000:.2f} ms")
+        print(f"  {'':15s} incremental: {rt.deleted} deleted, {len(kept)} new nodes kept, {survived} synced nodes survive, {rt.calls} calls, {incremental_time * 1000:.2f} ms")
+        print(f"  {'':15s} {sync.stats()}, stale geometry left: {stale or 'none'}")
+
+
+
+# --- Sync Registry ---
+def _synced_scene(props, bones, meshes):
+    rt = FakeSyncRuntime(props)
+    nodes = _fake_import(rt, bones, meshes)
+    root = rt.Dummy("CAS_SCALE_ROOT")
+    for node in nodes + [root]:
+        node.props[max_scene.SYNC_TAG] = True
+        if node.parent is None and node is not root:
+            object.__setattr__(node, "parent", root)
+    registry = max_scene.SyncRegistry(rt)
+    registry.register(root, nodes)
+    registry.clear()
+    return rt, registry
+
+
+def bench_registry(sizes=(1000, 10000, 50000), bones=150, meshes=5):
+    print(f"[registry] cleanup + import bookkeeping for {bones} bones + {meshes} meshes vs scene size")
+    for props in sizes:
+        # Old path: tag scan, then a set diff around the import
+        rt, _ = _synced_scene(props, bones, meshes)
+        rt.calls = 0
+        start = time.perf_counter()
+        synced = [obj for obj in rt.objects if rt.getUserProp(obj, max_scene.SYNC_TAG) == True]
+        existing = set(rt.objects)
+        scan_time = time.perf_counter() - start
+        _fake_import(rt, bones, meshes)
+        start = time.perf_counter()
+        imported = [obj for obj in rt.objects if obj not in existing]
+        scan_time += time.perf_counter() - start
+        scan_calls = rt.calls
+        assert len(synced) == bones + meshes + 1 and len(imported) == bones + meshes
+
+        # Registry: handles stored on the root, handle range around the import
+        rt, registry = _synced_scene(props, bones, meshes)
+        rt.calls = 0
+        start = time.perf_counter()
+        synced = registry.nodes()
+        mark = registry.mark()
+        registry_time = time.perf_counter() - start
+        _fake_import(rt, bones, meshes)
+        start = time.perf_counter()
+        imported = registry.created_since(mark)
+        registry_time += time.perf_counter() - start
+        assert len(synced) == bones + meshes and len(imported) == bones + meshes
+
+        print(f"  {props:6d} props: scan {scan_time * 1000:8.2f} ms {scan_calls:7d} calls | registry {registry_time * 1000:6.2f} ms {rt.calls:5d} calls {registry.stats()}")
+
+    # Scene merged into another one: every handle renumbered, the stored
+    # ones now belong to the user's own nodes
+    rt, registry = _synced_scene(1000, bones, meshes)
+    synced = [node for node in rt.scene.values() if node.props.get(max_scene.SYNC_TAG) and node.name != "CAS_SCALE_ROOT"]
+    for node in synced:
+        old = node.handle
+        del rt.scene[old]
+        object.__setattr__(node, "handle", next(FakeNode._handles))
+        rt.add(node)
+        user = FakeNode(f"User_{old}", rt)
+        object.__setattr__(user, "handle", old)
+        rt.add(user)
+    found = registry.nodes()
+    foreign = [node.name for node in found if node.name.startswith("User_")]
+    print(f"  renumbered handles: {len(found)}/{len(synced)} synced nodes found, {len(foreign)} unrelated nodes taken, {registry.stats()}")
+
+
+
+# --- Capture / Replay ---
+def record_fake_capture(path, kind="scrub", joints=150, ticks=600, rate=0.02):
+    # Encodes a fake session the way CasBridgeCore.encode_pose does
+    names, _, _ = fake_pose(joints)
+    tracker = cas_stream.DeltaTracker()
+    writer = cas_capture.CaptureWriter(path, {"format": cas_protocol.FORMAT_BINARY, "framed": True})
+    layout = cas_protocol.frame(cas_protocol.encode_layout(1, names))
+    for t, pos, rot in fake_session(kind, joints, ticks):
+        flags = cas_capture.REC_LAYOUT if t == 0 else 0
+        keyframe, indices = tracker.update(pos, rot)
+        if keyframe:
+            flags |= cas_capture.REC_KEYFRAME
+            msg = cas_protocol.frame(cas_protocol.encode_pose(1, t, pos, rot))
+        elif indices:
+            sub_pos, sub_rot = cas_stream.pick_joints(pos, rot, indices)
+            msg = cas_protocol.frame(cas_protocol.encode_pose(1, t, sub_pos, sub_rot, indices))
+        else:
+            continue
+        writer.write(layout + msg if t == 0 else msg, t, flags, timestamp=t * rate)
+    writer.close()
+    return writer
+
+
+def _replay_receiver(server, names, result):
+    # Mirrors ServerWorker + update_scene_live on a stub runtime, applying
+    # every frame as it arrives
+    rt = FakeRuntime(5000, names)
+    cache = max_scene.NodeCache(rt)
+    applier = max_scene.PoseApplier(rt, cache)
+    conversion = max_stream.AxisConversion(scale=2.54)
+    client, addr = server.accept()
+    session = cas_protocol.Session(client, framed=False)
+    reader = session.reader
+    layouts = {}
+    decode_time = apply_time = 0.0
+    frames = 0
+    first = last = None
+    with client:
+        while reader.recv_from(client):
+            for channel, payload in reader.messages():
+                if not cas_protocol.is_binary(payload):
+                    packet = json.loads(bytes(payload).decode('utf-8'))
+                    if packet.get("command") == "HELLO":
+                        session.send_raw(cas_protocol.hello_reply(packet))
+                        reader.framed = True
+                    continue
+                start = time.perf_counter()
+                pose = cas_protocol.decode_binary(payload, layouts)
+                decoded = time.perf_counter()
+                decode_time += decoded - start
+                if pose is None: continue
+                pos, rot = conversion.convert(pose)
+                nodes = [cache.get(pose.names[i]) for i in pose.joints()]
+                applier.apply(nodes, pos, rot)
+                apply_time += time.perf_counter() - decoded
+                frames += 1
+                if first is None: first = decoded
+                last = time.perf_counter()
+    result.update(frames=frames, decode=decode_time, apply=apply_time,
+                  span=(last - first) if frames else 0.0, bytes=reader.bytes_received)
+
+
+def bench_replay(joints=150, ticks=600):
+    print(f"[replay] capture of {ticks} ticks x {joints} joints replayed into a stub receiver")
+    import tempfile
+    names, _, _ = fake_pose(joints)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "session" + cas_capture.CAPTURE_EXT)
+        writer = record_fake_capture(path, joints=joints, ticks=ticks)
+        print(f"  recorded {writer.stats()}, {os.path.getsize(path) / 1024:.0f} KB on disk")
+
+        with cas_capture.CaptureReader(path) as reader:
+            offset, layout_offset = reader.seek(ticks // 2)
+            frame = reader.record_at(offset)[1]
+            data_end = reader.data_end
+            print(f"  index: {len(reader.index)} keyframes, seek({ticks // 2}) -> keyframe at frame {frame}, layout record at {layout_offset}")
+
+            for speed in (0.0, 10.0):
+                server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                server.bind(("127.0.0.1", 0))
+                server.listen(1)
+                result = {}
+                t = threading.Thread(target=_replay_receiver, args=(server, names, result))
+                t.start()
+                sock = socket.create_connection(server.getsockname())
+                sock.sendall(cas_protocol.hello_packet())
+                cas_protocol.parse_hello_reply(sock.recv(1024))
+                sent, sent_bytes, seconds = cas_capture.replay(reader, sock.sendall, speed)
+                sock.close()
+                t.join()
+                server.close()
+
+                frames = result["frames"] or 1
+                label = "max speed" if speed == 0 else f"{speed:g}x"
+                print(f"  {label:<9} sent {sent} records in {seconds:.2f}s, received {result['frames']} frames "
+                      f"({result['frames'] / max(result['span'], 1e-9):.0f} frames/s)")
+                print(f"  {'':9} decode {result['decode'] / frames * 1e6:7.1f} us/frame, apply {result['apply'] / frames * 1e6:7.1f} us/frame")
+
+        # A sender that crashed leaves no index and maybe half a record
+        with open(path, "r+b") as f:
+            f.truncate(data_end - 7)
+        with cas_capture.CaptureReader(path) as reader:
+            print(f"  truncated file: {len(reader.index)} keyframes recovered by scanning")
+
+
+
+# --- Record Mode ---
+def bench_take(joints=150, ticks=1000):
+    print(f"[take] record {ticks} ticks x {joints} joints, reduce and bake")
+    from array import array
+    names, _, _ = fake_pose(joints)
+    for kind in ("scrub", "playback"):
+        take = max_stream.TakeBuffer()
+        tracker = cas_stream.DeltaTracker()
+        truth = {}
+        start = time.perf_counter()
+        for t, pos, rot in fake_session(kind, joints, ticks):
+            truth[t] = (array("f", pos), array("f", rot))
+            keyframe, indices = tracker.update(pos, rot)
+            if keyframe:
+                take.add(cas_protocol.PoseFrame(t, names, pos, rot))
+            elif indices:
+                sub_pos, sub_rot = cas_stream.pick_joints(pos, rot, indices)
+                take.add(cas_protocol.PoseFrame(t, names, sub_pos, sub_rot, indices))
+            else:
+                # Nothing moved: the sender skips the tick, so does the take
+                truth.pop(t)
+        buffer_time = (time.perf_counter() - start) / ticks
+        stats = take.stats()
+
+        segments = take.take()
+        poses = segments[0].ordered()
+        # Deltas are folded in, so buffered frames match what was sampled
+        # (within the sender's delta epsilon)
+        exact = max(max(abs(a - b) for a, b in zip(p.pos, truth[p.frame][0])) for p in poses)
+
+        conversion = max_stream.AxisConversion(scale=2.54)
+        rt = FakeRuntime(0, names)
+        cache = max_scene.NodeCache(rt)
+        baker = max_scene.KeyBaker(rt, cache)
+        nodes = [cache.get(name) for name in names]
+        # The last bone already has keys in an Euler controller: it is keyed on every frame
+        nodes[-1].__dict__["keyed"] = True
+        start = time.perf_counter()
+        times = [p.frame for p in poses]
+        world_pos, world_rot = [], []
+        for p in poses:
+            cpos, crot = conversion.convert(p)
+            world_pos.append(cpos)
+            # fake_session scribbles on quaternion components; a real rig's are unit
+            world_rot.append([c for r in range(0, len(crot), 4) for c in max_stream._quat_normalize(crot[r:r + 4])])
+        parents, spaces = baker.parent_spaces(nodes)
+        reducible = baker.key_modes(nodes)
+        prepare_time = time.perf_counter() - start
+        # Parent spaces and reduction run on their own thread; the main thread
+        # keeps ticking like the dialog's event loop, its longest wait is what
+        # the UI feels
+        segment = {"times": times, "pos_frames": world_pos, "rot_frames": world_rot,
+                   "exact": [not ok for ok in reducible], "parents": parents, "spaces": spaces}
+        job = max_stream.ReductionJob([segment])
+        stall = 0.0
+        tick = time.perf_counter()
+        while not job.done():
+            time.sleep(0.001)
+            now = time.perf_counter()
+            stall = max(stall, now - tick)
+            tick = now
+        job.wait()
+        keep = job.keep[0]
+        pos_frames, rot_frames = segment["pos_frames"], segment["rot_frames"]
+
+        # Play the keys back as the Linear controllers do (lerp in parent
+        # space, slerp rotations) and compare with every buffered frame
+        err_pos = err_rot = 0.0
+        play_pos = [[None] * joints for _ in times]
+        play_rot = [[None] * joints for _ in times]
+        for j, kept in enumerate(keep):
+            for a, b in zip(kept, kept[1:]):
+                pa, pb = pos_frames[a][j * 3:j * 3 + 3], pos_frames[b][j * 3:j * 3 + 3]
+                qa, qb = rot_frames[a][j * 4:j * 4 + 4], rot_frames[b][j * 4:j * 4 + 4]
+                for f in range(a, b + 1):
+                    w = (times[f] - times[a]) / (times[b] - times[a])
+                    play_pos[f][j] = tuple(x + (y - x) * w for x, y in zip(pa, pb))
+                    play_rot[f][j] = max_stream.quat_slerp(qa, qb, w)
+                    err_pos = max(err_pos, max(abs(x - y) for x, y in zip(play_pos[f][j], pos_frames[f][j * 3:j * 3 + 3])))
+                    err_rot = max(err_rot, max(abs(x - y) for x, y in zip(play_rot[f][j], rot_frames[f][j * 4:j * 4 + 4])))
+        # ... and the world pose that plays back down the hierarchy
+        err_world = 0.0
+        for f in range(len(times)):
+            wpos, wrot = [None] * joints, [None] * joints
+            for j, parent in enumerate(parents):
+                if parent < 0:
+                    wpos[j], wrot[j] = play_pos[f][j], play_rot[f][j]
+                else:
+                    offset = max_stream.quat_rotate(wrot[parent], play_pos[f][j])
+                    wpos[j] = tuple(x + y for x, y in zip(wpos[parent], offset))
+                    wrot[j] = max_stream.quat_mul(wrot[parent], play_rot[f][j])
+                err_world = max(err_world, sum((x - y) ** 2 for x, y in zip(wpos[j], world_pos[f][j * 3:j * 3 + 3])) ** 0.5)
+
+        rt.calls = 0
+        start = time.perf_counter()
+        written = baker.bake(nodes, times, pos_frames, rot_frames, keep)
+        bake_time = time.perf_counter() - start
+
+        full = len(times) * joints
+        print(f"  {kind:<9} buffered {stats['frames']} frames, {stats['memory_kb']} KB, {buffer_time * 1e6:.1f} us/frame, max diff vs sampled {exact:.1e}")
+        print(f"  {'':9} keys {full} -> {written} ({written / full:.0%}), prepare {prepare_time * 1000:.0f} ms, "
+              f"reduce {job.elapsed * 1000:.0f} ms on its thread (main thread max stall {stall * 1000:.1f} ms), "
+              f"bake {bake_time * 1000:.1f} ms in {rt.calls} bridge calls")
+        print(f"  {'':9} max error vs played-back keys: local pos {err_pos:.4f} rot {err_rot:.5f}, "
+              f"world pos {err_world:.4f} (tolerance {max_stream.KEY_POS_TOLERANCE})")
+        print(f"  {'':9} bone with its own keyed controller: {len(keep[-1])}/{len(times)} frames keyed")
+
+
+
+# --- Bulk Transfer ---
+def _bulk_receiver(server, names, write_ms, result):
+    # Mirrors ServerWorker + CasLiveDialog: blocks are converted, baked on a
+    # stub runtime and acked once written
+    rt = FakeRuntime(0, names)
+    cache = max_scene.NodeCache(rt)
+    baker = max_scene.KeyBaker(rt, cache)
+    conversion = max_stream.AxisConversion(scale=2.54)
+    client, addr = server.accept()
+    session = cas_protocol.Session(client, framed=False)
+    reader = session.reader
+    layouts = {}
+    frames = keys = 0
+    write_time = 0.0
+    with client:
+        while reader.recv_from(client):
+            for channel, payload in reader.messages():
+                if cas_protocol.is_binary(payload):
+                    block = cas_protocol.decode_binary(payload, layouts)
+                    if block is None: continue
+                    start = time.perf_counter()
+                    poses = block.poses()
+                    pos_frames, rot_frames = zip(*(conversion.convert(p) for p in poses))
+                    times = [p.frame for p in poses]
+                    nodes = [cache.get(n) for n in block.names]
+                    pos_frames, rot_frames = max_stream.local_frames(*baker.parent_spaces(nodes), pos_frames, rot_frames)
+                    keys += baker.bake(nodes, times, pos_frames, rot_frames, [range(len(times))] * len(nodes))
+                    if write_ms: time.sleep(write_ms / 1000.0)
+                    write_time += time.perf_counter() - start
+                    frames += len(poses)
+                    session.ack({"id": block.block_id}, True)
+                    continue
+                packet = json.loads(bytes(payload).decode('utf-8'))
+                if packet.get("command") == "HELLO":
+                    session.send_raw(cas_protocol.hello_reply(packet))
+                    reader.framed = True
+                elif packet.get("command") in ("BULK_BEGIN", "BULK_END"):
+                    session.ack(packet, True)
+    result.update(frames=frames, keys=keys, write=write_time, received=reader.bytes_received)
+
+
+def bench_transfer(frames=2000, joints=150):
+    print(f"[transfer] {frames} frames x {joints} joints, fake Cascadeur sampler -> fake Max baker")
+    from array import array
+    names, pos, rot = fake_pose(joints)
+    rnd = random.Random(5)
+    # Smooth motion, like an animation curve
+    velocity = [rnd.uniform(-0.05, 0.05) for _ in pos]
+    pos = array("f", pos)
+    rot = array("f", rot)
+
+    def sample(frame):
+        for i in range(len(pos)):
+            pos[i] += velocity[i]
+        return pos, rot
+
+    print(f"  live link at 50 fps would take {frames / 50.0:.1f}s")
+    for level, block_frames, write_ms, precision in ((0, 64, 0, None), (1, 64, 0, None), (6, 64, 0, None), (1, 16, 0, None),
+                                                     (1, 64, 0, (16, 10)), (1, 64, 20, None)):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        result = {}
+        t = threading.Thread(target=_bulk_receiver, args=(server, names, write_ms, result))
+        t.start()
+        sock = socket.create_connection(server.getsockname())
+        sock.sendall(cas_protocol.hello_packet())
+        cas_protocol.parse_hello_reply(sock.recv(1024))
+        session = cas_protocol.Session(sock)
+        peak = [0]
+
+        def progress(done, total, transfer):
+            peak[0] = max(peak[0], len(transfer.in_flight))
+
+        transfer = cas_stream.BlockTransfer(session, 1, names, block_frames=block_frames, level=level, progress=progress,
+                                            precision=precision)
+        stats = transfer.run(0, frames - 1, sample)
+        sock.close()
+        t.join()
+        server.close()
+        slow = f", receiver +{write_ms} ms/block" if write_ms else ""
+        slow += f", quantized {precision[0]}/{precision[1]} bits" if precision else ""
+        print(f"  zlib {level} x{block_frames}{slow}: {stats['fps']:8.0f} frames/s {stats['mb_per_s']:6.2f} MB/s on the wire, "
+              f"ratio {stats['ratio']:.2f}, stalled {stats['stall_s']:.2f}s, peak in flight {peak[0]}/{transfer.window}")
+        print(f"  {'':10} receiver: {result['frames']} frames, {result['keys']} keys, write {result['write'] / max(result['frames'], 1) * 1e6:.0f} us/frame")
+
+
+
+# --- Quantized Encoding ---
+def _random_pose(joints, rnd, spread=150.0):
+    import math
+    from array import array
+    pos = array("f", [rnd.uniform(-spread, spread) for _ in range(joints * 3)])
+    rot = array("f")
+    for _ in range(joints):
+        q = [rnd.gauss(0.0, 1.0) for _ in range(4)]
+        n = math.sqrt(sum(v * v for v in q))
+        rot.extend(v / n for v in q)
+    return pos, rot
+
+
+def _pose_errors(pos, rot, decoded):
+    import math
+    pos_err = max(abs(a - b) for a, b in zip(pos, decoded.pos))
+    ang_err = 0.0
+    for r in range(0, len(rot), 4):
+        # From the chord between the quaternions; acos of the dot product
+        # drowns small angles in float32 rounding
+        plus = math.sqrt(sum((rot[r + c] - decoded.rot[r + c]) ** 2 for c in range(4)))
+        minus = math.sqrt(sum((rot[r + c] + decoded.rot[r + c]) ** 2 for c in range(4)))
+        ang_err = max(ang_err, 4.0 * math.asin(min(1.0, min(plus, minus) / 2.0)))
+    return pos_err, ang_err
+
+
+def bench_quant(joints=150, poses=50, repeat=20):
+    import math
+    print(f"[quant] {joints} joints, {poses} random poses per setting, errors checked against the bounds")
+    rnd = random.Random(11)
+    names = tuple(f"Joint_{i:03d}" for i in range(joints))
+    samples = [_random_pose(joints, rnd) for _ in range(poses)]
+    layouts = {}
+    cas_protocol.decode_binary(cas_protocol.encode_layout(1, names), layouts)
+
+    pos, rot = samples[0]
+    raw = cas_protocol.encode_pose(1, 0, pos, rot)
+    report("float32 encode", timed(lambda: cas_protocol.encode_pose(1, 0, pos, rot), repeat), len(raw))
+    report("float32 decode", timed(lambda: cas_protocol.decode_binary(raw, layouts), repeat))
+
+    for pos_bits, rot_bits in ((12, 8), (16, 10), (20, 14), (24, 20)):
+        quantizer = cas_protocol.Quantizer.around(pos, 200.0, pos_bits, rot_bits)
+        cas_protocol.decode_binary(cas_protocol.encode_range(1, quantizer), layouts)
+        worst_pos = worst_ang = 0.0
+        size = 0
+        for p, r in samples:
+            msg = cas_protocol.encode_qpose(1, 0, p, r, quantizer)
+            size += len(msg)
+            pe, ae = _pose_errors(p, r, cas_protocol.decode_binary(msg, layouts))
+            worst_pos = max(worst_pos, pe)
+            worst_ang = max(worst_ang, ae)
+        msg = cas_protocol.encode_qpose(1, 0, pos, rot, quantizer)
+        enc = timed(lambda: cas_protocol.encode_qpose(1, 0, pos, rot, quantizer), repeat)
+        dec = timed(lambda: cas_protocol.decode_binary(msg, layouts), repeat)
+        ok = worst_pos <= quantizer.pos_error() and worst_ang <= quantizer.rot_error()
+        print(f"  pos {pos_bits:2d}b rot {rot_bits:2d}b: {size / poses:6.0f} B/pose ({size / poses / len(raw):.0%}), "
+              f"enc {enc * 1e6:6.0f} us dec {dec * 1e6:6.0f} us, max pos err {worst_pos:.5f} (bound {quantizer.pos_error():.5f}), "
+              f"max angle {math.degrees(worst_ang):.4f} deg (bound {math.degrees(quantizer.rot_error()):.4f}), within bounds {ok}")
+
+    # Batched frames: smooth motion compresses far better than random poses
+    frames = 64
+    from array import array
+    pos_block = array("f")
+    rot_block = array("f")
+    p = array("f", pos)
+    for f in range(frames):
+        for i in range(len(p)):
+            p[i] += 0.05
+        pos_block.extend(p)
+        rot_block.extend(rot)
+    float_block = cas_protocol.encode_block(1, 1, 0, frames, pos_block, rot_block, 0)
+    for level, quantizer in ((1, None), (0, cas_protocol.Quantizer.around(pos_block, 0.0)), (1, cas_protocol.Quantizer.around(pos_block, 0.0))):
+        block = cas_protocol.encode_block(1, 1, 0, frames, pos_block, rot_block, level, quantizer)
+        label = ("quantized" if quantizer else "float32") + f" zlib {level}"
+        enc = timed(lambda: cas_protocol.encode_block(1, 1, 0, frames, pos_block, rot_block, level, quantizer), 3)
+        dec = timed(lambda: cas_protocol.decode_binary(block, layouts), 3)
+        print(f"  block of {frames} frames, {label:<16} {len(block) / frames:7.0f} B/frame ({len(block) / len(float_block):.0%} of raw float32), "
+              f"enc {enc / frames * 1e6:5.0f} us/frame dec {dec / frames * 1e6:5.0f} us/frame")
+
+
+# --- Pacing ---
+class _SlowReceiver:
+    # Event simulation of the Max side on a virtual clock: poses arrive after
+    # `latency`, the mailbox keeps only the newest, applying one takes apply_s
+    # and FEEDBACK reports travel back with the same latency.
+    def __init__(self, now, apply_s, latency=0.002):
+        self.now = now
+        self.apply_s = apply_s
+        self.latency = latency
+        self.wire = collections.deque()
+        self.pending = None
+        self.busy_until = 0.0
+        self.applied = 0
+        self.dropped = 0
+        self.clock_at = 0.0
+        self.feedback = max_stream.ApplyFeedback(clock=lambda: self.clock_at)
+        self.reports = collections.deque()
+
+    def deliver(self):
+        self.wire.append(self.now[0] + self.latency)
+
+    def advance(self):
+        t = self.now[0]
+        while True:
+            arrival = self.wire[0] if self.wire else float("inf")
+            start = max(self.busy_until, self.pending) if self.pending is not None else float("inf")
+            if min(arrival, start) > t: break
+            if arrival <= start:
+                self.wire.popleft()
+                if self.pending is not None:
+                    self.dropped += 1
+                self.pending = arrival
+            else:
+                self.pending = None
+                self.busy_until = start + self.apply_s
+                self.clock_at = self.busy_until
+                self.applied += 1
+                report = self.feedback.record(self.applied, self.apply_s, self.dropped)
+                if report is not None:
+                    self.reports.append((self.busy_until + self.latency, report))
+
+    def reports_until(self, t):
+        while self.reports and self.reports[0][0] <= t:
+            yield self.reports.popleft()[1]
+
+
+def _paced_run(pacer, receiver, now, seconds, work_s=0.002):
+    end = now[0] + seconds
+    sent = applied = dropped = 0
+    applied0, dropped0 = receiver.applied, receiver.dropped
+    while now[0] < end:
+        pacer.wait()
+        receiver.advance()
+        for report in receiver.reports_until(now[0]):
+            pacer.feedback(report)
+        now[0] += work_s
+        receiver.deliver()
+        pacer.sent()
+        sent += 1
+    receiver.advance()
+    return sent / seconds, (receiver.applied - applied0) / seconds, (receiver.dropped - dropped0) / seconds
+
+
+def bench_pacing(seconds=4.0):
+    print("[pacing] sender against a simulated receiver that slows down to 15 fps, then speeds up")
+    phases = (("slow 66 ms", 1 / 15.0), ("fast 4 ms", 0.004))
+    for adaptive in (False, True):
+        now = [0.0]
+        pacer = cas_stream.FramePacer(50.0, adaptive=adaptive, clock=lambda: now[0],
+                                      sleep=lambda d: now.__setitem__(0, now[0] + d))
+        receiver = _SlowReceiver(now, phases[0][1])
+        for label, apply_s in phases:
+            receiver.apply_s = apply_s
+            # Settle, then measure the steady state
+            _paced_run(pacer, receiver, now, seconds / 2)
+            sent, applied, dropped = _paced_run(pacer, receiver, now, seconds / 2)
+            name = "adaptive" if adaptive else "fixed 50/s"
+            print(f"  {name:<10} {label:<11} rate {pacer.rate:6.1f}/s  sent {sent:6.1f}/s  applied {applied:5.1f}/s  "
+                  f"dropped {dropped:5.1f}/s")
+        print(f"  {'':10} {pacer.stats()}")
+
+    # Real clock: fixed sleeps add the work time on top, the pacer does not
+    work_s = 0.004
+    for label, period in (("sleep(period)", 0.01), ("FramePacer", 0.01)):
+        ticks = 0
+        pacer = cas_stream.FramePacer(1.0 / period, 1.0, 1000.0, adaptive=False)
+        start = time.monotonic()
+        while time.monotonic() - start < 1.0:
+            if label == "FramePacer":
+                pacer.wait()
+            else:
+                time.sleep(period)
+            busy = time.perf_counter() + work_s
+            while time.perf_counter() < busy: pass
+            ticks += 1
+        elapsed = time.monotonic() - start
+        print(f"  real clock {label:<14} target {1 / period:.0f}/s with {work_s * 1000:.0f} ms work: {ticks / elapsed:6.1f}/s")
+
+
+# --- Redraw ---
+class FakeViewRuntime(FakeRuntime):
+    # Four viewports on a virtual clock: a redraw costs view_s per enabled
+    # view, applying a pose apply_s
+    def __init__(self, bone_names, now, view_s, apply_s):
+        super().__init__(0, bone_names)
+        self.now = now
+        self.view_s = view_s
+        self.apply_s = apply_s
+        self.enabled = [True] * 4
+        self.active = 0
+        self.redraw_calls = 0
+        self.views_drawn = 0
+
+    def execute(self, script):
+        super().execute(script)
+        if "casBridgeDisableInactiveViews" in script:
+            self.casBridgeDisableInactiveViews = self._disable_inactive
+            self.casBridgeEnableViews = self._enable_views
+
+    def _disable_inactive(self):
+        self.calls += 1
+        disabled = [i + 1 for i, on in enumerate(self.enabled) if on and i != self.active]
+        for i in disabled:
+            self.enabled[i - 1] = False
+        return disabled
+
+    def _enable_views(self, ids):
+        self.calls += 1
+        for i in ids:
+            self.enabled[i - 1] = True
+        return len(ids)
+
+    def _apply_pose(self, nodes, values):
+        self.now[0] += self.apply_s
+        return super()._apply_pose(nodes, values)
+
+    def redrawViews(self):
+        self.calls += 1
+        self.redraw_calls += 1
+        views = sum(self.enabled)
+        self.views_drawn += views
+        self.now[0] += self.view_s * views
+
+
+def bench_redraw(joints=150, hz=200, seconds=2.0, view_ms=4.0, apply_ms=1.0):
+    print(f"[redraw] {hz} Hz input for {seconds:.0f}s ({joints} joints, still for the second half), "
+          f"4 views x {view_ms:.0f} ms redraw, {apply_ms:.0f} ms apply")
+    names, pos, rot = fake_pose(joints)
+    ticks = int(hz * seconds)
+    stream = []
+    for t in range(ticks):
+        moving = t < ticks // 2
+        p = array("f", pos)
+        if moving:
+            p[0] += t * 0.1
+        else:
+            p[0] += (ticks // 2 - 1) * 0.1
+        stream.append((t / hz, cas_protocol.PoseFrame(1 if not moving else t, names, p, array("f", rot))))
+
+    for label, fps, skip, active_only in (("every pose", 0, False, False),
+                                          ("capped 30", 30.0, True, False),
+                                          ("capped 30, active", 30.0, True, True)):
+        now = [0.0]
+        rt = FakeViewRuntime(names, now, view_ms / 1000.0, apply_ms / 1000.0)
+        cache = max_scene.NodeCache(rt)
+        applier = max_scene.PoseApplier(rt, cache)
+        scheduler = max_scene.RedrawScheduler(rt, fps, active_only, clock=lambda: now[0])
+        nodes = [cache.get(name) for name in names]
+        live = None
+        timer = None
+        applied = dropped = 0
+        k = 0
+        while k < len(stream):
+            # The mailbox hands over the newest pose that has arrived
+            arrived, pose = stream[k]
+            if timer is not None and timer <= arrived:
+                now[0] = max(now[0], timer)
+                timer = None
+                delay = scheduler.flush()
+                if delay > 0: timer = now[0] + delay
+                continue
+            now[0] = max(now[0], arrived)
+            while k + 1 < len(stream) and stream[k + 1][0] <= now[0]:
+                k += 1
+                dropped += 1
+            pose = stream[k][1]
+            k += 1
+            if skip and cas_protocol.same_pose(live, pose):
+                scheduler.applied(0.0, changed=False)
+            else:
+                start = now[0]
+                applier.apply(nodes, pose.pos, pose.rot)
+                live = pose
+                applied += 1
+                scheduler.applied(now[0] - start)
+            delay = scheduler.flush()
+            if delay > 0 and timer is None:
+                timer = now[0] + delay
+        if timer is not None:
+            now[0] = max(now[0], timer)
+            scheduler.flush()
+        scheduler.restore()
+        stats = scheduler.stats()
+        busy = (stats["apply_s"] + stats["redraw_s"]) / now[0]
+        print(f"  {label:<18} redraws {rt.redraw_calls:4d} ({rt.views_drawn:4d} views)  applied {applied:4d} dropped {dropped:4d}  "
+              f"apply {stats['apply_s'] * 1000 / now[0]:6.1f} ms/s redraw {stats['redraw_s'] * 1000 / now[0]:6.1f} ms/s  "
+              f"busy {busy:.0%}  last pose drawn {not scheduler.dirty}  views restored {all(rt.enabled)}")
+
+
+# --- Stats ---
+def _stamped_receiver(server, stats, result):
+    # Mirrors ServerWorker and drain_mailbox with stamps: decode, transit
+    # from the stamp, a 1 ms apply, latency and FEEDBACK back to the sender
+    client, addr = server.accept()
+    session = cas_protocol.Session(client, framed=False)
+    reader = session.reader
+    layouts = {}
+    feedback = max_stream.ApplyFeedback(interval=0.05)
+    applied = 0
+    with client:
+        while reader.recv_from(client):
+            for channel, payload in reader.messages():
+                if not cas_protocol.is_binary(payload):
+                    packet = json.loads(bytes(payload).decode("utf-8"))
+                    if packet.get("command") == "HELLO":
+                        session.send_raw(cas_protocol.hello_reply(packet))
+                        reader.framed = True
+                    continue
+                start = stats.now()
+                pose = cas_protocol.decode_binary(payload, layouts)
+                if pose is None: continue
+                stats.since("decode", start)
+                sent = layouts.pop("stamp", None)
+                stats.add("recv", time.time() - sent)
+                start = stats.now()
+                busy = time.perf_counter() + 0.001
+                while time.perf_counter() < busy: pass
+                stats.since("apply", start)
+                stats.add("latency", time.time() - sent)
+                applied += 1
+                report = feedback.record(pose.frame, 0.001, 0, sent)
+                if report is not None:
+                    session.send_json(report)
+    result["applied"] = applied
+
+
+def bench_stats(joints=150, repeat=5000, poses=300):
+    print(f"[stats] instrumentation cost per pose and stamped end-to-end latency ({joints} joints)")
+    names, pos, rot = fake_pose(joints)
+    pos = array("f", pos)
+    rot = array("f", rot)
+
+    # The sender's hot path: three timed stages and two counters per pose
+    def hot_path(stats):
+        start = stats.now()
+        stats.since("sample", start)
+        start = stats.now()
+        msg = cas_protocol.encode_pose(1, 0, pos, rot)
+        stats.since("encode", start)
+        start = stats.now()
+        stats.since("send", start)
+        stats.count("packets")
+        stats.count("bytes", len(msg))
+
+    base = timed(lambda: cas_protocol.encode_pose(1, 0, pos, rot), repeat)
+    report("encode only", base)
+    for label, stats in (("disabled", cas_stats.Instruments(False)),
+                         ("enabled", cas_stats.Instruments(True, trace=0)),
+                         ("enabled + trace", cas_stats.Instruments(True))):
+        seconds = timed(lambda: hot_path(stats), repeat)
+        print(f"  {label:<28} {seconds * 1e6:10.1f} us   overhead {(seconds - base) * 1e6:5.2f} us per pose, "
+              f"{(seconds - base) / 0.02:.3%} of a 20 ms tick")
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    receiver_stats = cas_stats.Instruments(True)
+    result = {}
+    t = threading.Thread(target=_stamped_receiver, args=(server, receiver_stats, result))
+    t.start()
+    sock = socket.create_connection(server.getsockname())
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)   # as ConnectionManager does
+    sock.sendall(cas_protocol.hello_packet())
+    reply = sock.recv(1024)
+    stamps = cas_protocol.FEATURE_STAMPS in cas_protocol.parse_hello_features(reply)
+    session = cas_protocol.Session(sock)
+    sender_stats = cas_stats.Instruments(True)
+    session.send_raw(cas_protocol.frame(cas_protocol.encode_layout(1, names)))
+    for i in range(poses):
+        sampled_at = time.time()
+        start = sender_stats.now()
+        msg = cas_protocol.frame(cas_protocol.encode_pose(1, i, pos, rot))
+        sender_stats.since("encode", start)
+        start = sender_stats.now()
+        session.send_raw(cas_protocol.frame(cas_protocol.encode_stamp(sampled_at)) + msg)
+        sender_stats.since("send", start)
+        session.poll(0)
+        while session.inbox:
+            _, packet = session.inbox.popleft()
+            if packet.get("t") is not None:
+                sender_stats.add("latency", time.time() - packet["t"])
+        time.sleep(0.002)
+    time.sleep(0.1)
+    session.poll(0.1)
+    sock.close()
+    t.join()
+    server.close()
+
+    print(f"  receiver lists stamps {stamps}, applied {result.get('applied')}/{poses}")
+    for side, stats in (("sender", sender_stats), ("receiver", receiver_stats)):
+        for line in stats.lines():
+            print(f"  {side:<9} {line}")
+
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_stats")
+    os.makedirs(folder, exist_ok=True)
+    paths = receiver_stats.export(os.path.join(folder, "receiver.json"))
+    paths += receiver_stats.export(os.path.join(folder, "receiver.csv"))
+    with open(paths[0], encoding="utf-8") as f:
+        trace = json.load(f)["trace"]
+    sizes = ", ".join(f"{os.path.basename(p)} {os.path.getsize(p) // 1024} KB" for p in paths)
+    print(f"  exported {sizes} ({len(trace)} trace samples)")
+    for path in paths:
+        os.remove(path)
+    os.rmdir(folder)
+
+
+# --- Logging ---
+def _log_per_message(path, msg):
+    # The old cas_bridge.log: exists check, open, append, close per call
+    import datetime
+    formatted_msg = f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {msg}"
+    try:
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder): os.makedirs(folder)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(formatted_msg + "\n")
+    except: pass
+
+
+def bench_log(messages=5000):
+    print(f"[log] {messages} log calls from the live thread (console echo off)")
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_log")
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, "cas_log.txt")
+
+    for label, unique in (("distinct lines", True), ("error burst", False)):
+        msg = "⚠️ Loop Error: [WinError 10054] An existing connection was forcibly closed by the remote host"
+        texts = [f"{msg} #{i}" if unique else msg for i in range(messages)]
+
+        start = time.perf_counter()
+        worst = 0.0
+        for text in texts:
+            t = time.perf_counter()
+            _log_per_message(path, text)
+            worst = max(worst, time.perf_counter() - t)
+        old = (time.perf_counter() - start) / messages
+        old_lines = sum(1 for _ in open(path, encoding="utf-8"))
+        os.remove(path)
+
+        writer = cas_stream.LogWriter(path, echo=None)
+        start = time.perf_counter()
+        new_worst = 0.0
+        for text in texts:
+            t = time.perf_counter()
+            writer.log(text)
+            new_worst = max(new_worst, time.perf_counter() - t)
+        new = (time.perf_counter() - start) / messages
+        writer.close()
+        new_lines = sum(1 for _ in open(path, encoding="utf-8"))
+        stats = writer.stats()
+        os.remove(path)
+        print(f"  {label:<15} open per call {old * 1e6:7.1f} us (worst {worst * 1e3:5.2f} ms, {old_lines} lines)   "
+              f"queued {new * 1e6:5.1f} us (worst {new_worst * 1e3:5.2f} ms, {new_lines} lines in {stats['batches']} batches, "
+              f"{stats['suppressed']} suppressed)")
+
+    # Rotation: 64 KB files, two backups
+    writer = cas_stream.LogWriter(path, max_bytes=64 * 1024, backups=2, flush_interval=0.01, echo=None)
+    for i in range(4000):
+        writer.log(f"📡 line {i:05d} " + "x" * 40)
+        if i % 500 == 0:
+            time.sleep(0.02)
+    writer.close()
+    files = sorted(os.listdir(folder))
+    sizes = ", ".join(f"{name} {os.path.getsize(os.path.join(folder, name)) // 1024} KB" for name in files)
+    print(f"  rotation        {writer.stats()['rotations']} rotations, kept {sizes}")
+    for name in files:
+        os.remove(os.path.join(folder, name))
+    os.rmdir(folder)
+
+
+# --- Multiple senders ---
+class _LinkSink:
+    # ServerWorker's LinkServer handler without Qt: HELLO (namespace),
+    # stamps, decode and the mailbox
+    def __init__(self, mailbox, wake):
+        self.mailbox = mailbox
+        self.wake = wake
+
+    def on_open(self, link):
+        pass
+
+    def on_close(self, link):
+        pass
+
+    def on_message(self, link, channel, payload):
+        if not cas_protocol.is_binary(payload):
+            packet = json.loads(bytes(payload).decode("utf-8"))
+            if packet.get("command") == "HELLO":
+                link.namespace = packet.get("namespace") or ""
+                link.session.send_raw(cas_protocol.hello_reply(packet))
+                link.session.reader.framed = True
+            return
+        pose = cas_protocol.decode_binary(payload, link.layouts)
+        if pose is None: return
+        packet = {"command": "LIVE_DATA", "pose": pose, "_link": link, "_link_id": link.id,
+                  "_sent": link.layouts.pop("stamp", None)}
+        if self.mailbox.put(packet):
+            self.wake.set()
+
+
+def _link_sender(port, namespace, joints, hz, stop, result):
+    # One cas_bridge.py: HELLO with its namespace, then stamped poses at hz
+    # (0 = as fast as the socket takes them)
+    names, pos, rot = fake_pose(joints)
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sent = 0
+    try:
+        sock.sendall(cas_protocol.hello_packet(namespace=namespace))
+        sock.recv(1024)
+        sock.sendall(cas_protocol.frame(cas_protocol.encode_layout(1, names)))
+        pacer = cas_stream.FramePacer(hz, adaptive=False) if hz else None
+        while not stop.is_set():
+            if pacer is not None:
+                pacer.wait()
+            sock.sendall(cas_protocol.frame(cas_protocol.encode_stamp(time.time()))
+                         + cas_protocol.frame(cas_protocol.encode_pose(1, sent, pos, rot)))
+            sent += 1
+    except OSError:
+        pass
+    finally:
+        sock.close()
+        result[namespace] = sent
+
+
+def _links_run(senders, hz, joints, seconds, apply_ms, flood_joints, read_budget):
+    mailbox = max_stream.PoseMailbox()
+    wake = threading.Event()
+    server = max_stream.LinkServer("127.0.0.1", 0, _LinkSink(mailbox, wake), read_budget)
+    server.open()
+    serve = threading.Thread(target=server.serve)
+    serve.start()
+
+    stop = threading.Event()
+    sent = {}
+    threads = [threading.Thread(target=_link_sender, args=(server.port, f"char{i}", joints, hz, stop, sent))
+               for i in range(senders)]
+    if flood_joints:
+        threads.append(threading.Thread(target=_link_sender, args=(server.port, "flood", flood_joints, 0, stop, sent)))
+    for t in threads:
+        t.start()
+
+    # The Max main thread: newest pose of each sender, apply_ms each
+    links = {}
+    applied = collections.Counter()
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        if not wake.wait(0.05): continue
+        wake.clear()
+        _, poses = mailbox.drain()
+        for packet in poses:
+            busy = time.perf_counter() + apply_ms / 1000.0
+            while time.perf_counter() < busy: pass
+            mailbox.mark_applied(packet)
+            link = packet["_link"]
+            links[link.namespace] = link
+            applied[link.namespace] += 1
+            if packet["_sent"] is not None:
+                link.latency.add((time.time() - packet["_sent"]) * 1000.0)
+    elapsed = time.perf_counter() - start
+    received_bytes = sum(link.session.reader.bytes_received for link in links.values())
+
+    stop.set()
+    t = time.perf_counter()
+    server.stop()
+    serve.join()
+    stop_ms = (time.perf_counter() - t) * 1000
+    for t in threads:
+        t.join()
+    return links, applied, sent, mailbox, elapsed, received_bytes, stop_ms
+
+
+def bench_links(senders=4, hz=60, joints=150, seconds=2.0, apply_ms=1.0, flood_joints=4000):
+    print(f"[links] {senders} senders at {hz} Hz ({joints} joints) into one receiver, {apply_ms:.0f} ms apply per pose")
+    print("  (the previous accept loop served one connection at a time, a second sender waited for the first to quit)")
+    cases = (("live senders", 0, max_stream.READ_BUDGET),
+             (f"+ flood ({flood_joints} joints)", flood_joints, max_stream.READ_BUDGET),
+             ("+ flood, unbounded reads", flood_joints, None))
+    for label, flood, budget in cases:
+        links, applied, sent, mailbox, elapsed, received_bytes, stop_ms = _links_run(
+            senders, hz, joints, seconds, apply_ms, flood, budget)
+        print(f"  {label}: {mailbox.received / elapsed:.0f} poses/s in, {sum(applied.values()) / elapsed:.0f} applied/s, "
+              f"{received_bytes / elapsed / 1e6:.1f} MB/s, stop() {stop_ms:.1f} ms")
+        for name in sorted(links):
+            lat = links[name].latency.summary()
+            print(f"    {name:<6} sent {sent.get(name, 0):6d}  applied {applied[name]:5d}  "
+                  f"dropped {mailbox.dropped_by.get(links[name].id, 0):6d}  "
+                  f"latency p50 {lat['p50_ms']:6.2f}  p95 {lat['p95_ms']:6.2f} ms")
+
+
+# --- Retargeting ---
+def _random_quat(rnd, spread=1.0):
+    # Random rotation, spread 1.0 = any, smaller = closer to identity
+    axis = [rnd.gauss(0, 1) for _ in range(3)]
+    n = sum(c * c for c in axis) ** 0.5 or 1.0
+    half = rnd.uniform(-3.14159, 3.14159) * spread / 2
+    k = math.sin(half) / n
+    return (axis[0] * k, axis[1] * k, axis[2] * k, math.cos(half))
+
+
+def _fk(parents, locals_rot, locals_pos):
+    # World pose of a skeleton from local rotations and bone offsets
+    world_rot = []
+    world_pos = []
+    for k, parent in enumerate(parents):
+        if parent < 0:
+            world_rot.append(locals_rot[k])
+            world_pos.append(locals_pos[k])
+        else:
+            world_rot.append(max_stream.quat_mul(world_rot[parent], locals_rot[k]))
+            offset = max_stream.quat_rotate(world_rot[parent], locals_pos[k])
+            world_pos.append(tuple(world_pos[parent][c] + offset[c] for c in range(3)))
+    return world_pos, world_rot
+
+
+def _flat(rows):
+    return [v for row in rows for v in row]
+
+
+def synthetic_rigs(bones, seed=11):
+    # A Cascadeur-like source skeleton and a Biped-like target: same tree,
+    # 1.3x longer bones, other bone axes, a few joints on either side that
+    # the other one lacks. Returns everything RetargetMap.compile takes.
+    rnd = random.Random(seed)
+    parents = [-1] + [rnd.randrange(max(0, k - 4), k) for k in range(1, bones)]
+    names = ["Root"] + [f"joint_{k:03d}" for k in range(1, bones)]
+    bind_local = [_random_quat(rnd, 0.3) for _ in range(bones)]
+    lengths = [(0.0, 0.0, 100.0)] + [tuple(rnd.uniform(-10, 10) for _ in range(3)) for _ in range(1, bones)]
+    axes = [_random_quat(rnd) for _ in range(bones)]
+
+    source_names = [f"Hero:{name}" for name in names] + [f"Hero:prop_{i}" for i in range(5)]
+    s_pos, s_rot = _fk(parents, bind_local, lengths)
+    s_pos += [(0.0, 0.0, 0.0)] * 5
+    s_rot += [(0.0, 0.0, 0.0, 1.0)] * 5
+
+    targets = [f"Bip001 {name.replace('_', ' ').title()}" for name in names] + [f"Bip001 Extra{i}" for i in range(10)]
+    t_pos, t_rot = _fk(parents, bind_local, [tuple(c * 1.3 for c in length) for length in lengths])
+    t_rot = [max_stream.quat_mul(q, a) for q, a in zip(t_rot, axes)]
+    t_pos += [(0.0, 0.0, 0.0)] * 10
+    t_rot += [(0.0, 0.0, 0.0, 1.0)] * 10
+    t_parents = [None if p < 0 else targets[p] for p in parents] + [targets[0]] * 10
+
+    rig = {
+        "parents": parents, "bind_local": bind_local, "lengths": lengths, "axes": axes,
+        "source_names": source_names, "s_pos": _flat(s_pos), "s_rot": _flat(s_rot),
+        "targets": targets, "t_pos": _flat(t_pos), "t_rot": _flat(t_rot), "t_parents": t_parents,
+    }
+    return rig
+
+
+def _rig_frame(rig, rnd):
+    # Source pose with every joint turned a little from its bind pose, and
+    # the target pose the retarget should produce (same turns, own lengths)
+    parents = rig["parents"]
+    turned = [max_stream.quat_mul(q, _random_quat(rnd, 0.2)) for q in rig["bind_local"]]
+    root = tuple(rnd.uniform(-50, 50) for _ in range(3))
+    s_pos, s_rot = _fk(parents, turned, [root] + rig["lengths"][1:])
+    t_pos, t_rot = _fk(parents, turned, [root] + [tuple(c * 1.3 for c in length) for length in rig["lengths"][1:]])
+    t_rot = [max_stream.quat_mul(q, a) for q, a in zip(t_rot, rig["axes"])]
+    # The target root sits where its bind offset puts it relative to the source root
+    offset = [rig["t_pos"][c] - rig["s_pos"][c] for c in range(3)]
+    offset = max_stream.quat_rotate(max_stream.quat_conj(rig["s_rot"][0:4]), offset)
+    offset = max_stream.quat_rotate(s_rot[0], offset)
+    shift = [root[c] + offset[c] - t_pos[0][c] for c in range(3)]
+    t_pos = [tuple(p[c] + shift[c] for c in range(3)) for p in t_pos]
+    extra = len(rig["source_names"]) - len(parents)
+    return (_flat(s_pos) + [0.0] * 3 * extra, _flat(s_rot) + [0.0, 0.0, 0.0, 1.0] * extra,
+            _flat(t_pos), _flat(t_rot))
+
+
+def _max_error(nodes, pos, rot, want_pos, want_rot):
+    # Largest position and quaternion component error over the bones that
+    # were written (q and -q are the same rotation)
+    pos_err = 0.0
+    rot_err = 0.0
+    for k, node in enumerate(nodes):
+        if node is None: continue
+        n = node.index
+        pos_err = max(pos_err, max(abs(pos[k * 3 + c] - want_pos[n * 3 + c]) for c in range(3)))
+        a = rot[k * 4:k * 4 + 4]
+        b = want_rot[n * 4:n * 4 + 4]
+        sign = 1.0 if sum(x * y for x, y in zip(a, b)) >= 0 else -1.0
+        rot_err = max(rot_err, max(abs(a[c] - sign * b[c]) for c in range(4)))
+    return pos_err, rot_err
+
+
+class _RigNode:
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+
+
+def bench_retarget(bones=150, frames=200, repeat=500):
+    backend = "numpy" if max_stream.numpy is not None else "pure Python"
+    print(f"[retarget] synthetic {bones}-joint source -> {bones + 10}-node target with other bone axes and lengths ({backend})")
+    rig = synthetic_rigs(bones)
+    source_names = rig["source_names"]
+    targets = rig["targets"]
+
+    start = time.perf_counter()
+    mapping = max_stream.match_bones(source_names, targets)
+    match_s = time.perf_counter() - start
+    start = time.perf_counter()
+    retarget = max_stream.RetargetMap.compile(source_names, rig["s_pos"], rig["s_rot"], targets,
+                                              rig["t_pos"], rig["t_rot"], rig["t_parents"], mapping)
+    compile_s = time.perf_counter() - start
+    nodes = {name: _RigNode(name, k) for k, name in enumerate(targets)}
+    missing = retarget.bind(nodes.get)
+    print(f"  matched {len(mapping)}/{len(targets)} targets by name in {match_s * 1000:.2f} ms, "
+          f"compiled in {compile_s * 1000:.2f} ms: {retarget.stats()}, {missing} unbound")
+
+    # The bind pose must come out as the target's bind pose
+    out_nodes, pos, rot = retarget.apply(source_names, rig["s_pos"], rig["s_rot"])
+    pos_err, rot_err = _max_error(out_nodes, pos, rot, rig["t_pos"], rig["t_rot"])
+    print(f"  bind pose          max error pos {pos_err:.2e}  rot {rot_err:.2e}")
+
+    rnd = random.Random(5)
+    worst_pos = worst_rot = 0.0
+    poses = []
+    for _ in range(frames):
+        s_pos, s_rot, t_pos, t_rot = _rig_frame(rig, rnd)
+        poses.append((s_pos, s_rot))
+        out_nodes, pos, rot = retarget.apply(source_names, s_pos, s_rot)
+        pos_err, rot_err = _max_error(out_nodes, pos, rot, t_pos, t_rot)
+        worst_pos = max(worst_pos, pos_err)
+        worst_rot = max(worst_rot, rot_err)
+    print(f"  {frames} posed frames  max error pos {worst_pos:.2e}  rot {worst_rot:.2e} (target FK reference)")
+
+    # Saved and loaded: same result. Joints in another order: same result.
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_retarget.json")
+    retarget.save(path)
+    size = os.path.getsize(path)
+    loaded = max_stream.RetargetMap.load(path)
+    os.remove(path)
+    loaded.bind(nodes.get)
+    s_pos, s_rot = poses[-1]
+    _, want_pos, want_rot = retarget.apply(source_names, s_pos, s_rot)
+    _, got_pos, got_rot = loaded.apply(source_names, s_pos, s_rot)
+    file_err = max(abs(a - b) for a, b in zip(want_pos + want_rot, got_pos + got_rot))
+    order = list(range(len(source_names)))
+    rnd.shuffle(order)
+    shuffled = tuple(source_names[i] for i in order)
+    _, got_pos, got_rot = retarget.apply(shuffled, _flat(s_pos[i * 3:i * 3 + 3] for i in order),
+                                         _flat(s_rot[i * 4:i * 4 + 4] for i in order))
+    layout_err = max(abs(a - b) for a, b in zip(want_pos + want_rot, got_pos + got_rot))
+    print(f"  saved {size // 1024} KB, loaded map max diff {file_err:.1e}, shuffled joint layout max diff {layout_err:.1e}")
+
+    # Per frame cost against the name path update_scene_live uses without a map
+    cache = max_scene.NodeCache(FakeRuntime(0, source_names))
+    cache.rebuild()
+    names = tuple(source_names)
+    joints = range(len(names))
+    name_path = timed(lambda: [cache.get(names[i]) for i in joints], repeat)
+    seconds = timed(lambda: retarget.apply(names, s_pos, s_rot), repeat)
+    report("name lookups only", name_path)
+    report("retarget apply", seconds)
+    print(f"  {len(retarget) / seconds / 1e6:.2f} M bones/s, {seconds / 0.02:.1%} of a 20 ms tick")
+
+    # A parent node missing from the scene: its bound children are reported at bind time
+    gone = retarget.targets[retarget.parents.index(0)]
+    missing = retarget.bind(lambda name: None if name == gone else nodes.get(name))
+    out_nodes, _, _ = retarget.apply(names, s_pos, s_rot)
+    print(f"  {gone} unbound: {missing} missing, {out_nodes.count(None)} bones not written")
+
+
+BENCHMARKS = {
+    "wire": bench_wire,
+    "framing": bench_framing,
+    "nodes": bench_nodes,
+    "mailbox": bench_mailbox,
+    "delta": bench_delta,
+    "selection": bench_selection,
+    "sampler": bench_sampler,
+    "axis": bench_axis,
+    "apply": bench_apply,
+    "session": bench_session,
+    "reconnect": bench_reconnect,
+    "meshcache": bench_meshcache,
+    "incremental": bench_incremental,
+    "registry": bench_registry,
+    "replay": bench_replay,
+    "take": bench_take,
+    "transfer": bench_transfer,
+    "quant": bench_quant,
+    "pacing": bench_pacing,
+    "redraw": bench_redraw,
+    "stats": bench_stats,
+    "log": bench_log,
+    "links": bench_links,
+    "retarget": bench_retarget,
+}
+
+
+def main(argv):
+    selected = argv or list(BENCHMARKS)
+    for name in selected:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark '{name}'. Available: {', '.join(BENCHMARKS)}")
+            continue
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
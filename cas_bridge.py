@@ -1,47 +1,292 @@
 import sys
 import os
+import importlib
 import socket
 import json
 import time
-import datetime
 import threading
 import csc
 
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+import cas_protocol
+import cas_stream
+import cas_capture
+import cas_stats
+
+# Cascadeur keeps imported modules between script runs; reload so edits to
+# the helper modules take effect without a restart (cas_protocol first,
+# cas_stream uses it)
+importlib.reload(cas_protocol)
+importlib.reload(cas_stream)
+importlib.reload(cas_capture)
+importlib.reload(cas_stats)
+
 # --- CONFIG ---
 HOST = '127.0.0.1'
 PORT = 5555
-UPDATE_RATE = 0.02
+UPDATE_RATE = 0.02        # seconds between sends at start; adapted to Max's feedback from there
+ADAPTIVE_RATE = True      # follow the rate Max reports it can apply
+MIN_SEND_RATE = 10.0      # sends per second, lower bound of the adaptive rate
+MAX_SEND_RATE = 120.0     # sends per second, upper bound of the adaptive rate
 SEND_MESH = True 
+DELTA_EPSILON = 1e-4      # joints that moved less than this are not resent
+KEYFRAME_INTERVAL = 50    # full pose every N ticks so Max can resync
+JOINT_INCLUDE = r"Joint|Center|Point"   # regex, or a list of exact names
+JOINT_EXCLUDE = None                    # regex, or a list of exact names
+SYNC_TIMEOUT = 120.0      # seconds to wait for Max to finish importing
+HEARTBEAT_INTERVAL = 1.0  # ping Max when nothing else was sent for this long
+EXPORT_CACHE_DIR = "C:/Temp3d/Cascadeur/cache"
+EXPORT_CACHE_MB = 512     # recent exports kept on disk, oldest evicted first
+WIRE_ENCODING = "binary"  # "binary" (float32) or "quantized" (fixed point, for links across machines)
+QUANT_POS_BITS = 16       # quantized: bits per position axis inside the session range
+QUANT_ROT_BITS = 10       # quantized: bits per quaternion component (smallest three)
+QUANT_MARGIN = 200.0      # quantized: room around the first pose before the range is resent
+TRANSFER_RANGE = None     # (first, last) to send that frame range as keys before the live link starts
+BLOCK_FRAMES = 64         # frames per compressed transfer block
+BLOCK_WINDOW = 4          # blocks in flight before waiting for Max to acknowledge
+CHARACTER_NAMESPACE = None  # e.g. "Hero": drive a character of its own in Max, for several streams at once
+CHARACTER_SCALE = None      # Max scale for this character, None = the receiver's Global Scale
+RECORD_DIR = None         # e.g. "C:/Temp3d/Cascadeur/captures" to record the pose stream for cas_replay.py
+INSTRUMENT = True         # per-stage timings (sample, encode, send, latency) and stamps for Max's stats panel
+STATS_LOG_INTERVAL = 10.0 # seconds between stage timing lines in the log, 0 = only on stop
+STATS_EXPORT = None       # e.g. "C:/Temp3d/cas_stats_sender.json" (or .csv), written on stop
 LOG_FILE = "C:/Temp3d/cas_log.txt"
+LOG_MAX_MB = 1.0          # the log rotates to .1, .2 ... past this size
+LOG_BACKUPS = 2           # rotated logs kept
+LOG_REPEAT_INTERVAL = 5.0 # the same message more than 3 times within this many seconds is only counted
 
 def log(msg):
-    timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-    formatted_msg = f"[{timestamp}] {msg}"
-    print(formatted_msg)
-    try:
-        if not os.path.exists("C:/Temp3d"): os.makedirs("C:/Temp3d")
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(formatted_msg + "\n")
-    except: pass
+    # Queued for the background log writer; the file is written in batches
+    writer = getattr(sys, "cas_bridge_log", None)
+    if writer is None:
+        writer = cas_stream.LogWriter(LOG_FILE, int(LOG_MAX_MB * 1024 * 1024), LOG_BACKUPS,
+                                      repeat_interval=LOG_REPEAT_INTERVAL)
+        sys.cas_bridge_log = writer
+    writer.log(msg)
 
 class CasBridgeCore:
     def __init__(self):
         self.running = False
         self.thread = None
         self.sock = None
+        self.session = None
+        self.connection = cas_stream.ConnectionManager(HOST, PORT, on_state=self.on_connection_state)
+        self.export_cache = cas_stream.ExportCache(EXPORT_CACHE_DIR, EXPORT_CACHE_MB * 1024 * 1024)
+        self.last_send = 0.0
+        self.wire_format = cas_protocol.FORMAT_JSON
+        self.framed = False
+        self.layout_id = 0
+        self.layout_names = None
+        self.quantizer = None
+        self.sent_flags = 0
+        self.recorder = None
+        self.stamps = False
+        self.stats = cas_stats.Instruments(INSTRUMENT)
+        self.last_stats_log = time.perf_counter()
+        self.pacer = cas_stream.FramePacer(1.0 / UPDATE_RATE, MIN_SEND_RATE, MAX_SEND_RATE, ADAPTIVE_RATE)
+        self.delta = cas_stream.DeltaTracker(DELTA_EPSILON, KEYFRAME_INTERVAL)
+        self.sampler = cas_stream.PoseSampler()
+        self.selection = cas_stream.JointSelection(cas_stream.JointFilter(JOINT_INCLUDE, JOINT_EXCLUDE))
         self.app = csc.app.get_application()
         self.manager = self.app.get_scene_manager()
 
-    def connect_socket(self):
+    def on_connection_state(self, state, reason):
+        # Published by the connection manager; the live loop only reads self.connection.state
+        log(f"🔌 Connection {state}" + (f": {reason}" if reason else ""))
+
+    def connect_socket(self, wait=0.0):
+        # Never blocks the live loop unless wait is given
+        if self.sock: return True
+        sock = self.connection.wait(wait) if wait else self.connection.poll()
+        if sock is None: return False
+        self.sock = sock
         try:
-            if self.sock: return True
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.settimeout(0.5)
-            self.sock.connect((HOST, PORT))
-            return True
-        except:
-            self.sock = None
+            self.negotiate_format()
+        except OSError as e:
+            self.drop_connection(f"handshake failed ({e})")
             return False
+        return True
+
+    def drop_connection(self, reason):
+        self.sock = None
+        self.session = None
+        self.connection.disconnect(reason)
+
+    def negotiate_format(self):
+        # Ask Max which pose format it speaks; no answer means an old receiver
+        # that only understands bare JSON packets
+        self.wire_format = cas_protocol.FORMAT_JSON
+        self.framed = False
+        self.stamps = False
+        self.session = None
+        self.layout_names = None
+        offered = cas_protocol.DEFAULT_FORMATS
+        if WIRE_ENCODING == cas_protocol.FORMAT_QUANTIZED:
+            offered = (cas_protocol.FORMAT_QUANTIZED,) + offered
+        try:
+            self.sock.sendall(cas_protocol.hello_packet(offered, CHARACTER_NAMESPACE, CHARACTER_SCALE))
+            reply = self.sock.recv(1024)
+            chosen = cas_protocol.parse_hello_reply(reply) if reply else None
+            if chosen:
+                self.wire_format = chosen
+                self.framed = True
+                self.session = cas_protocol.Session(self.sock)
+                # Max measures latency from stamps sent ahead of each pose
+                self.stamps = INSTRUMENT and cas_protocol.FEATURE_STAMPS in cas_protocol.parse_hello_features(reply)
+        except socket.timeout:
+            pass
+        log(f"🤝 Wire format: {self.wire_format} ({'framed' if self.framed else 'legacy'})")
+        # A new receiver starts from the configured rate again
+        self.pacer.set_rate(1.0 / UPDATE_RATE)
+        if RECORD_DIR:
+            self.start_recording()
+
+    def start_recording(self):
+        # One capture per connection, since the handshake decides the format
+        self.stop_recording()
+        try:
+            path = cas_capture.capture_path(RECORD_DIR)
+            self.recorder = cas_capture.CaptureWriter(path, {
+                "format": self.wire_format,
+                "framed": self.framed,
+                "protocol": cas_protocol.PROTOCOL_VERSION,
+                "update_rate": UPDATE_RATE,
+            })
+            log(f"⏺️ Recording pose stream to {path}")
+        except OSError as e:
+            log(f"⚠️ Could not start recording: {e}")
+
+    def stop_recording(self):
+        if not self.recorder: return
+        recorder = self.recorder
+        self.recorder = None
+        try:
+            recorder.close()
+            log(f"⏹️ Capture saved: {recorder.path} {recorder.stats()}")
+        except OSError as e:
+            log(f"⚠️ Could not finish capture {recorder.path}: {e}")
+
+    def encode_pose(self, current_frame, names, pos, rot):
+        # Returns the bytes to send, or None when no joint moved
+        msg = b""
+        self.sent_flags = 0
+        binary = self.wire_format in (cas_protocol.FORMAT_BINARY, cas_protocol.FORMAT_QUANTIZED)
+        quantized = self.wire_format == cas_protocol.FORMAT_QUANTIZED
+        new_layout = names != self.layout_names
+        if new_layout:
+            self.layout_id = (self.layout_id + 1) & 0xFFFF
+            self.layout_names = names
+            self.delta.reset()
+        if quantized and (new_layout or self.quantizer is None or not self.quantizer.contains(pos)):
+            # Positions left the range: a wider one, resent with the layout
+            # so the record is self-contained, and a keyframe in it
+            self.quantizer = cas_protocol.Quantizer.around(pos, QUANT_MARGIN, QUANT_POS_BITS, QUANT_ROT_BITS)
+            self.delta.reset()
+            new_layout = True
+        if binary and new_layout:
+            msg = cas_protocol.frame(cas_protocol.encode_layout(self.layout_id, names))
+            if quantized:
+                msg += cas_protocol.frame(cas_protocol.encode_range(self.layout_id, self.quantizer))
+            self.sent_flags |= cas_capture.REC_LAYOUT
+
+        keyframe, indices = self.delta.update(pos, rot)
+        if keyframe:
+            self.sent_flags |= cas_capture.REC_KEYFRAME
+        else:
+            if not indices: return None
+            pos, rot = cas_stream.pick_joints(pos, rot, indices)
+
+        if quantized:
+            return msg + cas_protocol.frame(cas_protocol.encode_qpose(self.layout_id, current_frame, pos, rot, self.quantizer, indices))
+        if binary:
+            return msg + cas_protocol.frame(cas_protocol.encode_pose(self.layout_id, current_frame, pos, rot, indices))
+
+        # JSON deltas just list fewer joints, which older receivers handle too
+        data_list = []
+        for k, i in enumerate(range(len(names)) if keyframe else indices):
+            data_list.append({
+                "n": names[i],
+                "p": list(pos[k * 3:k * 3 + 3]),
+                "r": list(rot[k * 4:k * 4 + 4])
+            })
+        packet = {
+            "command": "LIVE_DATA",
+            "frame": current_frame,
+            "data": data_list
+        }
+        msg = json.dumps(packet).encode('utf-8')
+        return cas_protocol.frame(msg) if self.framed else msg
+
+    def send_bytes(self, msg):
+        if self.session:
+            self.session.send_raw(msg)
+        else:
+            self.sock.sendall(msg)
+        self.last_send = time.perf_counter()
+
+    def handle_incoming(self):
+        # Acks and heartbeats are handled by the session itself
+        self.session.poll(0)
+        inbox = self.session.inbox
+        while inbox:
+            _, packet = inbox.popleft()
+            if isinstance(packet, dict) and packet.get("command") == "FEEDBACK":
+                self.handle_feedback(packet)
+        if time.perf_counter() - self.last_send > HEARTBEAT_INTERVAL:
+            self.session.ping()
+            self.last_send = time.perf_counter()
+
+    def handle_feedback(self, report):
+        if report.get("t") is not None:
+            self.stats.add("latency", time.time() - report["t"])
+        target = self.pacer.rate
+        if self.pacer.feedback(report):
+            log(f"🎚️ Send rate {target:.0f} -> {self.pacer.rate:.0f}/s (achieved {self.pacer.achieved:.1f}/s, "
+                f"Max at frame {report.get('frame')} applies in {report.get('apply_ms', 0):.1f} ms, "
+                f"{report.get('applied', 0)} applied / {report.get('dropped', 0)} dropped)")
+
+    def sync_model(self, fbx_path, digest=None):
+        packet = {"command": "SYNC_MODEL", "path": fbx_path}
+        if digest: packet["hash"] = digest
+        if self.connect_socket(wait=2.0) and self.session:
+            start = time.perf_counter()
+            request_id = self.session.request(packet, cas_protocol.CHANNEL_MESH)
+            log("   ✅ Command Sent. Waiting for Max to load mesh...")
+            ack = self.session.wait_ack(request_id, SYNC_TIMEOUT)
+            if ack is None:
+                log(f"   ⚠️ Max did not confirm the import within {SYNC_TIMEOUT:.0f}s")
+                return False
+            if not ack.get("ok"):
+                log(f"   ❌ Max could not import the mesh: {ack.get('error')}")
+                return False
+            if ack.get("skipped"):
+                log(f"   ✅ Max already holds this mesh version, import skipped ({time.perf_counter() - start:.2f}s round trip)")
+                return True
+            log(f"   ✅ Max finished loading the mesh ({time.perf_counter() - start:.2f}s round trip)")
+            return True
+
+        # Older receivers: bare JSON and a fixed pause. They serve one client
+        # at a time, so while the live link is connected the packet has to go
+        # over that socket; a second connection would wait in the backlog.
+        data = json.dumps(packet).encode('utf-8')
+        if self.sock:
+            try:
+                self.send_bytes(data)
+            except OSError as e:
+                self.drop_connection(f"sync send failed ({e})")
+                return False
+        else:
+            temp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            temp_sock.settimeout(2.0)
+            temp_sock.connect((HOST, PORT))
+            temp_sock.sendall(data)
+            temp_sock.close()
+        log("   ✅ Command Sent. Waiting for Max to load mesh...")
+        log("   ⏳ Pausing 1.0s to let Max process the file...")
+        time.sleep(1.0)
+        return True
 
     def export_and_sync_mesh(self):
         log("   >>> [STEP 1] Starting Mesh Export Process...")
@@ -67,20 +312,77 @@ class CasBridgeCore:
             
             log(f"   ✅ FBX File created at: {fbx_path}")
 
+            hits = self.export_cache.hits
+            digest, fbx_path = self.export_cache.store(fbx_path)
+            state = "unchanged since a recent export" if self.export_cache.hits > hits else "new version"
+            log(f"   ℹ️ Mesh {digest[:8]}: {state} ({fbx_path})")
+
             log("   ℹ️ Sending SYNC command to 3ds Max...")
-            temp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            temp_sock.settimeout(2.0)
-            temp_sock.connect((HOST, PORT))
-            packet = {"command": "SYNC_MODEL", "path": fbx_path}
-            temp_sock.sendall(json.dumps(packet).encode('utf-8'))
-            temp_sock.close()
-            
-            log("   ✅ Command Sent. Waiting for Max to load mesh...")
-            return True
+            return self.sync_model(fbx_path, digest)
         except Exception as e:
             log(f"   ❌ Export Failed: {e}")
             return False
 
+    def transfer_range(self, first, last):
+        log(f"   >>> Transferring frames {first}-{last} to 3ds Max...")
+        scene = self.manager.current_scene()
+        if not scene:
+            log("   ❌ ERROR: No active scene found to transfer.")
+            return False
+        if not hasattr(scene, "set_current_frame"):
+            log("   ❌ This Cascadeur version cannot change the current frame from Python.")
+            return False
+        if not self.connect_socket(wait=2.0) or self.wire_format not in (cas_protocol.FORMAT_BINARY, cas_protocol.FORMAT_QUANTIZED):
+            log("   ❌ Bulk transfer needs a connected receiver that speaks the binary format.")
+            return False
+
+        objects = scene.get_selected_objects() if hasattr(scene, "get_selected_objects") else []
+        joints = self.selection.update(objects)
+        if not joints:
+            log("   ❌ No joints selected to transfer.")
+            return False
+
+        # The live stream announces its own layout again afterwards
+        self.layout_id = (self.layout_id + 1) & 0xFFFF
+        self.layout_names = None
+        try:
+            restore_frame = scene.get_current_frame()
+        except AttributeError:
+            restore_frame = None
+
+        def sample(frame):
+            scene.set_current_frame(frame)
+            return self.sampler.sample(joints)
+
+        reported = [0]
+        def progress(done, total, transfer):
+            percent = done * 100 // total
+            if percent >= reported[0] + 10 or done == total:
+                reported[0] = percent
+                log(f"   ⏳ {done}/{total} frames ({percent}%), {transfer.frames / max(transfer.elapsed, 1e-9):.0f} fps")
+
+        precision = None
+        if self.wire_format == cas_protocol.FORMAT_QUANTIZED:
+            precision = (QUANT_POS_BITS, QUANT_ROT_BITS)
+        transfer = cas_stream.BlockTransfer(self.session, self.layout_id, self.selection.names,
+                                            BLOCK_FRAMES, BLOCK_WINDOW, timeout=SYNC_TIMEOUT, progress=progress,
+                                            precision=precision)
+        try:
+            stats = transfer.run(first, last, sample)
+        except (TimeoutError, RuntimeError) as e:
+            log(f"   ❌ Transfer failed: {e}")
+            return False
+        except OSError as e:
+            log(f"   ❌ Transfer failed: {e}")
+            self.drop_connection(str(e))
+            return False
+        finally:
+            if restore_frame is not None:
+                scene.set_current_frame(restore_frame)
+        self.last_send = time.perf_counter()
+        log(f"   ✅ Transfer done: {stats}")
+        return True
+
     def start_live_link(self):
         if self.running:
             self.stop_live_link()
@@ -92,14 +394,17 @@ class CasBridgeCore:
         if SEND_MESH:
             log("🤔 Reason: Because SEND_MESH = True, I will export the mesh now.")
             success = self.export_and_sync_mesh()
-            if success:
-                log("   ⏳ Pausing 1.0s to let Max process the file...")
-                time.sleep(1.0) 
-            else:
+            if not success:
                 log("   ⚠️ Export failed, but trying to continue connection...")
         else:
             log("🤔 Reason: Because SEND_MESH = False, I am SKIPPING export.")
 
+        if TRANSFER_RANGE:
+            self.transfer_range(*TRANSFER_RANGE)
+
+        # A restart usually follows scene edits (renames, a different scene):
+        # filter the selection afresh
+        self.selection.invalidate()
         self.running = True
         self.thread = threading.Thread(target=self._live_loop)
         self.thread.daemon = True
@@ -112,21 +417,39 @@ class CasBridgeCore:
         if self.thread: 
             try: self.thread.join(timeout=1.0)
             except: pass
-        if self.sock: 
-            try: self.sock.close()
-            except: pass
-            self.sock = None
+        self.sock = None
+        self.session = None
+        self.connection.close()
+        self.stop_recording()
+        log(f"📊 Delta stats: {self.delta.stats()}")
+        log(f"📊 Pacing stats: {self.pacer.stats()}")
+        if INSTRUMENT:
+            self.log_stats()
+            if STATS_EXPORT:
+                try:
+                    log(f"📊 Stats exported: {', '.join(self.stats.export(STATS_EXPORT))}")
+                except OSError as e:
+                    log(f"⚠️ Could not export stats: {e}")
+        log(f"📊 Connection stats: {self.connection.stats()}")
         log("🛑 STOPPED previous session.")
 
+    def log_stats(self):
+        self.last_stats_log = time.perf_counter()
+        for line in self.stats.lines():
+            log(f"📊 {line}")
+
     def _live_loop(self):
         log(" Live Loop Running... (Waiting for scene data)")
         packet_count = 0
         
         while self.running:
-            time.sleep(UPDATE_RATE)
+            self.pacer.wait()
 
             try:
                 if not self.connect_socket(): continue
+                if self.session: self.handle_incoming()
+                if INSTRUMENT and STATS_LOG_INTERVAL and time.perf_counter() - self.last_stats_log > STATS_LOG_INTERVAL:
+                    self.log_stats()
 
                 scene = self.manager.current_scene()
                 if not scene: continue
@@ -145,54 +468,59 @@ class CasBridgeCore:
                 
                 if not objects: continue
 
-                data_list = []
-                for obj in objects:
-                    if "Joint" in obj.name or "Center" in obj.name or "Point" in obj.name:
-                        tf = obj.get_global_transform()
-                        p = tf.translation
-                        r = tf.rotation
-                        data_list.append({
-                            "n": obj.name,
-                            "p": [p.x, p.y, p.z],
-                            "r": [r.x, r.y, r.z, r.w]
-                        })
-
-                if not data_list: continue
-
-                packet = {
-                    "command": "LIVE_DATA",
-                    "frame": current_frame,
-                    "data": data_list
-                }
-                
-                msg = json.dumps(packet).encode('utf-8')
-                self.sock.sendall(msg)
+                joints = self.selection.update(objects)
+                if not joints: continue
+
+                stats = self.stats
+                sampled_at = time.time() if self.stamps else None
+                start = stats.now()
+                pos, rot = self.sampler.sample(joints)
+                stats.since("sample", start)
+                start = stats.now()
+                msg = self.encode_pose(current_frame, self.selection.names, pos, rot)
+                stats.since("encode", start)
+                if msg is None: continue
+                start = stats.now()
+                if sampled_at is not None:
+                    # Not recorded: replayed stamps would be stale
+                    self.send_bytes(cas_protocol.frame(cas_protocol.encode_stamp(sampled_at)) + msg)
+                else:
+                    self.send_bytes(msg)
+                stats.since("send", start)
+                stats.count("packets")
+                stats.count("bytes", len(msg))
+                self.pacer.sent()
+                if self.recorder:
+                    self.recorder.write(msg, int(current_frame), self.sent_flags)
                 
                 if packet_count == 0:
-                    log(f"📡 First Packet Sent! (Frame: {current_frame}, Objects: {len(data_list)})")
+                    log(f"📡 First Packet Sent! (Frame: {current_frame}, Objects: {len(joints)})")
                 packet_count += 1
 
             except Exception as e:
                 
                 if packet_count % 50 == 0:
                     log(f"⚠️ Loop Error: {e}")
-                self.sock = None
-                time.sleep(1.0)
+                if self.sock:
+                    self.drop_connection(str(e))
 
 
 def main():
     
-    if os.path.exists(LOG_FILE) and os.path.getsize(LOG_FILE) > 1024 * 1024:
-        try: os.remove(LOG_FILE)
-        except: pass
-
-    
     if hasattr(sys, "cas_bridge_instance") and sys.cas_bridge_instance:
         sys.cas_bridge_instance.running = False
         sys.cas_bridge_instance.stop_live_link()
         time.sleep(0.2) 
         sys.cas_bridge_instance = None
 
+    # The previous run's writer flushes and stops; the next log() starts one
+    # with this run's settings
+    writer = getattr(sys, "cas_bridge_log", None)
+    if writer is not None:
+        log(f"📊 Log stats: {writer.stats()}")
+        writer.close()
+        sys.cas_bridge_log = None
+
     
     bridge = CasBridgeCore()
     sys.cas_bridge_instance = bridge
@@ -0,0 +1,197 @@
+# File: cas_capture.py
+# Capture files of the live pose stream, written by cas_bridge.py when
+# RECORD_DIR is set and played back into Max with cas_replay.py.
+#
+# Layout:
+#   header   "CASC", version, flags, meta length, meta JSON (wire format, framing)
+#   records  timestamp (float64, seconds since start), payload length,
+#            frame, record flags, then the bytes exactly as sent
+#   index    keyframe entries (frame, record offset, layout record offset),
+#            then a footer pointing at the index. Written on close; a file
+#            without one (crashed sender) is indexed by scanning the records.
+import os
+import mmap
+import json
+import time
+import struct
+
+CAPTURE_MAGIC = b"CASC"
+CAPTURE_VERSION = 1
+CAPTURE_EXT = ".cascap"
+HEADER = struct.Struct("<4sBBHI")
+RECORD = struct.Struct("<dIiB")
+INDEX_ENTRY = struct.Struct("<iQQ")
+FOOTER = struct.Struct("<QI4s")
+INDEX_MAGIC = b"CASI"
+
+REC_LAYOUT = 0x01    # record starts a new joint layout (binary format)
+REC_KEYFRAME = 0x02  # record holds a full pose, replay can start here
+NO_FRAME = -1
+NO_OFFSET = 0xFFFFFFFFFFFFFFFF
+
+
+# ---------------------------------------------------------
+# WRITER (append only, one record per send)
+# ---------------------------------------------------------
+class CaptureWriter:
+    def __init__(self, path, meta=None):
+        self.path = path
+        self.file = open(path, "wb")
+        meta_bytes = json.dumps(meta or {}).encode("utf-8")
+        self.file.write(HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, 0, 0, len(meta_bytes)))
+        self.file.write(meta_bytes)
+        self.offset = HEADER.size + len(meta_bytes)
+        self.start = time.perf_counter()
+        self.index = []
+        self.layout_offset = NO_OFFSET
+        self.records = 0
+
+    def write(self, data, frame=NO_FRAME, flags=0, timestamp=None):
+        if timestamp is None:
+            timestamp = time.perf_counter() - self.start
+        if flags & REC_LAYOUT:
+            self.layout_offset = self.offset
+        if flags & REC_KEYFRAME:
+            self.index.append((frame, self.offset, self.layout_offset))
+        self.file.write(RECORD.pack(timestamp, len(data), frame, flags))
+        self.file.write(data)
+        self.offset += RECORD.size + len(data)
+        self.records += 1
+
+    def close(self):
+        if self.file is None: return
+        index_offset = self.offset
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(FOOTER.pack(index_offset, len(self.index), INDEX_MAGIC))
+        self.file.close()
+        self.file = None
+
+    def stats(self):
+        return {"records": self.records, "keyframes": len(self.index), "bytes": self.offset}
+
+
+def capture_path(directory, prefix="cas_live"):
+    if not os.path.exists(directory): os.makedirs(directory)
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    return os.path.join(directory, f"{prefix}_{stamp}{CAPTURE_EXT}")
+
+
+# ---------------------------------------------------------
+# READER (memory mapped, records are views into the file)
+# ---------------------------------------------------------
+class CaptureReader:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+        magic, version, _, _, meta_len = HEADER.unpack_from(self.view, 0)
+        if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a capture file")
+        self.meta = json.loads(bytes(self.view[HEADER.size:HEADER.size + meta_len]).decode("utf-8"))
+        self.data_start = HEADER.size + meta_len
+        self.data_end, self.index = self._read_index()
+
+    def _read_index(self):
+        size = len(self.view)
+        if size >= self.data_start + FOOTER.size:
+            index_offset, count, magic = FOOTER.unpack_from(self.view, size - FOOTER.size)
+            if magic == INDEX_MAGIC and index_offset + count * INDEX_ENTRY.size + FOOTER.size == size:
+                index = [INDEX_ENTRY.unpack_from(self.view, index_offset + i * INDEX_ENTRY.size) for i in range(count)]
+                return index_offset, index
+
+        # No footer: scan the records, stopping at a truncated one
+        index = []
+        layout_offset = NO_OFFSET
+        offset = self.data_start
+        while offset + RECORD.size <= size:
+            _, length, frame, flags = RECORD.unpack_from(self.view, offset)
+            if offset + RECORD.size + length > size: break
+            if flags & REC_LAYOUT:
+                layout_offset = offset
+            if flags & REC_KEYFRAME:
+                index.append((frame, offset, layout_offset))
+            offset += RECORD.size + length
+        return offset, index
+
+    def records(self, offset=None):
+        # Yields (timestamp, frame, flags, payload view) from offset on
+        view = self.view
+        offset = self.data_start if offset is None else offset
+        end = self.data_end
+        while offset < end:
+            timestamp, length, frame, flags = RECORD.unpack_from(view, offset)
+            start = offset + RECORD.size
+            yield timestamp, frame, flags, view[start:start + length]
+            offset = start + length
+
+    def record_at(self, offset):
+        return next(self.records(offset))
+
+    def seek(self, frame):
+        # First keyframe at or after frame, in recording order.
+        # Returns (record offset, layout record offset or None).
+        for entry_frame, offset, layout_offset in self.index:
+            if entry_frame >= frame:
+                return offset, (None if layout_offset == NO_OFFSET else layout_offset)
+        raise KeyError(f"No keyframe at or after frame {frame}")
+
+    def frames(self):
+        return [entry[0] for entry in self.index]
+
+    def duration(self):
+        last = 0.0
+        for timestamp, _, _, _ in self.records():
+            last = timestamp
+        return last
+
+    def close(self):
+        try:
+            self.view.release()
+            self.map.close()
+        except (AttributeError, BufferError):
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------------------------------------------------------
+# REPLAY (paced playback into a send function)
+# ---------------------------------------------------------
+def replay(reader, send, speed=1.0, start_frame=None, stop=None):
+    # speed 1.0 is real time, 4.0 four times faster, 0 as fast as possible.
+    # Returns (records sent, bytes sent, seconds).
+    offset = None
+    sent = 0
+    sent_bytes = 0
+    if start_frame is not None:
+        offset, layout_offset = reader.seek(start_frame)
+        if layout_offset is not None and layout_offset < offset:
+            # Binary deltas need the joint layout of the keyframe
+            _, _, _, payload = reader.record_at(layout_offset)
+            send(payload)
+            sent += 1
+            sent_bytes += len(payload)
+
+    begin = time.perf_counter()
+    first = None
+    for timestamp, frame, flags, payload in reader.records(offset):
+        if stop is not None and stop(): break
+        if first is None:
+            first = timestamp
+        if speed > 0:
+            delay = (timestamp - first) / speed - (time.perf_counter() - begin)
+            if delay > 0:
+                time.sleep(delay)
+        send(payload)
+        sent += 1
+        sent_bytes += len(payload)
+    return sent, sent_bytes, time.perf_counter() - begin
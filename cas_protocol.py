@@ -0,0 +1,938 @@
+# File: cas_protocol.py
+# Wire format shared by cas_bridge.py (Cascadeur) and max_receiver.py (3ds Max).
+# Keep this file next to both scripts.
+import sys
+import json
+import re
+import math
+import time
+import select
+import zlib
+import struct
+import threading
+from array import array
+from collections import deque
+
+PROTOCOL_VERSION = 1
+
+FORMAT_QUANTIZED = "quantized"
+FORMAT_BINARY = "binary"
+FORMAT_JSON = "json"
+# What a receiver accepts, and what a sender offers unless asked for
+# quantized poses (both in order of preference)
+SUPPORTED_FORMATS = (FORMAT_QUANTIZED, FORMAT_BINARY, FORMAT_JSON)
+DEFAULT_FORMATS = (FORMAT_BINARY, FORMAT_JSON)
+# Optional extras a receiver lists in its HELLO reply
+FEATURE_STAMPS = "stamps"
+SUPPORTED_FEATURES = (FEATURE_STAMPS,)
+
+# --- Binary Messages ---
+# Every binary message starts with a fixed header, so its full size is known
+# as soon as the header has arrived.
+POSE_MAGIC = b"CASP"
+LAYOUT_MAGIC = b"CASL"
+BLOCK_MAGIC = b"CASB"
+QPOSE_MAGIC = b"CASQ"
+QRANGE_MAGIC = b"CASR"
+STAMP_MAGIC = b"CAST"
+BINARY_MAGICS = (POSE_MAGIC, LAYOUT_MAGIC, BLOCK_MAGIC, QPOSE_MAGIC, QRANGE_MAGIC, STAMP_MAGIC)
+
+# magic, version, flags, layout id, frame, joint count
+# followed by float32 positions (N*3) and float32 quaternions xyzw (N*4).
+# Delta poses (FLAG_DELTA) carry only the changed joints and put their
+# uint16 layout indices (N) in front of the float arrays.
+POSE_HEADER = struct.Struct("<4sBBHiI")
+FLAG_DELTA = 0x01
+# magic, version, flags, layout id, names length
+# followed by the utf-8 joint names separated by "\n"
+LAYOUT_HEADER = struct.Struct("<4sBBHI")
+# magic, version, flags, layout id, block id, first frame, frame count,
+# payload size. Bulk transfer of consecutive frames: the payload holds the
+# positions, then the quaternions, channel by channel (joint 0 x for every
+# frame, joint 0 y for every frame, ...), zlib compressed with BLOCK_ZLIB.
+# The block id doubles as the request id the receiver acknowledges.
+BLOCK_HEADER = struct.Struct("<4sBBHIiII")
+BLOCK_ZLIB = 0x01
+BLOCK_QUANTIZED = 0x02   # payload starts with its own range message
+# magic, version, flags, layout id, position min xyz, position max xyz,
+# position bits, rotation bits. Quantization settings for the poses of a
+# layout; sent before the first quantized pose and whenever the range changes.
+QRANGE_HEADER = struct.Struct("<4sBBH6fBB")
+# magic, version, flags, layout id, frame, joint count, payload size,
+# followed by [uint16 indices (FLAG_DELTA)], fixed-point positions and
+# smallest-three quaternions, each bit-packed (see _pack_bits). Single poses
+# are not compressed: a zlib stream costs more than it saves on one pose.
+QPOSE_HEADER = struct.Struct("<4sBBHiII")
+# magic, version, flags, reserved, sender wall clock (time.time()) when the
+# pose was sampled. Sent right before a pose for end-to-end latency; only to
+# receivers that list FEATURE_STAMPS in their HELLO reply.
+STAMP_HEADER = struct.Struct("<4sBBHd")
+
+POS_STRIDE = 3
+ROT_STRIDE = 4
+
+_FLOAT_SIZE = array("f").itemsize
+_INDEX_SIZE = 2
+_BIG_ENDIAN = sys.byteorder != "little"
+# Bytes that matter when delimiting unframed JSON, outside / inside a string
+_JSON_BRACES = re.compile(rb'[{}"]')
+_JSON_STRING = re.compile(rb'["\\]')
+
+
+class PoseFrame:
+    # One streamed pose: joint names plus flat float arrays (no per-joint dicts).
+    # For a delta pose, indices lists which joints of names the arrays hold.
+    __slots__ = ("frame", "names", "pos", "rot", "indices")
+
+    def __init__(self, frame, names, pos, rot, indices=None):
+        self.frame = frame
+        self.names = names
+        self.pos = pos
+        self.rot = rot
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.names) if self.indices is None else len(self.indices)
+
+    def joints(self):
+        # Layout index of every joint carried in the arrays
+        return range(len(self.names)) if self.indices is None else self.indices
+
+    @classmethod
+    def from_json(cls, frame, data_list):
+        names = []
+        pos = array("f")
+        rot = array("f")
+        for bone in data_list:
+            names.append(bone.get("n"))
+            pos.extend(bone.get("p"))
+            rot.extend(bone.get("r"))
+        return cls(frame, tuple(names), pos, rot)
+
+
+class PoseBlock:
+    # Consecutive full poses from a bulk transfer, stored channel by channel
+    __slots__ = ("block_id", "first", "count", "names", "pos", "rot")
+
+    def __init__(self, block_id, first, count, names, pos, rot):
+        self.block_id = block_id
+        self.first = first
+        self.count = count
+        self.names = names
+        self.pos = pos
+        self.rot = rot
+
+    def __len__(self):
+        return self.count
+
+    def poses(self):
+        count = self.count
+        return [PoseFrame(self.first + f, self.names, self.pos[f::count], self.rot[f::count]) for f in range(count)]
+
+
+def _float_bytes(values):
+    if not isinstance(values, array) or values.typecode != "f":
+        values = array("f", values)
+    if _BIG_ENDIAN:
+        values = array("f", values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _float_array(view):
+    values = array("f")
+    values.frombytes(view)
+    if _BIG_ENDIAN:
+        values.byteswap()
+    return values
+
+
+def _index_bytes(indices, typecode="H"):
+    values = array(typecode, indices)
+    if _BIG_ENDIAN:
+        values.byteswap()
+    return values.tobytes()
+
+
+def _index_array(view, typecode="H"):
+    values = array(typecode)
+    values.frombytes(view)
+    if _BIG_ENDIAN:
+        values.byteswap()
+    return values
+
+
+def encode_layout(layout_id, names):
+    blob = "\n".join(names).encode("utf-8")
+    return LAYOUT_HEADER.pack(LAYOUT_MAGIC, PROTOCOL_VERSION, 0, layout_id, len(blob)) + blob
+
+
+def encode_pose(layout_id, frame, pos, rot, indices=None):
+    count = len(pos) // POS_STRIDE
+    if indices is None:
+        header = POSE_HEADER.pack(POSE_MAGIC, PROTOCOL_VERSION, 0, layout_id, int(frame), count)
+        return b"".join((header, _float_bytes(pos), _float_bytes(rot)))
+    header = POSE_HEADER.pack(POSE_MAGIC, PROTOCOL_VERSION, FLAG_DELTA, layout_id, int(frame), count)
+    return b"".join((header, _index_bytes(indices), _float_bytes(pos), _float_bytes(rot)))
+
+
+def _channels(values, stride):
+    # Frame-major (frame, channel) -> channel-major (channel, frame)
+    out = array(values.typecode)
+    for c in range(stride):
+        out.extend(values[c::stride])
+    return out
+
+
+def _frames(values, count):
+    # Channel-major back to frame-major
+    out = array(values.typecode)
+    for f in range(count):
+        out.extend(values[f::count])
+    return out
+
+
+def encode_block(layout_id, block_id, first_frame, count, pos, rot, level=1, quantizer=None):
+    # pos / rot: count sampled frames back to back, as PoseSampler lays them
+    # out. level 0 sends the channels uncompressed. With a quantizer the
+    # channels hold fixed-point positions and one packed integer per
+    # quaternion; the range covering the block goes in front.
+    stride = len(pos) // count if count else 0
+    joints = stride // POS_STRIDE
+    flags = 0
+    if quantizer is None:
+        payload = _float_bytes(_channels(pos, stride)) + _float_bytes(_channels(rot, joints * ROT_STRIDE))
+    else:
+        flags |= BLOCK_QUANTIZED
+        payload = b"".join((
+            encode_range(layout_id, quantizer),
+            _pack_bits(_channels(quantizer.quantize_pos(pos), stride), quantizer.pos_bits),
+            _pack_bits(_channels(quantizer.quantize_rot(rot), joints), quantizer.rot_field)))
+    if level:
+        payload = zlib.compress(payload, level)
+        flags |= BLOCK_ZLIB
+    header = BLOCK_HEADER.pack(BLOCK_MAGIC, PROTOCOL_VERSION, flags, layout_id, block_id, int(first_frame), count, len(payload))
+    return header + payload
+
+
+def decode_block(buf, names):
+    magic, version, flags, layout_id, block_id, first, count, size = BLOCK_HEADER.unpack_from(buf)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported block version {version}")
+    payload = bytes(memoryview(buf)[BLOCK_HEADER.size:BLOCK_HEADER.size + size])
+    if flags & BLOCK_ZLIB:
+        try:
+            payload = zlib.decompress(payload)
+        except zlib.error as e:
+            raise ValueError(f"Corrupt block {block_id}: {e}")
+    if flags & BLOCK_QUANTIZED:
+        quantizer = decode_range(payload)[1]
+        joints = len(names)
+        start = QRANGE_HEADER.size
+        values = count * joints
+        split = start + _packed_size(values * POS_STRIDE, quantizer.pos_bits)
+        if len(payload) != split + _packed_size(values, quantizer.rot_field):
+            raise ValueError(f"Block {block_id} does not match layout {layout_id} ({joints} joints)")
+        pos = _unpack_bits(payload[start:split], quantizer.pos_bits, values * POS_STRIDE, quantizer.pos_code)
+        rot = _unpack_bits(payload[split:], quantizer.rot_field, values, quantizer.rot_code)
+        pos = quantizer.dequantize_pos(_frames(pos, count))
+        rot = quantizer.dequantize_rot(_frames(rot, count))
+        # PoseBlock keeps channels together, like the float payload
+        pos = _channels(pos, joints * POS_STRIDE)
+        rot = _channels(rot, joints * ROT_STRIDE)
+        return PoseBlock(block_id, first, count, names, pos, rot)
+
+    split = count * len(names) * POS_STRIDE * _FLOAT_SIZE
+    if len(payload) != split // POS_STRIDE * (POS_STRIDE + ROT_STRIDE):
+        raise ValueError(f"Block {block_id} does not match layout {layout_id} ({len(names)} joints)")
+    return PoseBlock(block_id, first, count, names, _float_array(payload[:split]), _float_array(payload[split:]))
+
+
+# --- Quantized Poses ---
+POS_BITS = 16
+ROT_BITS = 10
+_SQRT1_2 = math.sqrt(0.5)
+
+
+def _int_code(bits):
+    # Smallest unsigned array type that holds bits (in memory; on the wire
+    # values take exactly bits each, see _pack_bits)
+    for code in ("B", "H", "I", "Q"):
+        if array(code).itemsize * 8 >= bits:
+            return code
+    raise ValueError(f"{bits} bits do not fit an integer array")
+
+
+def _packed_size(count, bits):
+    return (count * bits + 7) // 8
+
+
+def _pack_bits(values, bits):
+    # Unsigned values below 2**bits -> bits each, most significant first,
+    # zero bits up to the next byte at the end. Eight values make a whole
+    # number of bytes, so they are packed eight at a time.
+    values = list(values)
+    count = len(values)
+    values.extend([0] * (-count % 8))
+    out = []
+    for g in range(0, len(values), 8):
+        v0, v1, v2, v3, v4, v5, v6, v7 = values[g:g + 8]
+        n = (((((((v0 << bits | v1) << bits | v2) << bits | v3) << bits | v4) << bits | v5) << bits | v6) << bits) | v7
+        out.append(n.to_bytes(bits, "big"))
+    return b"".join(out)[:_packed_size(count, bits)]
+
+
+def _unpack_bits(data, bits, count, typecode):
+    mask = (1 << bits) - 1
+    shifts = tuple(bits * i for i in range(7, -1, -1))
+    from_bytes = int.from_bytes
+    data = bytes(data) + bytes(-len(data) % bits)
+    out = []
+    extend = out.extend
+    for g in range(0, len(data), bits):
+        n = from_bytes(data[g:g + bits], "big")
+        extend([n >> s & mask for s in shifts])
+    del out[count:]
+    return array(typecode, out)
+
+
+class Quantizer:
+    # Positions become fixed-point offsets inside [lo, hi] per axis with
+    # pos_bits per value. Quaternions use smallest-three: the largest
+    # component is dropped (2 bits say which, its sign is made positive) and
+    # the other three, which lie in +-1/sqrt(2), get rot_bits each. Fields
+    # are bit-packed on the wire, so any width counts: 12/8 is smaller than
+    # 16/10.
+    def __init__(self, lo, hi, pos_bits=POS_BITS, rot_bits=ROT_BITS):
+        if not 2 <= pos_bits <= 32 or not 2 <= rot_bits <= 20:
+            raise ValueError(f"Unsupported precision: {pos_bits} position bits, {rot_bits} rotation bits")
+        self.lo = tuple(float(v) for v in lo)
+        self.hi = tuple(max(float(h), l + 1e-6) for l, h in zip(self.lo, hi))
+        self.pos_bits = pos_bits
+        self.rot_bits = rot_bits
+        self.rot_field = 2 + 3 * rot_bits
+        self.pos_code = _int_code(pos_bits)
+        self.rot_code = _int_code(self.rot_field)
+        self._pos_max = (1 << pos_bits) - 1
+        self._rot_max = (1 << rot_bits) - 1
+        self.steps = tuple((h - l) / self._pos_max for l, h in zip(self.lo, self.hi))
+        # An even number of steps, so 0 (identity rotations) is exact
+        self._rot_step = 2.0 * _SQRT1_2 / (self._rot_max - 1)
+
+    @classmethod
+    def around(cls, pos, margin, pos_bits=POS_BITS, rot_bits=ROT_BITS):
+        # Range covering the pose positions plus margin on every side
+        lo = [min(pos[c::POS_STRIDE]) - margin for c in range(POS_STRIDE)]
+        hi = [max(pos[c::POS_STRIDE]) + margin for c in range(POS_STRIDE)]
+        return cls(lo, hi, pos_bits, rot_bits)
+
+    def contains(self, pos):
+        for c in range(POS_STRIDE):
+            axis = pos[c::POS_STRIDE]
+            if axis and (min(axis) < self.lo[c] or max(axis) > self.hi[c]):
+                return False
+        return True
+
+    def pos_error(self):
+        # Largest per-axis position error for values inside the range: half a
+        # step, plus the float32 rounding of the decoded value
+        extent = max(max(abs(l), abs(h)) for l, h in zip(self.lo, self.hi))
+        return max(self.steps) / 2.0 + extent * 2.0 ** -24
+
+    def rot_error(self):
+        # Upper bound of the angle (radians) between a unit quaternion and its
+        # decoded version. The three sent components are off by at most e
+        # together; the rebuilt largest one (>= 1/2) by at most 2*sqrt(3)*e + 2*e^2.
+        # float32 rounding of the decoded components is added to e.
+        e = math.sqrt(3.0) * (self._rot_step / 2.0 + 2.0 ** -24)
+        chord = math.hypot(e, 2.0 * math.sqrt(3.0) * e + 2.0 * e * e)
+        return 4.0 * math.asin(min(1.0, chord / 2.0))
+
+    def quantize_pos(self, pos):
+        out = array(self.pos_code, bytes(len(pos) * array(self.pos_code).itemsize))
+        top = self._pos_max
+        for c in range(POS_STRIDE):
+            lo = self.lo[c]
+            k = 1.0 / self.steps[c]
+            out[c::POS_STRIDE] = array(self.pos_code, [0 if v <= lo else min(top, int((v - lo) * k + 0.5)) for v in pos[c::POS_STRIDE]])
+        return out
+
+    def dequantize_pos(self, values):
+        out = array("f", bytes(len(values) * _FLOAT_SIZE))
+        for c in range(POS_STRIDE):
+            lo = self.lo[c]
+            step = self.steps[c]
+            out[c::POS_STRIDE] = array("f", [lo + q * step for q in values[c::POS_STRIDE]])
+        return out
+
+    def quantize_rot(self, rot):
+        bits = self.rot_bits
+        top = self._rot_max
+        k = 1.0 / self._rot_step
+        out = array(self.rot_code)
+        append = out.append
+        for r in range(0, len(rot), ROT_STRIDE):
+            q = rot[r:r + ROT_STRIDE]
+            a0, a1, a2, a3 = abs(q[0]), abs(q[1]), abs(q[2]), abs(q[3])
+            largest = 0
+            big = a0
+            if a1 > big: largest, big = 1, a1
+            if a2 > big: largest, big = 2, a2
+            if a3 > big: largest, big = 3, a3
+            sign = -1.0 if q[largest] < 0.0 else 1.0
+            packed = largest
+            for i in range(ROT_STRIDE):
+                if i == largest: continue
+                v = int((q[i] * sign + _SQRT1_2) * k + 0.5)
+                packed = (packed << bits) | (0 if v < 0 else top if v > top else v)
+            append(packed)
+        return out
+
+    def dequantize_rot(self, values):
+        bits = self.rot_bits
+        top = self._rot_max
+        step = self._rot_step
+        out = array("f", bytes(len(values) * ROT_STRIDE * _FLOAT_SIZE))
+        r = 0
+        for packed in values:
+            largest = packed >> (3 * bits)
+            c = packed >> (2 * bits) & top
+            b = packed >> bits & top
+            a = packed & top
+            x = c * step - _SQRT1_2
+            y = b * step - _SQRT1_2
+            z = a * step - _SQRT1_2
+            w = math.sqrt(max(0.0, 1.0 - x * x - y * y - z * z))
+            if largest == 0: out[r:r + 4] = array("f", (w, x, y, z))
+            elif largest == 1: out[r:r + 4] = array("f", (x, w, y, z))
+            elif largest == 2: out[r:r + 4] = array("f", (x, y, w, z))
+            else: out[r:r + 4] = array("f", (x, y, z, w))
+            r += ROT_STRIDE
+        return out
+
+
+def encode_range(layout_id, quantizer):
+    return QRANGE_HEADER.pack(QRANGE_MAGIC, PROTOCOL_VERSION, 0, layout_id,
+                              *quantizer.lo, *quantizer.hi, quantizer.pos_bits, quantizer.rot_bits)
+
+
+def decode_range(buf):
+    header = QRANGE_HEADER.unpack_from(buf)
+    if header[1] != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported range version {header[1]}")
+    return header[3], Quantizer(header[4:7], header[7:10], header[10], header[11])
+
+
+def encode_qpose(layout_id, frame, pos, rot, quantizer, indices=None):
+    parts = []
+    flags = 0
+    if indices is not None:
+        flags |= FLAG_DELTA
+        parts.append(_index_bytes(indices))
+    parts.append(_pack_bits(quantizer.quantize_pos(pos), quantizer.pos_bits))
+    parts.append(_pack_bits(quantizer.quantize_rot(rot), quantizer.rot_field))
+    payload = b"".join(parts)
+    count = len(pos) // POS_STRIDE
+    return QPOSE_HEADER.pack(QPOSE_MAGIC, PROTOCOL_VERSION, flags, layout_id, int(frame), count, len(payload)) + payload
+
+
+def decode_qpose(buf, names, quantizer):
+    magic, version, flags, layout_id, frame, count, size = QPOSE_HEADER.unpack_from(buf)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported pose version {version}")
+    payload = bytes(memoryview(buf)[QPOSE_HEADER.size:QPOSE_HEADER.size + size])
+    start = 0
+    indices = None
+    if flags & FLAG_DELTA:
+        indices = _index_array(payload[:count * _INDEX_SIZE])
+        start = count * _INDEX_SIZE
+        if count and max(indices) >= len(names):
+            raise ValueError(f"Delta pose indexes past layout {layout_id} ({len(names)} joints)")
+    elif count != len(names):
+        raise ValueError(f"Pose has {count} joints but layout {layout_id} has {len(names)}")
+    mid = start + _packed_size(count * POS_STRIDE, quantizer.pos_bits)
+    if len(payload) != mid + _packed_size(count, quantizer.rot_field):
+        raise ValueError(f"Quantized pose size does not match {count} joints")
+    pos = quantizer.dequantize_pos(_unpack_bits(payload[start:mid], quantizer.pos_bits, count * POS_STRIDE, quantizer.pos_code))
+    rot = quantizer.dequantize_rot(_unpack_bits(payload[mid:], quantizer.rot_field, count, quantizer.rot_code))
+    return PoseFrame(frame, names, pos, rot, indices)
+
+
+def message_size(buf):
+    # Total size of the binary message at the start of buf, or None if the
+    # header is still incomplete.
+    magic = bytes(buf[:4])
+    if magic == POSE_MAGIC:
+        if len(buf) < POSE_HEADER.size: return None
+        header = POSE_HEADER.unpack_from(buf)
+        count = header[5]
+        size = POSE_HEADER.size + count * (POS_STRIDE + ROT_STRIDE) * _FLOAT_SIZE
+        if header[2] & FLAG_DELTA:
+            size += count * _INDEX_SIZE
+        return size
+    if magic == LAYOUT_MAGIC:
+        if len(buf) < LAYOUT_HEADER.size: return None
+        return LAYOUT_HEADER.size + LAYOUT_HEADER.unpack_from(buf)[4]
+    if magic == BLOCK_MAGIC:
+        if len(buf) < BLOCK_HEADER.size: return None
+        return BLOCK_HEADER.size + BLOCK_HEADER.unpack_from(buf)[7]
+    if magic == QPOSE_MAGIC:
+        if len(buf) < QPOSE_HEADER.size: return None
+        return QPOSE_HEADER.size + QPOSE_HEADER.unpack_from(buf)[6]
+    if magic == QRANGE_MAGIC:
+        return QRANGE_HEADER.size
+    if magic == STAMP_MAGIC:
+        return STAMP_HEADER.size
+    raise ValueError(f"Unknown message magic {magic!r}")
+
+
+def encode_stamp(sent_time):
+    return STAMP_HEADER.pack(STAMP_MAGIC, PROTOCOL_VERSION, 0, 0, sent_time)
+
+
+def decode_stamp(buf):
+    magic, version, flags, _, sent_time = STAMP_HEADER.unpack_from(buf)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported stamp version {version}")
+    return sent_time
+
+
+def decode_layout(buf):
+    magic, version, flags, layout_id, length = LAYOUT_HEADER.unpack_from(buf)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported layout version {version}")
+    blob = bytes(buf[LAYOUT_HEADER.size:LAYOUT_HEADER.size + length])
+    names = tuple(blob.decode("utf-8").split("\n")) if blob else ()
+    return layout_id, names
+
+
+def decode_pose(buf, names):
+    magic, version, flags, layout_id, frame, count = POSE_HEADER.unpack_from(buf)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported pose version {version}")
+    view = memoryview(buf)
+    start = POSE_HEADER.size
+    indices = None
+    if flags & FLAG_DELTA:
+        indices = _index_array(view[start:start + count * _INDEX_SIZE])
+        start += count * _INDEX_SIZE
+        if count and max(indices) >= len(names):
+            raise ValueError(f"Delta pose indexes past layout {layout_id} ({len(names)} joints)")
+    elif count != len(names):
+        raise ValueError(f"Pose has {count} joints but layout {layout_id} has {len(names)}")
+    mid = start + count * POS_STRIDE * _FLOAT_SIZE
+    end = mid + count * ROT_STRIDE * _FLOAT_SIZE
+    return PoseFrame(frame, names, _float_array(view[start:mid]), _float_array(view[mid:end]), indices)
+
+
+def apply_delta(base, delta):
+    # Writes the joints of a delta pose into a full pose, in place
+    pos = base.pos
+    rot = base.rot
+    dpos = delta.pos
+    drot = delta.rot
+    for k, i in enumerate(delta.indices):
+        pos[i * 3:i * 3 + 3] = dpos[k * 3:k * 3 + 3]
+        rot[i * 4:i * 4 + 4] = drot[k * 4:k * 4 + 4]
+    base.frame = delta.frame
+
+
+def same_pose(base, pose):
+    # True when applying pose (full or delta) on top of the full pose base
+    # would not change anything, including the frame
+    if base is None or base.names != pose.names or base.frame != pose.frame:
+        return False
+    if pose.indices is None:
+        return base.pos == pose.pos and base.rot == pose.rot
+    pos = base.pos
+    rot = base.rot
+    dpos = pose.pos
+    drot = pose.rot
+    for k, i in enumerate(pose.indices):
+        if pos[i * 3:i * 3 + 3] != dpos[k * 3:k * 3 + 3] or rot[i * 4:i * 4 + 4] != drot[k * 4:k * 4 + 4]:
+            return False
+    return True
+
+
+def merge_poses(older, newer):
+    # Folds an older, never applied pose into a newer one so dropping the
+    # older one does not lose the joints only it carried.
+    if newer.indices is None or older.names != newer.names:
+        return newer
+    if older.indices is None:
+        merged = PoseFrame(older.frame, older.names, array("f", older.pos), array("f", older.rot))
+        apply_delta(merged, newer)
+        return merged
+
+    joints = {}
+    for k, i in enumerate(older.indices):
+        joints[i] = (older.pos[k * 3:k * 3 + 3], older.rot[k * 4:k * 4 + 4])
+    for k, i in enumerate(newer.indices):
+        joints[i] = (newer.pos[k * 3:k * 3 + 3], newer.rot[k * 4:k * 4 + 4])
+    indices = array("H", sorted(joints))
+    pos = array("f")
+    rot = array("f")
+    for i in indices:
+        p, r = joints[i]
+        pos.extend(p)
+        rot.extend(r)
+    return PoseFrame(newer.frame, newer.names, pos, rot, indices)
+
+
+def pose_layout_id(buf):
+    # Same position in pose and block headers
+    return POSE_HEADER.unpack_from(buf)[3]
+
+
+def decode_binary(buf, layouts):
+    # Decodes one binary message. Layouts are stored into the dict and return
+    # None, poses come back as a PoseFrame and bulk blocks as a PoseBlock
+    # (None if the layout is unknown). A stamp is kept under "stamp" until
+    # the receiver takes it for the pose that follows.
+    if len(buf) < 4 or bytes(buf[:4]) not in BINARY_MAGICS:
+        raise ValueError("Not a binary message")
+    try:
+        if message_size(buf) != len(buf):
+            raise ValueError("Binary message size does not match its frame")
+        magic = bytes(buf[:4])
+        if magic == LAYOUT_MAGIC:
+            layout_id, names = decode_layout(buf)
+            layouts[layout_id] = names
+            return None
+        if magic == QRANGE_MAGIC:
+            # Kept next to the names, under a key no layout id can have
+            layout_id, quantizer = decode_range(buf)
+            layouts[("range", layout_id)] = quantizer
+            return None
+        if magic == STAMP_MAGIC:
+            layouts["stamp"] = decode_stamp(buf)
+            return None
+        layout_id = pose_layout_id(buf)
+        names = layouts.get(layout_id)
+        if names is None: return None
+        if magic == BLOCK_MAGIC:
+            return decode_block(buf, names)
+        if magic == QPOSE_MAGIC:
+            quantizer = layouts.get(("range", layout_id))
+            if quantizer is None: return None
+            return decode_qpose(buf, names, quantizer)
+        return decode_pose(buf, names)
+    except struct.error as e:
+        raise ValueError(f"Truncated binary message: {e}")
+
+
+def is_binary(buf):
+    return bytes(buf[:4]) in BINARY_MAGICS
+
+
+# --- Stream Framing ---
+# After the HELLO handshake every message is sent as a u32 payload length and
+# a channel byte, followed by the payload (JSON or binary). Senders that never
+# say HELLO (older cas_bridge versions, one-shot commands) send bare JSON
+# objects back to back, which FrameReader still splits correctly.
+FRAME_HEADER = struct.Struct("<IB")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+CHANNEL_CONTROL = 0
+CHANNEL_POSE = 1
+CHANNEL_MESH = 2
+CHANNEL_HEARTBEAT = 3
+
+
+def frame(payload, channel=CHANNEL_POSE):
+    return FRAME_HEADER.pack(len(payload), channel) + payload
+
+
+class FrameReader:
+    # Incremental reader over a single growable bytearray. Payloads are
+    # yielded as memoryviews into the buffer, so they are only valid until
+    # the next recv_from()/feed() call.
+    def __init__(self, capacity=64 * 1024, max_size=MAX_FRAME_SIZE):
+        self.buf = bytearray(capacity)
+        self.start = 0
+        self.end = 0
+        self.need = 0
+        self.skip = 0
+        self.max_size = max_size
+        self.framed = False
+        self._json = json.JSONDecoder()
+        # Unframed scan state: bytes of the current object already scanned
+        self._scanned = 0
+        self._depth = 0
+        self._in_string = False
+
+        self.frames = 0
+        self.malformed = 0
+        self.oversized = 0
+        self.bytes_received = 0
+
+    def pending(self):
+        return self.end - self.start
+
+    def _make_room(self):
+        size = self.end - self.start
+        wanted = max(self.need, size + 1)
+        if wanted > len(self.buf):
+            # Fresh buffer instead of resizing: old views may still be alive
+            new_buf = bytearray(max(wanted, len(self.buf) * 2))
+            new_buf[:size] = self.buf[self.start:self.end]
+            self.buf = new_buf
+        elif self.start and len(self.buf) - self.end < max(wanted - size, len(self.buf) // 4):
+            self.buf[:size] = self.buf[self.start:self.end]
+        else:
+            return
+        self.start = 0
+        self.end = size
+
+    def recv_from(self, sock, limit=None):
+        # Returns the number of bytes read (at most limit), 0 when the peer closed
+        self._make_room()
+        view = memoryview(self.buf)[self.end:]
+        n = sock.recv_into(view if limit is None else view[:limit])
+        self.end += n
+        self.bytes_received += n
+        return n
+
+    def feed(self, data):
+        data = memoryview(data)
+        while len(data):
+            self._make_room()
+            n = min(len(data), len(self.buf) - self.end)
+            self.buf[self.end:self.end + n] = data[:n]
+            self.end += n
+            self.bytes_received += n
+            data = data[n:]
+
+    def messages(self):
+        # Yields (channel, payload). Unframed JSON arrives as CHANNEL_CONTROL.
+        # The mode is checked per message, so a HELLO can switch it mid-buffer
+        while True:
+            msg = self._next_framed() if self.framed else self._next_json()
+            if msg is None: return
+            yield msg
+
+    def _next_framed(self):
+        header = FRAME_HEADER.size
+        while True:
+            if self.skip:
+                n = min(self.skip, self.end - self.start)
+                self.start += n
+                self.skip -= n
+                if self.skip: return None
+
+            available = self.end - self.start
+            if available < header: return None
+            size, channel = FRAME_HEADER.unpack_from(self.buf, self.start)
+            if size > self.max_size:
+                self.oversized += 1
+                self.start += header
+                self.skip = size
+                continue
+            if available < header + size:
+                self.need = header + size
+                return None
+
+            self.need = 0
+            begin = self.start + header
+            self.start = begin + size
+            self.frames += 1
+            return channel, memoryview(self.buf)[begin:begin + size]
+
+    def _next_json(self):
+        # Unframed mode: consecutive JSON objects with nothing in between.
+        # An object's end is found by scanning braces and strings, resuming
+        # where the last call stopped, so every byte is looked at once however
+        # the stream is split; only a complete object is decoded.
+        buf = self.buf
+        while True:
+            if not self._scanned:
+                while self.start < self.end and buf[self.start] in b" \t\r\n":
+                    self.start += 1
+                if self.start >= self.end: return None
+                if buf[self.start] != 0x7B:
+                    self._drop_malformed()
+                    return None
+
+            pos = self.start + self._scanned
+            depth = self._depth
+            in_string = self._in_string
+            while True:
+                m = (_JSON_STRING if in_string else _JSON_BRACES).search(buf, pos, self.end)
+                if m is None: break
+                c = buf[m.start()]
+                pos = m.end()
+                if in_string:
+                    if c == 0x5C: pos += 1  # skip the escaped byte
+                    else: in_string = False
+                elif c == 0x22: in_string = True
+                elif c == 0x7B: depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0: break
+
+            if m is None:
+                # Incomplete object, wait for more bytes
+                self._scanned = max(pos, self.end) - self.start
+                self._depth = depth
+                self._in_string = in_string
+                if self._scanned > self.max_size:
+                    self.oversized += 1
+                    self.start = self.end
+                    self._reset_scan()
+                return None
+
+            begin = self.start
+            self.start = pos
+            self._reset_scan()
+            payload = memoryview(buf)[begin:pos]
+            try:
+                self._json.decode(bytes(payload).decode("utf-8"))
+            except ValueError:
+                self.malformed += 1
+                continue
+            self.frames += 1
+            return CHANNEL_CONTROL, payload
+
+    def _reset_scan(self):
+        self._scanned = 0
+        self._depth = 0
+        self._in_string = False
+
+    def _drop_malformed(self):
+        self.malformed += 1
+        self.start = self.end
+        self._reset_scan()
+
+
+# --- Session ---
+class Session:
+    # One end of a framed connection. Sends are locked so the worker thread
+    # and the UI thread can both write to the same socket. Requests get an id
+    # and the other side answers with {"command": "ACK", "id": ...}.
+    def __init__(self, sock, framed=True):
+        self.sock = sock
+        self.reader = FrameReader()
+        self.reader.framed = framed
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.acks = {}
+        self.inbox = deque()
+        self.rtt = None
+        self.bytes_sent = 0
+
+    def send(self, payload, channel=CHANNEL_POSE):
+        data = frame(payload, channel)
+        with self.lock:
+            self.sock.sendall(data)
+        self.bytes_sent += len(data)
+
+    def send_raw(self, data):
+        # Pre-framed bytes (several frames in one write) or the HELLO reply
+        with self.lock:
+            self.sock.sendall(data)
+        self.bytes_sent += len(data)
+
+    def send_json(self, packet, channel=CHANNEL_CONTROL):
+        self.send(json.dumps(packet).encode("utf-8"), channel)
+
+    def new_id(self):
+        # Request ids, also used by bulk blocks, which are acked the same way
+        request_id = self.next_id
+        self.next_id += 1
+        return request_id
+
+    def request(self, packet, channel=CHANNEL_CONTROL):
+        # Sends packet with a fresh request id and returns the id
+        request_id = self.new_id()
+        packet = dict(packet, id=request_id)
+        self.send_json(packet, channel)
+        return request_id
+
+    def ack(self, packet, ok=True, **info):
+        if "id" not in packet: return
+        self.send_json(dict(info, command="ACK", id=packet["id"], ok=ok))
+
+    def ping(self):
+        self.send_json({"command": "PING", "t": time.perf_counter()}, CHANNEL_HEARTBEAT)
+
+    def poll(self, timeout=0.0):
+        # Reads whatever arrived within timeout. ACKs and heartbeats are
+        # handled here, everything else goes to inbox as (channel, message).
+        # Raises ConnectionError when the peer closed the connection.
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable: return
+        if not self.reader.recv_from(self.sock):
+            raise ConnectionError("Connection closed by peer")
+        for channel, payload in self.reader.messages():
+            if is_binary(payload):
+                self.inbox.append((channel, bytes(payload)))
+                continue
+            try:
+                packet = json.loads(bytes(payload).decode("utf-8"))
+            except ValueError:
+                self.reader.malformed += 1
+                continue
+            self.dispatch(channel, packet)
+
+    def dispatch(self, channel, packet):
+        command = packet.get("command")
+        if command == "ACK":
+            self.acks[packet.get("id")] = packet
+        elif command == "PING":
+            self.send_json({"command": "PONG", "t": packet.get("t")}, CHANNEL_HEARTBEAT)
+        elif command == "PONG":
+            if packet.get("t") is not None:
+                self.rtt = time.perf_counter() - packet["t"]
+        else:
+            self.inbox.append((channel, packet))
+
+    def wait_ack(self, request_id, timeout):
+        # Returns the ACK packet, or None on timeout
+        deadline = time.perf_counter() + timeout
+        while request_id not in self.acks:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0: return None
+            self.poll(remaining)
+        return self.acks.pop(request_id)
+
+
+# --- Negotiation ---
+# The sender opens with a JSON HELLO listing the formats it can speak and the
+# receiver answers with the one it picked. Old receivers never answer, so the
+# sender falls back to JSON. Optional session details ride along: namespace
+# (which character in Max this connection drives) and scale.
+def hello_packet(formats=DEFAULT_FORMATS, namespace=None, scale=None):
+    packet = {"command": "HELLO", "version": PROTOCOL_VERSION, "formats": list(formats)}
+    if namespace:
+        packet["namespace"] = namespace
+    if scale:
+        packet["scale"] = scale
+    return json.dumps(packet).encode("utf-8")
+
+
+# A reply also means the receiver reads length-prefixed frames from then on.
+def hello_reply(packet):
+    offered = packet.get("formats") or [FORMAT_JSON]
+    chosen = next((f for f in offered if f in SUPPORTED_FORMATS), FORMAT_JSON)
+    return json.dumps({"command": "HELLO", "version": PROTOCOL_VERSION, "format": chosen, "framing": "length",
+                       "features": list(SUPPORTED_FEATURES)}).encode("utf-8")
+
+
+def parse_hello_reply(data):
+    # Returns the chosen format, or None if this is not a valid reply
+    try:
+        reply = json.loads(data.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if reply.get("command") != "HELLO" or reply.get("framing") != "length": return None
+    chosen = reply.get("format")
+    return chosen if chosen in SUPPORTED_FORMATS else FORMAT_JSON
+
+
+def parse_hello_features(data):
+    # Features listed in a HELLO reply; older receivers list none
+    try:
+        reply = json.loads(data.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        return ()
+    return tuple(reply.get("features") or ())
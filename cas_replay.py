@@ -0,0 +1,77 @@
+# File: cas_replay.py
+# Plays a capture recorded by cas_bridge.py (RECORD_DIR) into the Max
+# receiver, without Cascadeur.
+#   python cas_replay.py capture.cascap                 -> real time
+#   python cas_replay.py capture.cascap --speed 4       -> 4x faster
+#   python cas_replay.py capture.cascap --speed 0       -> as fast as possible
+#   python cas_replay.py capture.cascap --frame 120     -> start at frame 120
+import sys
+import socket
+import argparse
+import threading
+
+import cas_protocol
+import cas_capture
+
+
+def connect(host, port, meta):
+    # Same handshake as cas_bridge.py; the receiver has to accept the
+    # recorded wire format, since records are replayed byte for byte
+    sock = socket.create_connection((host, port), timeout=2.0)
+    if not meta.get("framed"):
+        return sock
+    sock.sendall(cas_protocol.hello_packet((meta.get("format"),) + cas_protocol.DEFAULT_FORMATS))
+    chosen = cas_protocol.parse_hello_reply(sock.recv(1024))
+    if chosen != meta.get("format"):
+        sock.close()
+        raise ConnectionError(f"Receiver chose format {chosen}, capture is {meta.get('format')}")
+    return sock
+
+
+def drain(sock):
+    # The receiver talks back (FEEDBACK, ACK) but a replay has nothing to
+    # adjust, so everything it sends is read and dropped. Unread, it fills
+    # the socket buffers until Max blocks on send and the replay's own
+    # sendall times out halfway through a frame.
+    while True:
+        try:
+            if not sock.recv(65536): return
+        except socket.timeout:
+            continue
+        except OSError:
+            return
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Replay a live link capture into 3ds Max")
+    parser.add_argument("capture")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = real time, 0 = max speed")
+    parser.add_argument("--frame", type=int, default=None, help="start at the first keyframe at or after this frame")
+    parser.add_argument("--loop", action="store_true")
+    args = parser.parse_args(argv)
+
+    with cas_capture.CaptureReader(args.capture) as reader:
+        print(f"Capture: {reader.meta}, {len(reader.index)} keyframes")
+        sock = connect(args.host, args.port, reader.meta)
+        threading.Thread(target=drain, args=(sock,), name="cas_replay_drain", daemon=True).start()
+        try:
+            while True:
+                sent, sent_bytes, seconds = cas_capture.replay(reader, sock.sendall, args.speed, args.frame)
+                rate = sent / seconds if seconds > 0 else 0.0
+                print(f"Replayed {sent} records, {sent_bytes / 1024:.0f} KB in {seconds:.2f}s ({rate:.0f} records/s)")
+                if not args.loop: break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Wakes the drain thread as well
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,155 @@
+# File: cas_stats.py
+# Per-stage timing for the live link, shared by cas_bridge.py and
+# max_receiver.py. Keep this file next to both scripts.
+#   sender:   sample, encode, send, latency (echoed back by Max)
+#   receiver: recv (sender stamp -> worker), decode, queue (mailbox wait),
+#             apply, redraw, latency (sender stamp -> pose applied)
+# Disabled instruments return right away, so the calls can stay in the hot
+# path (see cas_bench.py stats for the cost either way).
+import csv
+import json
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+
+# Bucket upper bounds in milliseconds; the last bucket is everything above
+BUCKETS_MS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0, 1000.0)
+TRACE_EVENTS = 20000
+
+
+# ---------------------------------------------------------
+# HISTOGRAM (fixed log-spaced buckets, no per-sample storage)
+# ---------------------------------------------------------
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, p):
+        # Upper bound of the bucket holding the p-th sample (the maximum for
+        # the open last bucket), so estimates err on the slow side
+        if not self.count: return 0.0
+        rank = p * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(BUCKETS_MS[i], self.max) if i < len(BUCKETS_MS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.5), 3),
+            "p95_ms": round(self.percentile(0.95), 3),
+            "p99_ms": round(self.percentile(0.99), 3),
+            "max_ms": round(self.max, 3),
+        }
+
+
+# ---------------------------------------------------------
+# INSTRUMENTS (stage histograms, counters, optional trace)
+# ---------------------------------------------------------
+class Instruments:
+    # t = stats.now(); ...; stats.since("encode", t)
+    # One instance is shared by the worker and main threads (the receiver
+    # records decode on one and apply on the other), so recording and
+    # reading take a lock. trace keeps the last N (time, stage, ms) samples
+    # for export, 0 keeps none.
+    def __init__(self, enabled=True, trace=TRACE_EVENTS):
+        self.enabled = enabled
+        self.trace_size = trace
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.counters = {}
+            self.trace = deque(maxlen=self.trace_size) if self.trace_size else None
+            self.start = time.perf_counter()
+
+    def now(self):
+        return time.perf_counter() if self.enabled else 0.0
+
+    def since(self, stage, start):
+        if not self.enabled: return
+        end = time.perf_counter()
+        self.add(stage, end - start, end)
+
+    def add(self, stage, seconds, at=None):
+        if not self.enabled: return
+        ms = seconds * 1000.0
+        with self.lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = Histogram()
+            hist.add(ms)
+            if self.trace is not None:
+                self.trace.append((round((at or time.perf_counter()) - self.start, 6), stage, round(ms, 4)))
+
+    def count(self, name, n=1):
+        if not self.enabled: return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "elapsed_s": round(time.perf_counter() - self.start, 3),
+                "stages": {name: hist.summary() for name, hist in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+    def lines(self):
+        # One line per stage, for logs and the Max stats panel
+        snap = self.snapshot()
+        out = []
+        for name, s in snap["stages"].items():
+            out.append(f"{name:<8} {s['count']:7d}  avg {s['mean_ms']:7.2f}  p95 {s['p95_ms']:7.2f}  max {s['max_ms']:7.2f} ms")
+        if snap["counters"]:
+            out.append("  ".join(f"{k} {v}" for k, v in snap["counters"].items()))
+        return out
+
+    def export(self, path):
+        # .json: summary and trace in one file. .csv: one row per stage, and
+        # the trace next to it as <name>_trace.csv. Returns the paths written.
+        snap = self.snapshot()
+        with self.lock:
+            trace = list(self.trace) if self.trace is not None else []
+        if not path.lower().endswith(".csv"):
+            snap["trace"] = [{"t": t, "stage": stage, "ms": ms} for t, stage, ms in trace]
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(snap, f, indent=1)
+            return [path]
+
+        fields = ("count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(("stage",) + fields)
+            for name, s in snap["stages"].items():
+                writer.writerow([name] + [s[k] for k in fields])
+            for name, value in snap["counters"].items():
+                writer.writerow([name, value])
+        paths = [path]
+        if trace:
+            trace_path = path[:-4] + "_trace.csv"
+            with open(trace_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(("time_s", "stage", "ms"))
+                writer.writerows(trace)
+            paths.append(trace_path)
+        return paths
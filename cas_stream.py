@@ -0,0 +1,918 @@
+# File: cas_stream.py
+# Sender-side stream stages for cas_bridge.py. No csc imports here, so these
+# run (and can be benchmarked) outside Cascadeur.
+import os
+import re
+import time
+import errno
+import hashlib
+import random
+import itertools
+import select
+import socket
+import struct
+import datetime
+import threading
+from array import array
+from collections import deque
+from operator import attrgetter
+
+import cas_protocol
+
+DELTA_EPSILON = 1e-4
+KEYFRAME_INTERVAL = 50
+JOINT_INCLUDE = r"Joint|Center|Point"
+BLOCK_FRAMES = 64
+BLOCK_WINDOW = 4
+BLOCK_LEVEL = 1
+SEND_RATE = 50.0
+MIN_SEND_RATE = 10.0
+MAX_SEND_RATE = 120.0
+RATE_HEADROOM = 0.8     # aim for this share of what the receiver can apply
+RATE_STEP_UP = 1.2      # growth per clean feedback report
+RATE_STEP_DOWN = 0.75   # cut when the receiver dropped poses
+LOG_MAX_BYTES = 1024 * 1024
+LOG_BACKUPS = 2
+LOG_FLUSH_INTERVAL = 0.5
+LOG_REPEAT_INTERVAL = 5.0
+LOG_REPEAT_BURST = 3
+
+
+# ---------------------------------------------------------
+# JOINT SELECTION (cached filter over the selected objects)
+# ---------------------------------------------------------
+def _compile_rule(rule):
+    # A rule is a regex string (searched in the name) or a list of exact names
+    if rule is None:
+        return None
+    if isinstance(rule, str):
+        return re.compile(rule).search
+    return frozenset(rule).__contains__
+
+
+class JointFilter:
+    def __init__(self, include=JOINT_INCLUDE, exclude=None):
+        self.include = _compile_rule(include)
+        self.exclude = _compile_rule(exclude)
+
+    def __call__(self, name):
+        if self.include is not None and not self.include(name):
+            return False
+        if self.exclude is not None and self.exclude(name):
+            return False
+        return True
+
+
+_get_name = attrgetter("name")
+
+
+class JointSelection:
+    # Filters the selection only when it changes. The selection is
+    # fingerprinted every tick by its names, which is all the filter and
+    # the stream layout go by (so a rename counts as a change); as long as
+    # it matches, the cached positions and names are reused without running
+    # the filter again.
+    def __init__(self, joint_filter=None):
+        self.filter = joint_filter or JointFilter()
+        self.fingerprint = None
+        self.kept = ()
+        self.names = ()
+        self.rebuilds = 0
+
+    def invalidate(self):
+        self.fingerprint = None
+
+    def update(self, objects):
+        # Returns the joint objects of this selection, in selection order
+        if not objects:
+            return []
+        fingerprint = tuple(map(_get_name, objects))
+        if fingerprint != self.fingerprint:
+            self.fingerprint = fingerprint
+            keep = self.filter
+            kept = []
+            names = []
+            for i, name in enumerate(fingerprint):
+                if keep(name):
+                    kept.append(i)
+                    names.append(name)
+            self.kept = tuple(kept) if len(kept) < len(objects) else None
+            self.names = tuple(names)
+            self.rebuilds += 1
+        if self.kept is None:
+            return list(objects)
+        return [objects[i] for i in self.kept]
+
+
+# ---------------------------------------------------------
+# POSE SAMPLER (transforms -> preallocated float arrays)
+# ---------------------------------------------------------
+class PoseSampler:
+    # Fills the same position (N*3) and quaternion (N*4) arrays every tick,
+    # laid out exactly like the binary pose message so the encoder can write
+    # them as they are. The arrays are only reallocated when N changes.
+    # Values are packed straight into the array buffers with struct, one call
+    # per vector. NumPy is not used on purpose: per-element writes from
+    # Python are slower into an ndarray than into array('f').
+    _pack_pos = struct.Struct("3f").pack_into
+    _pack_rot = struct.Struct("4f").pack_into
+
+    def __init__(self):
+        self.count = 0
+        self.pos = array("f")
+        self.rot = array("f")
+        self.resizes = 0
+
+    def resize(self, count):
+        if count == self.count: return
+        self.count = count
+        self.pos = array("f", bytes(count * 3 * self.pos.itemsize))
+        self.rot = array("f", bytes(count * 4 * self.rot.itemsize))
+        self.resizes += 1
+
+    def sample(self, joints):
+        self.resize(len(joints))
+        pos = self.pos
+        rot = self.rot
+        pack_pos = self._pack_pos
+        pack_rot = self._pack_rot
+        p = 0
+        r = 0
+        for obj in joints:
+            tf = obj.get_global_transform()
+            t = tf.translation
+            q = tf.rotation
+            pack_pos(pos, p, t.x, t.y, t.z)
+            pack_rot(rot, r, q.x, q.y, q.z, q.w)
+            p += 12
+            r += 16
+        return pos, rot
+
+
+# ---------------------------------------------------------
+# DELTA TRACKER (change-only pose streaming)
+# ---------------------------------------------------------
+class DeltaTracker:
+    # Remembers the last pose that was actually sent and reports which joints
+    # moved further than epsilon since then. A full keyframe goes out every
+    # keyframe_interval ticks and after reset() (reconnect, new joint set) so
+    # the receiver can always resync.
+    # Poses are compared as whole channels: the float32 bytes are XORed as
+    # one integer and folded into a flag byte per joint (_row_flags), and only
+    # joints with changed bytes get the epsilon test in Python. Once most
+    # joints changed bytes a full pose goes out straight away, so sub-epsilon
+    # jitter on most of the rig is sent as a keyframe rather than skipped.
+
+    def __init__(self, epsilon=DELTA_EPSILON, keyframe_interval=KEYFRAME_INTERVAL):
+        self.epsilon = epsilon
+        self.keyframe_interval = keyframe_interval
+        self.last_pos = None
+        self.last_rot = None
+        self.since_key = 0
+
+        self.ticks = 0
+        self.keyframes = 0
+        self.deltas = 0
+        self.idle = 0
+        self.joints_sent = 0
+
+    def reset(self):
+        self.last_pos = None
+        self.last_rot = None
+
+    def _remember(self, pos, rot):
+        if self.last_pos is not None and len(self.last_pos) == len(pos):
+            self.last_pos[:] = pos
+            self.last_rot[:] = rot
+        else:
+            self.last_pos = array("f", pos)
+            self.last_rot = array("f", rot)
+
+    def _keyframe(self, pos, rot, count):
+        self._remember(pos, rot)
+        self.since_key = 0
+        self.keyframes += 1
+        self.joints_sent += count
+        return True, None
+
+    def _moved(self, pos, rot, pos_now, pos_last, rot_now, rot_last, limit):
+        # One flag byte per joint, nonzero where its position or rotation
+        # bytes changed; a channel with equal bytes is skipped
+        flags = 0
+        if pos_now != pos_last:
+            flags = _row_flags(pos_now, pos_last, 12)
+        if rot_now != rot_last:
+            flags |= _row_flags(rot_now, rot_last, 16)
+        count = len(pos) // 3
+        flags = flags.to_bytes(count, "little")
+        if count - flags.count(0) > limit:
+            return None
+
+        last_pos = self.last_pos
+        last_rot = self.last_rot
+        eps = self.epsilon
+        indices = array("H")
+        for i in itertools.compress(range(count), flags):
+            p = i * 3
+            r = i * 4
+            if (abs(pos[p] - last_pos[p]) > eps or abs(pos[p + 1] - last_pos[p + 1]) > eps
+                    or abs(pos[p + 2] - last_pos[p + 2]) > eps
+                    or abs(rot[r] - last_rot[r]) > eps or abs(rot[r + 1] - last_rot[r + 1]) > eps
+                    or abs(rot[r + 2] - last_rot[r + 2]) > eps or abs(rot[r + 3] - last_rot[r + 3]) > eps):
+                indices.append(i)
+                # Past this many joints the answer is a keyframe anyway
+                if len(indices) > limit:
+                    return None
+                last_pos[p:p + 3] = pos[p:p + 3]
+                last_rot[r:r + 4] = rot[r:r + 4]
+        return indices
+
+    def update(self, pos, rot):
+        # Returns (keyframe, indices): (True, None) for a full pose,
+        # (False, indices) for a delta, (False, empty) when nothing moved.
+        self.ticks += 1
+        count = len(pos) // 3
+        if (self.last_pos is None or len(self.last_pos) != len(pos)
+                or self.since_key >= self.keyframe_interval):
+            return self._keyframe(pos, rot, count)
+
+        self.since_key += 1
+        if not isinstance(pos, array) or pos.typecode != "f": pos = array("f", pos)
+        if not isinstance(rot, array) or rot.typecode != "f": rot = array("f", rot)
+        pos_now, pos_last = pos.tobytes(), self.last_pos.tobytes()
+        rot_now, rot_last = rot.tobytes(), self.last_rot.tobytes()
+        # Whole pose first, so an idle tick is two byte compares
+        if pos_now == pos_last and rot_now == rot_last:
+            self.idle += 1
+            return False, array("H")
+
+        limit = count * 3 // 4
+        indices = self._moved(pos, rot, pos_now, pos_last, rot_now, rot_last, limit)
+        if indices is None:
+            # Most joints moved: a full pose is smaller than a delta with indices
+            return self._keyframe(pos, rot, count)
+        if indices:
+            self.deltas += 1
+            self.joints_sent += len(indices)
+        else:
+            self.idle += 1
+        return False, indices
+
+    def stats(self):
+        return {
+            "ticks": self.ticks,
+            "keyframes": self.keyframes,
+            "deltas": self.deltas,
+            "idle": self.idle,
+            "joints_sent": self.joints_sent,
+        }
+
+
+def _row_flags(now, last, width):
+    # Compares two equally long byte strings as whole integers: the XOR is
+    # zero where they match, each width byte row is OR-folded into its first
+    # byte and those bytes are taken. Gives an integer with one byte per row,
+    # nonzero where the row changed.
+    x = int.from_bytes(now, "little") ^ int.from_bytes(last, "little")
+    span = 1
+    while span < width:
+        shift = min(span, width - span)
+        x |= x >> (8 * shift)
+        span += shift
+    return int.from_bytes(x.to_bytes(len(now), "little")[::width], "little")
+
+
+def pick_joints(pos, rot, indices):
+    # Subset of the pose arrays for the given joint indices
+    sub_pos = array("f")
+    sub_rot = array("f")
+    for i in indices:
+        sub_pos.extend(pos[i * 3:i * 3 + 3])
+        sub_rot.extend(rot[i * 4:i * 4 + 4])
+    return sub_pos, sub_rot
+
+
+# ---------------------------------------------------------
+# BLOCK TRANSFER (a whole frame range, as fast as it can be sampled)
+# ---------------------------------------------------------
+class BlockTransfer:
+    # Sends frames first..last in compressed blocks over a framed session.
+    # At most `window` blocks are waiting for the receiver's ack, so a slow
+    # receiver throttles the sender instead of piling up in socket buffers.
+    # The range is bracketed by BULK_BEGIN / BULK_END requests.
+    # precision=(position bits, rotation bits) quantizes every block to the
+    # range its own frames cover.
+    def __init__(self, session, layout_id, names, block_frames=BLOCK_FRAMES, window=BLOCK_WINDOW,
+                 level=BLOCK_LEVEL, timeout=30.0, progress=None, precision=None):
+        self.session = session
+        self.layout_id = layout_id
+        self.names = names
+        self.block_frames = block_frames
+        self.window = window
+        self.level = level
+        self.timeout = timeout
+        self.progress = progress
+        self.precision = precision
+        self.in_flight = deque()
+
+        self.frames = 0
+        self.blocks = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+        self.sample_time = 0.0
+        self.encode_time = 0.0
+        self.stall_time = 0.0
+        self.elapsed = 0.0
+
+    def run(self, first, last, sample):
+        # sample(frame) -> (pos, rot) arrays for self.names at that frame
+        start = time.perf_counter()
+        total = last - first + 1
+        session = self.session
+        session.send(cas_protocol.encode_layout(self.layout_id, self.names))
+        self._request({"command": "BULK_BEGIN", "first": first, "last": last,
+                       "layout": self.layout_id, "joints": len(self.names)})
+
+        pos = array("f")
+        rot = array("f")
+        block_first = first
+        for frame in range(first, last + 1):
+            t = time.perf_counter()
+            p, r = sample(frame)
+            pos.extend(p)
+            rot.extend(r)
+            self.sample_time += time.perf_counter() - t
+            if frame - block_first + 1 == self.block_frames or frame == last:
+                self._send_block(block_first, frame - block_first + 1, pos, rot)
+                block_first = frame + 1
+                pos = array("f")
+                rot = array("f")
+                self.elapsed = time.perf_counter() - start
+                if self.progress:
+                    self.progress(self.frames, total, self)
+
+        while self.in_flight:
+            self._wait_oldest()
+        self._request({"command": "BULK_END", "first": first, "last": last, "frames": self.frames})
+        self.elapsed = time.perf_counter() - start
+        return self.stats()
+
+    def _send_block(self, first, count, pos, rot):
+        t = time.perf_counter()
+        block_id = self.session.new_id()
+        quantizer = None
+        if self.precision:
+            quantizer = cas_protocol.Quantizer.around(pos, 0.0, *self.precision)
+        payload = cas_protocol.encode_block(self.layout_id, block_id, first, count, pos, rot, self.level, quantizer)
+        self.encode_time += time.perf_counter() - t
+        while len(self.in_flight) >= self.window:
+            self._wait_oldest()
+        self.session.send(payload)
+        self.in_flight.append(block_id)
+        self.frames += count
+        self.blocks += 1
+        self.raw_bytes += (len(pos) + len(rot)) * pos.itemsize
+        self.sent_bytes += len(payload) + cas_protocol.FRAME_HEADER.size
+
+    def _wait_oldest(self):
+        t = time.perf_counter()
+        block_id = self.in_flight.popleft()
+        ack = self.session.wait_ack(block_id, self.timeout)
+        self.session.inbox.clear()
+        self.stall_time += time.perf_counter() - t
+        self._check(ack, f"block {block_id}")
+
+    def _request(self, packet):
+        request_id = self.session.request(packet, cas_protocol.CHANNEL_CONTROL)
+        self._check(self.session.wait_ack(request_id, self.timeout), packet["command"])
+
+    def _check(self, ack, what):
+        if ack is None:
+            raise TimeoutError(f"Receiver did not acknowledge {what} within {self.timeout:.0f}s")
+        if not ack.get("ok"):
+            raise RuntimeError(f"Receiver rejected {what}: {ack.get('error')}")
+
+    def stats(self):
+        elapsed = self.elapsed or 1e-9
+        return {
+            "frames": self.frames,
+            "blocks": self.blocks,
+            "fps": round(self.frames / elapsed, 1),
+            "mb_per_s": round(self.sent_bytes / elapsed / (1024 * 1024), 2),
+            "ratio": round(self.sent_bytes / self.raw_bytes, 3) if self.raw_bytes else 0.0,
+            "sample_s": round(self.sample_time, 3),
+            "encode_s": round(self.encode_time, 3),
+            "stall_s": round(self.stall_time, 3),
+            "elapsed_s": round(self.elapsed, 3),
+        }
+
+
+# ---------------------------------------------------------
+# FRAME PACER (monotonic send schedule, adapted to receiver feedback)
+# ---------------------------------------------------------
+class FramePacer:
+    # wait() sleeps until the next tick of a fixed schedule on the monotonic
+    # clock, so the time spent sampling and sending does not add up to drift.
+    # A tick that is already late is not made up with a burst: the schedule
+    # restarts from now.
+    # feedback() takes the receiver's FEEDBACK report (poses applied and
+    # dropped since the last one, average apply time) and moves the rate
+    # towards what the receiver keeps up with: straight down when it drops
+    # poses or is over budget, a step up per clean report otherwise.
+    def __init__(self, rate=SEND_RATE, min_rate=MIN_SEND_RATE, max_rate=MAX_SEND_RATE,
+                 adaptive=True, clock=time.monotonic, sleep=time.sleep):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.adaptive = adaptive
+        self.clock = clock
+        self.sleep = sleep
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.period = 1.0 / self.rate
+        self.deadline = None
+
+        self.ticks = 0
+        self.late = 0
+        self.sends = 0
+        self.window_start = clock()
+        self.window_sends = 0
+        self.achieved = 0.0
+        self.changes = 0
+        self.last_feedback = None
+
+    def wait(self):
+        now = self.clock()
+        if self.deadline is None:
+            self.deadline = now
+        delay = self.deadline - now
+        if delay > 0:
+            self.sleep(delay)
+            self.deadline += self.period
+        else:
+            if delay < -self.period:
+                self.late += 1
+                self.deadline = now
+            self.deadline += self.period
+        self.ticks += 1
+
+    def sent(self):
+        self.sends += 1
+        self.window_sends += 1
+
+    def set_rate(self, rate):
+        rate = min(max(rate, self.min_rate), self.max_rate)
+        if abs(rate - self.rate) < 0.5: return False
+        if self.deadline is not None:
+            # Next tick on the new period, counted from the last one
+            self.deadline += 1.0 / rate - self.period
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.changes += 1
+        return True
+
+    def measure(self):
+        # Sends per second since the previous call
+        now = self.clock()
+        elapsed = now - self.window_start
+        if elapsed > 0:
+            self.achieved = self.window_sends / elapsed
+        self.window_start = now
+        self.window_sends = 0
+        return self.achieved
+
+    def feedback(self, report):
+        # Returns True when the rate changed
+        self.last_feedback = report
+        self.measure()
+        if not self.adaptive: return False
+        applied = report.get("applied", 0)
+        dropped = report.get("dropped", 0)
+        apply_s = report.get("apply_ms", 0.0) / 1000.0
+        if not applied and not dropped: return False
+
+        rate = self.rate
+        capacity = RATE_HEADROOM / apply_s if apply_s > 0 else self.max_rate
+        if dropped:
+            # The receiver coalesced poses: send no faster than it applied them
+            interval = report.get("interval", 0.0)
+            shown = applied / interval if interval > 0 else rate
+            rate = min(rate * RATE_STEP_DOWN, max(shown, capacity))
+        elif capacity < rate:
+            rate = capacity
+        elif self.achieved >= rate * RATE_HEADROOM:
+            # Only raise the rate while the sender actually uses it
+            rate = min(rate * RATE_STEP_UP, capacity)
+        return self.set_rate(rate)
+
+    def stats(self):
+        return {
+            "rate": round(self.rate, 1),
+            "achieved": round(self.achieved, 1),
+            "ticks": self.ticks,
+            "sends": self.sends,
+            "late": self.late,
+            "changes": self.changes,
+        }
+
+
+# ---------------------------------------------------------
+# CONNECTION MANAGER (non-blocking connect with backoff)
+# ---------------------------------------------------------
+STATE_DISCONNECTED = "disconnected"
+STATE_CONNECTING = "connecting"
+STATE_CONNECTED = "connected"
+STATE_BACKOFF = "backoff"
+
+_CONNECT_PENDING = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, getattr(errno, "WSAEWOULDBLOCK", -1))
+
+
+class ConnectionManager:
+    # Call poll() once per tick; it never blocks. It starts a non-blocking
+    # connect, checks on it on later ticks and hands out the socket once it
+    # is up. Failures close the socket and wait with capped exponential
+    # backoff plus jitter before the next attempt.
+    def __init__(self, host, port, on_state=None, backoff_min=0.1, backoff_max=5.0,
+                 connect_timeout=2.0, send_buffer=256 * 1024, send_timeout=0.5):
+        self.host = host
+        self.port = port
+        self.on_state = on_state
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.connect_timeout = connect_timeout
+        self.send_buffer = send_buffer
+        self.send_timeout = send_timeout
+
+        self.state = STATE_DISCONNECTED
+        self.sock = None
+        self.failures = 0
+        self.retry_at = 0.0
+        self.connect_started = 0.0
+
+        self.attempts = 0
+        self.connects = 0
+        self.disconnects = 0
+
+    def _set_state(self, state, reason=None):
+        if state == self.state: return
+        self.state = state
+        if self.on_state:
+            self.on_state(state, reason)
+
+    def _close(self):
+        if self.sock is not None:
+            try: self.sock.close()
+            except OSError: pass
+            self.sock = None
+
+    def _backoff(self, reason):
+        self._close()
+        delay = min(self.backoff_max, self.backoff_min * (2 ** self.failures))
+        delay *= 0.5 + random.random() * 0.5
+        self.failures += 1
+        self.retry_at = time.monotonic() + delay
+        self._set_state(STATE_BACKOFF, f"{reason}, retry in {delay:.2f}s")
+
+    def _start_connect(self):
+        self.attempts += 1
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        self.connect_started = time.monotonic()
+        err = self.sock.connect_ex((self.host, self.port))
+        if err not in (0,) + _CONNECT_PENDING:
+            self._backoff(f"connect failed ({errno.errorcode.get(err, err)})")
+            return
+        self._set_state(STATE_CONNECTING)
+
+    def _check_connect(self):
+        _, writable, failed = select.select([], [self.sock], [self.sock], 0)
+        if writable or failed:
+            err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                self._backoff(f"connect failed ({errno.errorcode.get(err, err)})")
+                return
+            self._configure(self.sock)
+            self.failures = 0
+            self.connects += 1
+            self._set_state(STATE_CONNECTED)
+        elif time.monotonic() - self.connect_started > self.connect_timeout:
+            self._backoff("connect timed out")
+
+    def _configure(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+        except OSError:
+            pass
+        sock.settimeout(self.send_timeout)
+
+    def poll(self):
+        # Returns the connected socket, or None while not connected
+        if self.state == STATE_CONNECTED:
+            return self.sock
+        if self.state == STATE_BACKOFF and time.monotonic() < self.retry_at:
+            return None
+        if self.sock is None:
+            self._start_connect()
+        if self.state == STATE_CONNECTING:
+            self._check_connect()
+        return self.sock if self.state == STATE_CONNECTED else None
+
+    def wait(self, timeout):
+        # Blocking variant for one-off use outside the live loop
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            sock = self.poll()
+            if sock is not None: return sock
+            time.sleep(0.01)
+        return None
+
+    def disconnect(self, reason="closed"):
+        # Drops the current socket and schedules a reconnect
+        if self.state == STATE_CONNECTED:
+            self.disconnects += 1
+        self._backoff(reason)
+
+    def close(self):
+        self._close()
+        self.failures = 0
+        self._set_state(STATE_DISCONNECTED)
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "attempts": self.attempts,
+            "connects": self.connects,
+            "disconnects": self.disconnects,
+        }
+
+
+# ---------------------------------------------------------
+# EXPORT CACHE (content-hashed FBX exports, small on-disk LRU)
+# ---------------------------------------------------------
+# Top-level FBX nodes that change on every export of the same scene
+# (timestamps, random file id, exporter paths), left out of the digest
+_FBX_MAGIC = b"Kaydara FBX Binary  \x00"
+_FBX_VOLATILE = {b"FBXHeaderExtension", b"FileId", b"CreationTime", b"Creator", b"Documents"}
+
+
+def fbx_digest(path, chunk_size=1024 * 1024):
+    # Content hash of an FBX export: the same scene exported twice gives the
+    # same digest. Binary files are walked node by node at the top level
+    # (the footer repeats the timestamp, so it is skipped too); ASCII files
+    # drop the matching lines and comments.
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        head = f.read(27)
+        if not head.startswith(_FBX_MAGIC):
+            return _fbx_ascii_digest(head + f.read(), digest)
+        digest.update(head)
+        version = struct.unpack_from("<I", head, 23)[0]
+        record = struct.Struct("<QQQB" if version >= 7500 else "<IIIB")
+        offset = len(head)
+        while True:
+            header = f.read(record.size)
+            if len(header) < record.size: break
+            end, _, _, name_len = record.unpack(header)
+            if end == 0: break
+            name = f.read(name_len)
+            if name not in _FBX_VOLATILE:
+                digest.update(header)
+                digest.update(name)
+                remaining = end - offset - record.size - name_len
+                while remaining > 0:
+                    chunk = f.read(min(chunk_size, remaining))
+                    if not chunk: break
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+            f.seek(end)
+            offset = end
+    return digest.hexdigest()
+
+
+def _fbx_ascii_digest(data, digest):
+    depth = 0
+    skip_depth = None
+    for line in data.splitlines():
+        text = line.strip()
+        if skip_depth is None and depth == 0 and not text.startswith(b";"):
+            key = text.split(b":", 1)[0]
+            if key in _FBX_VOLATILE: skip_depth = depth
+        if skip_depth is None and not text.startswith(b";"):
+            digest.update(line)
+            digest.update(b"\n")
+        depth += text.count(b"{") - text.count(b"}")
+        if skip_depth is not None and depth <= skip_depth:
+            skip_depth = None
+    return digest.hexdigest()
+
+
+class ExportCache:
+    # Every export is renamed to <prefix>_<hash>.fbx in the cache directory,
+    # hashed with fbx_digest so re-exports of an unchanged scene match. An
+    # export whose content is already cached just refreshes that file.
+    # Least recently used files are evicted once the directory grows past
+    # max_bytes (the newest file is always kept).
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, prefix="cas_sync"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def path_for(self, digest):
+        return os.path.join(self.directory, f"{self.prefix}_{digest}.fbx").replace("\\", "/")
+
+    def store(self, export_path):
+        # Returns (digest, cached path). The export file itself is consumed.
+        if not os.path.exists(self.directory): os.makedirs(self.directory)
+        digest = fbx_digest(export_path)
+        cached = self.path_for(digest)
+        if os.path.exists(cached):
+            self.hits += 1
+            os.remove(export_path)
+            os.utime(cached)
+        else:
+            self.misses += 1
+            os.replace(export_path, cached)
+        self.evict(keep=cached)
+        return digest, cached
+
+    def entries(self):
+        # (mtime, size, path), oldest first
+        found = []
+        start = f"{self.prefix}_"
+        for name in os.listdir(self.directory):
+            if not (name.startswith(start) and name.endswith(".fbx")): continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            found.append((st.st_mtime, st.st_size, path))
+        found.sort()
+        return found
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_bytes: break
+            if keep and os.path.samefile(path, keep): continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evicted += 1
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted}
+
+
+# ---------------------------------------------------------
+# LOG WRITER (queued lines, appended in batches by a background thread)
+# ---------------------------------------------------------
+class LogWriter:
+    # log() stamps the line, echoes it and queues it; it never touches the
+    # disk. A background thread appends whatever is queued every
+    # flush_interval seconds (sooner once max_batch lines wait) and rotates
+    # the file at max_bytes: path -> path.1 -> ... -> path.<backups>.
+    # A message logged more than repeat_burst times within repeat_interval
+    # seconds is only counted; the count is written with its next line
+    # after the interval.
+    def __init__(self, path, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS, flush_interval=LOG_FLUSH_INTERVAL,
+                 repeat_interval=LOG_REPEAT_INTERVAL, repeat_burst=LOG_REPEAT_BURST, max_batch=1000, echo=print):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.repeat_interval = repeat_interval
+        self.repeat_burst = repeat_burst
+        self.max_batch = max_batch
+        self.echo = echo
+        self.queue = deque()
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.repeats = {}   # message -> [window start, count in window, suppressed]
+        self.file = None
+        self.size = 0
+        self.closing = False
+
+        self.logged = 0
+        self.suppressed = 0
+        self.written = 0
+        self.batches = 0
+        self.rotations = 0
+        self.errors = 0
+
+        self.thread = threading.Thread(target=self._run, name="cas_bridge_log", daemon=True)
+        self.thread.start()
+
+    def log(self, msg):
+        # Returns False when the message was rate limited
+        now = time.monotonic()
+        with self.lock:
+            seen = self.repeats.get(msg)
+            if seen is None or now - seen[0] >= self.repeat_interval:
+                suppressed = seen[2] if seen is not None else 0
+                if len(self.repeats) > 1000:
+                    self._prune()
+                self.repeats[msg] = [now, 1, 0]
+            else:
+                seen[1] += 1
+                if seen[1] > self.repeat_burst:
+                    seen[2] += 1
+                    self.suppressed += 1
+                    return False
+                suppressed = 0
+        if suppressed:
+            msg = f"{msg} (repeated {suppressed} more times)"
+        line = f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {msg}"
+        if self.echo is not None:
+            self.echo(line)
+        self.queue.append(line)
+        self.logged += 1
+        if len(self.queue) >= self.max_batch:
+            self.wake.set()
+        return True
+
+    def _prune(self):
+        # Forgets the oldest half; amortized over the next 500 new messages
+        for msg in list(itertools.islice(self.repeats, len(self.repeats) // 2)):
+            del self.repeats[msg]
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+            if self.closing and not self.queue: break
+        self._close_file()
+
+    def flush(self):
+        # Writer thread only (or after it stopped)
+        queue = self.queue
+        lines = []
+        while queue:
+            lines.append(queue.popleft())
+        if not lines: return
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        try:
+            if self.file is None:
+                self._open()
+            self.file.write(data)
+            self.file.flush()
+            self.size += len(data)
+            self.written += len(lines)
+            self.batches += 1
+            if self.size >= self.max_bytes:
+                self._rotate()
+        except OSError:
+            # Like the old writer: a log that cannot be written is dropped
+            self.errors += 1
+            self._close_file()
+
+    def _open(self):
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder): os.makedirs(folder)
+        self.file = open(self.path, "ab")
+        self.size = self.file.tell()
+        if self.size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._close_file()
+        for i in range(self.backups, 0, -1):
+            source = f"{self.path}.{i - 1}" if i > 1 else self.path
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i}")
+        if not self.backups and os.path.exists(self.path):
+            os.remove(self.path)
+        self.rotations += 1
+        self.file = open(self.path, "ab")
+        self.size = 0
+
+    def _close_file(self):
+        if self.file is None: return
+        try:
+            self.file.close()
+        except OSError:
+            pass
+        self.file = None
+
+    def close(self, timeout=2.0):
+        # Writes out what is still queued and stops the thread
+        self.closing = True
+        self.wake.set()
+        self.thread.join(timeout)
+
+    def stats(self):
+        return {
+            "logged": self.logged,
+            "suppressed": self.suppressed,
+            "written": self.written,
+            "batches": self.batches,
+            "rotations": self.rotations,
+            "errors": self.errors,
+            "queued": len(self.queue),
+        }
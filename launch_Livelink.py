@@ -20,9 +20,17 @@ def run():
 
     
     try:
+        import cas_protocol
+        import cas_stats
+        import max_scene
+        import max_stream
         import max_receiver
         
         
+        importlib.reload(cas_protocol)
+        importlib.reload(cas_stats)
+        importlib.reload(max_scene)
+        importlib.reload(max_stream)
         importlib.reload(max_receiver)
         
         
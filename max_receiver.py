@@ -1,7 +1,7 @@
 # File: max_receiver.py
 import sys
 import os
-import socket
+import time
 import json
 import pymxs
 import qtmax
@@ -9,75 +9,147 @@ from PySide6 import QtWidgets, QtCore, QtGui
 from PySide6.QtGui import QDesktopServices
 from PySide6.QtCore import QUrl
 
+import cas_protocol
+import cas_stats
+from cas_protocol import PoseFrame, PoseBlock, same_pose
+from max_scene import CharacterScene, NodeCache, RedrawScheduler, read_node_pose
+from max_stream import LinkServer, PoseMailbox, AxisConversion, TakeBuffer, RetargetMap, match_bones, local_frames, align_quaternions, ReductionJob
+
 # --- Defult Values ---
 DEFAULT_PORT = 5555
 DEFAULT_SCALE = 1.0
+APPLY_MODE = "bulk"   # "bulk" (one MAXScript call per frame) or "per_property"
+SYNC_MODE = "incremental"   # "incremental" (merge into the synced nodes) or "replace"
+TAKE_IDLE_COMMIT = 1.0      # record mode: bake buffered frames after this many idle seconds
+KEY_REDUCTION = True        # record mode: drop keys that interpolation reproduces
+REDRAW_FPS = 30.0           # viewport redraws per second at most, poses in between are still applied
+REDRAW_ACTIVE_ONLY = False  # disable the inactive viewports while the link runs
+INSTRUMENT = True           # per-stage timings for the stats panel and export
+RETARGET_DIR = "C:/Temp3d/Cascadeur/retarget"   # maps made with "Retarget to Selection", one <character>.json each
+RETARGET_STRETCH = False    # retarget: every bone follows its joint's position instead of keeping the rig's proportions
 
 # ---------------------------------------------------------
 # 1. WORKER THREAD (Server Logic)
 # ---------------------------------------------------------
 class ServerWorker(QtCore.QThread):
-    data_received = QtCore.Signal(dict)
+    # Runs the link server: any number of senders at once, each one's
+    # packets tagged with its link so the dialog routes them to its character
+    # Emitted when the mailbox goes from empty to non-empty
+    mail_ready = QtCore.Signal()
     
-    def __init__(self, port, scale_factor, parent=None):
+    def __init__(self, port, scale_factor, stats=None, parent=None):
         super().__init__(parent)
         self.port = port
         self.scale_factor = scale_factor 
         self.running = True
+        self.mailbox = PoseMailbox()
+        self.takes = None   # namespace -> TakeBuffer while recording
+        self.stats = stats or cas_stats.Instruments(False)
+        self.server = LinkServer('127.0.0.1', port, self)
+
+    def post(self, packet):
+        if self.mailbox.put(packet):
+            self.mail_ready.emit()
 
     def run(self):
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        
-        host = '127.0.0.1'
         try:
-            server_socket.bind((host, self.port))
-            server_socket.listen(1)
-        except Exception as e:
+            self.server.open()
+        except OSError as e:
             print(f"Bind Error on port {self.port}: {e}")
             return
-        
-        while self.running:
-            try:
-                server_socket.settimeout(1.0)
-                try:
-                    client, addr = server_socket.accept()
-                except socket.timeout:
-                    continue
-                
-                with client:
-                    buffer = b""
-                    while self.running:
-                        try:
-                            client.settimeout(2.0)
-                            chunk = client.recv(8192 * 4) 
-                            if not chunk: break
-                            buffer += chunk
-                            
-                            try:
-                                json_str = buffer.decode('utf-8')
-                                if "}{" in json_str:
-                                    json_str = json_str.split("}{")[0] + "}"
-
-                                data_dict = json.loads(json_str)
-                                data_dict["_runtime_scale"] = self.scale_factor
-                                self.data_received.emit(data_dict)
-                                buffer = b""
-                            except json.JSONDecodeError:
-                                continue
-                            
-                        except socket.timeout:
-                            continue
-                        except Exception:
-                            break
-            except Exception as e:
-                if self.running:
-                    print(f"Network Loop Error: {e}")
+        try:
+            self.server.serve()
+        except Exception as e:
+            if self.running:
+                print(f"Network Loop Error: {e}")
+
+    # --- LinkServer handler (worker thread) ---
+    def on_open(self, link):
+        print(f"Sender connected: {link.addr[0]}:{link.addr[1]}")
+
+    def on_close(self, link):
+        reader = link.session.reader
+        if reader.malformed or reader.oversized:
+            print(f"Connection closed: {reader.frames} frames, {reader.malformed} malformed, {reader.oversized} oversized")
+        self.post({"command": "LINK_CLOSED", "_link": link, "_link_id": link.id})
+
+    def on_message(self, link, channel, payload):
+        self.handle_message(link, payload)
+
+    def handle_message(self, link, payload):
+        stats = self.stats
+        session = link.session
+        layouts = link.layouts
+        tags = {
+            "_link": link,
+            "_link_id": link.id,
+            "_session": session,
+            "_runtime_scale": link.scale or self.scale_factor,
+        }
+        if cas_protocol.is_binary(payload):
+            start = stats.now()
+            pose = cas_protocol.decode_binary(payload, layouts)
+            if pose is None: return
+            stats.since("decode", start)
+            if isinstance(pose, PoseBlock):
+                # Bulk transfer: queued in order like any command, acked once written
+                self.post(dict(tags, command="BULK_BLOCK", id=pose.block_id, block=pose))
+                return
+            take = self.take_for(link)
+            if take is not None:
+                take.add(pose)
+            self.post(dict(tags, command="LIVE_DATA", frame=pose.frame, pose=pose, _sent=self.take_stamp(layouts)))
+            return
 
-        server_socket.close()
+        start = stats.now()
+        data_dict = json.loads(bytes(payload).decode('utf-8'))
+        if not isinstance(data_dict, dict):
+            raise ValueError("Expected a JSON object")
+        command = data_dict.get("command")
+        if command == "HELLO":
+            # Which character this sender drives, and at what scale
+            link.namespace = str(data_dict.get("namespace") or "")
+            scale = data_dict.get("scale")
+            if isinstance(scale, (int, float)) and scale > 0:
+                link.scale = float(scale)
+            session.send_raw(cas_protocol.hello_reply(data_dict))
+            session.reader.framed = True
+            return
+        if command in ("PING", "PONG"):
+            session.dispatch(cas_protocol.CHANNEL_HEARTBEAT, data_dict)
+            return
+        if command == "LIVE_DATA":
+            take = self.take_for(link)
+            if take is not None:
+                data_dict["pose"] = PoseFrame.from_json(data_dict.get("frame", 0), data_dict.get("data", []))
+                take.add(data_dict["pose"])
+            stats.since("decode", start)
+            data_dict["_sent"] = self.take_stamp(layouts)
+        data_dict.update(tags)
+        self.post(data_dict)
+
+    def take_for(self, link):
+        # Record mode keeps one take per character
+        takes = self.takes
+        if takes is None: return None
+        take = takes.get(link.namespace)
+        if take is None:
+            take = takes[link.namespace] = TakeBuffer(scale=link.scale or self.scale_factor)
+        return take
+
+    def take_stamp(self, layouts):
+        # Called once per live pose: counts it and returns the sender clock
+        # stamp sent ahead of it, if any
+        self.stats.count("poses")
+        sent = layouts.pop("stamp", None)
+        if sent is not None:
+            self.stats.add("recv", time.time() - sent)
+        return sent
 
     def stop(self):
+        # Immediate: the server wakes up from its select() right away
         self.running = False
+        self.server.stop()
         self.wait()
 
 # ---------------------------------------------------------
@@ -168,6 +240,23 @@ class CasLiveDialog(QtWidgets.QDialog):
         self.current_port = DEFAULT_PORT
         self.current_scale = DEFAULT_SCALE
         self.worker = None 
+        self.characters = {}   # sender namespace -> CharacterScene
+        self.takes = None      # sender namespace -> TakeBuffer while recording
+        self.bakes = []        # takes waiting for their key reduction, oldest first
+        self.stats = cas_stats.Instruments(INSTRUMENT)
+        self.redraw = RedrawScheduler(pymxs.runtime, REDRAW_FPS, REDRAW_ACTIVE_ONLY, instruments=self.stats)
+        self.redraw_timer = QtCore.QTimer(self)
+        self.redraw_timer.setSingleShot(True)
+        self.redraw_timer.timeout.connect(self.flush_redraw)
+        self.take_timer = QtCore.QTimer(self)
+        self.take_timer.setInterval(250)
+        self.take_timer.timeout.connect(self.check_take_idle)
+        self.bake_timer = QtCore.QTimer(self)
+        self.bake_timer.setInterval(100)
+        self.bake_timer.timeout.connect(self.write_bakes)
+        self.stats_timer = QtCore.QTimer(self)
+        self.stats_timer.setInterval(500)
+        self.stats_timer.timeout.connect(self.refresh_stats)
         self.init_ui()
         
 
@@ -198,14 +287,44 @@ class CasLiveDialog(QtWidgets.QDialog):
         self.btn_toggle.clicked.connect(self.toggle_connection)
         layout.addWidget(self.btn_toggle)
 
+        self.chk_record = QtWidgets.QCheckBox("Record Keys")
+        self.chk_record.setToolTip("Buffer every streamed frame and bake it to keys when the stream pauses")
+        self.chk_record.toggled.connect(self.toggle_recording)
+        layout.addWidget(self.chk_record)
+
+        self.chk_stats = QtWidgets.QCheckBox("Show Stats")
+        self.chk_stats.setEnabled(INSTRUMENT)
+        self.chk_stats.toggled.connect(self.toggle_stats_panel)
+        layout.addWidget(self.chk_stats)
+
+        self.lbl_stats = QtWidgets.QLabel("")
+        self.lbl_stats.setStyleSheet("background-color: #1a1a1a; color: #9e9e9e; font-family: Consolas, monospace; font-size: 10px; padding: 6px; border: 1px solid #333;")
+        self.lbl_stats.setTextInteractionFlags(QtCore.Qt.TextSelectableByMouse)
+        self.lbl_stats.hide()
+        layout.addWidget(self.lbl_stats)
+
+        self.btn_export_stats = QtWidgets.QPushButton("Export Stats...")
+        self.btn_export_stats.setStyleSheet("background-color: #444; color: white;")
+        self.btn_export_stats.clicked.connect(self.export_stats)
+        self.btn_export_stats.hide()
+        layout.addWidget(self.btn_export_stats)
+
         self.btn_settings = QtWidgets.QPushButton("Settings")
         self.btn_settings.setStyleSheet("background-color: #444; color: white;")
         self.btn_settings.clicked.connect(self.open_settings)
         layout.addWidget(self.btn_settings)
 
-        #self.btn_convert = QtWidgets.QPushButton("Convert Selection to Biped")
-        #self.btn_convert.clicked.connect(self.convert_selection_to_biped)
-        #layout.addWidget(self.btn_convert)
+        retarget_layout = QtWidgets.QHBoxLayout()
+        self.btn_retarget = QtWidgets.QPushButton("Retarget to Selection")
+        self.btn_retarget.setToolTip("Drive the selected rig (Biped, CAT or any bones) from the stream.\nPose both in the same stance first.")
+        self.btn_retarget.setStyleSheet("background-color: #444; color: white;")
+        self.btn_retarget.clicked.connect(self.retarget_selection)
+        retarget_layout.addWidget(self.btn_retarget)
+        self.btn_clear_retarget = QtWidgets.QPushButton("Clear Retarget")
+        self.btn_clear_retarget.setStyleSheet("background-color: #444; color: white;")
+        self.btn_clear_retarget.clicked.connect(self.clear_retarget)
+        retarget_layout.addWidget(self.btn_clear_retarget)
+        layout.addLayout(retarget_layout)
 
         self.setLayout(layout)
 
@@ -218,6 +337,18 @@ class CasLiveDialog(QtWidgets.QDialog):
             if self.worker:
                 pymxs.runtime.messageBox("Please Restart Connection to apply changes.")
 
+    def character(self, namespace=""):
+        scene = self.characters.get(namespace)
+        if scene is None:
+            scene = CharacterScene(pymxs.runtime, namespace, APPLY_MODE, AxisConversion())
+            self.characters[namespace] = scene
+            self.load_retarget(scene)
+        return scene
+
+    def character_for(self, packet):
+        link = packet.get("_link")
+        return self.character(link.namespace if link is not None else "")
+
     def toggle_connection(self):
         if self.worker is not None:
             self.stop_server()
@@ -225,8 +356,10 @@ class CasLiveDialog(QtWidgets.QDialog):
             self.start_server()
 
     def start_server(self):
-        self.worker = ServerWorker(self.current_port, self.current_scale)        
-        self.worker.data_received.connect(self.process_caslive_data)
+        self.stats.reset()
+        self.worker = ServerWorker(self.current_port, self.current_scale, self.stats)        
+        self.worker.mail_ready.connect(self.drain_mailbox)
+        self.worker.takes = self.takes
         self.worker.start()
         
         self.lbl_status.setText("LISTENING")
@@ -238,6 +371,29 @@ class CasLiveDialog(QtWidgets.QDialog):
     def stop_server(self):
         if self.worker:
             self.worker.stop()
+            # Poses and commands the worker posted before it stopped
+            self.drain_mailbox()
+            if self.takes is not None:
+                self.commit_takes()
+            self.write_bakes(wait=True)
+            print(f"Mailbox: {self.worker.mailbox.stats()}")
+            print(f"Links: {self.worker.server.stats()}")
+            for scene in self.characters.values():
+                stats = scene.stats()
+                print(f"Character {scene.label()}:")
+                print(f"  Node cache: {stats['node_cache']}")
+                print(f"  Mesh sync cache: {stats['mesh_sync']}")
+                print(f"  Incremental sync: {stats['incremental']}")
+                print(f"  Sync registry: {stats['registry']}")
+                print(f"  Key baker: {stats['baker']}")
+                if stats["retarget"] is not None:
+                    print(f"  Retarget: {stats['retarget']}")
+            print(f"Redraws: {self.redraw.stats()}")
+            if INSTRUMENT:
+                print("Stage timings:\n  " + "\n  ".join(self.stats.lines()))
+            self.redraw_timer.stop()
+            self.flush_redraw()
+            self.redraw.restore()
             self.worker = None
         self.lbl_status.setText("OFFLINE")
         self.lbl_status.setStyleSheet("background-color: #1a1a1a; color: #555; font-size: 26px; font-weight: bold; border-radius: 8px; padding: 15px; border: 1px solid #333;")
@@ -245,48 +401,416 @@ class CasLiveDialog(QtWidgets.QDialog):
         self.btn_toggle.setStyleSheet("background-color: #2e7d32; color: white; font-weight: bold; font-size: 14px;")
         self.btn_settings.setEnabled(True)
 
+    # --- STATS PANEL ---
+    def toggle_stats_panel(self, enabled):
+        self.lbl_stats.setVisible(enabled)
+        self.btn_export_stats.setVisible(enabled)
+        if enabled:
+            self.refresh_stats()
+            self.stats_timer.start()
+        else:
+            self.stats_timer.stop()
+            self.adjustSize()
+
+    def refresh_stats(self):
+        lines = self.stats.lines() or ["no data yet"]
+        if self.worker:
+            mailbox = self.worker.mailbox
+            mail = mailbox.stats()
+            lines.append(f"mailbox  {mail['received']} in, {mail['applied']} applied, {mail['dropped']} dropped")
+            for link in list(self.worker.server.links.values()):
+                lat = link.latency.summary()
+                lines.append(f"link {link.id:<3} {link.namespace or 'default':<10} {link.feedback.total_applied:6d} applied  "
+                             f"{mailbox.dropped_by.get(link.id, 0)} dropped  p95 {lat['p95_ms']:.1f} ms")
+        redraw = self.redraw.stats()
+        lines.append(f"per s    apply {redraw['apply_ms_per_s']:.0f} ms, redraw {redraw['redraw_ms_per_s']:.0f} ms, {redraw['redraws_per_s']:.0f} redraws")
+        self.lbl_stats.setText("\n".join(lines))
+
+    def export_stats(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export Stats", "C:/Temp3d/cas_stats.json", "JSON (*.json);;CSV (*.csv)")
+        if not path: return
+        try:
+            paths = self.stats.export(path)
+            print(f"Stats exported: {', '.join(paths)}")
+        except OSError as e:
+            pymxs.runtime.messageBox(f"Could not export stats: {e}")
+
+    # --- RECORD MODE ---
+    def toggle_recording(self, enabled):
+        # One take per character, filled by the worker as poses arrive
+        if enabled:
+            self.takes = {}
+            self.take_timer.start()
+        else:
+            self.take_timer.stop()
+        if self.worker:
+            self.worker.takes = self.takes if enabled else None
+        if not enabled and self.takes is not None:
+            self.commit_takes()
+            self.takes = None
+
+    def check_take_idle(self):
+        # Bake at pauses in the stream, not while frames are coming in
+        if self.takes is None: return
+        for namespace, take in list(self.takes.items()):
+            if len(take) and take.idle_for() > TAKE_IDLE_COMMIT:
+                self.commit_take(self.character(namespace), take)
+
+    def commit_takes(self):
+        for namespace, take in list(self.takes.items()):
+            self.commit_take(self.character(namespace), take)
+
+    def commit_take(self, character, take):
+        # The scene is read here, the frames are reduced to keys on a thread
+        # of their own (ReductionJob) and write_bakes keys the take once done
+        stats = take.stats()
+        segments = take.take()
+        if not segments: return
+        start = time.perf_counter()
+        try:
+            prepared = []
+            for segment in segments:
+                bake = self.prepare_bake(character, segment.ordered(), take.scale)
+                if KEY_REDUCTION:
+                    bake["exact"] = [not ok for ok in character.baker.key_modes(bake["nodes"])]
+                prepared.append(bake)
+        except Exception as e:
+            print(f"Could not bake take: {e}")
+            return
+        job = ReductionJob(prepared, KEY_REDUCTION)
+        self.bakes.append((character, prepared, job, stats, start))
+        self.write_bakes()
+        if self.bakes:
+            self.bake_timer.start()
+
+    def write_bakes(self, wait=False):
+        # Keys the takes whose reduction has finished, in commit order so a
+        # later take of the same frames still wins
+        while self.bakes:
+            character, prepared, job, stats, start = self.bakes[0]
+            if not (job.wait() if wait else job.done()): return
+            self.bakes.pop(0)
+            self.bake_take(character, prepared, job, stats, start)
+        self.bake_timer.stop()
+
+    def bake_take(self, character, prepared, job, stats, start):
+        if job.error is not None:
+            print(f"Could not reduce take: {job.error}")
+            return
+        frames = 0
+        keys = 0
+        try:
+            with pymxs.undo(True, "Cascadeur Take"):
+                for i, bake in enumerate(prepared):
+                    keys += character.baker.bake(bake["nodes"], bake["times"], bake["pos_frames"], bake["rot_frames"], job.keep[i])
+                    frames += len(bake["times"])
+        except Exception as e:
+            print(f"Could not bake take: {e}")
+            return
+        elapsed = time.perf_counter() - start
+        print(f"Baked take ({character.label()}): {frames} frames -> {keys} keys in {elapsed:.2f}s "
+              f"({job.elapsed:.2f}s of it off the UI thread), buffer {stats['memory_kb']} KB {stats}")
+        self.request_redraw()
+
+    def prepare_bake(self, character, poses, scale):
+        # Full poses of one layout, in frame order -> their nodes, world
+        # frames and the parent spaces to key them in (see ReductionJob). The
+        # live conversion is left at the scale the live link applies with.
+        conversion = character.conversion.with_scale(scale)
+        retarget = character.retarget
+        times = [pose.frame for pose in poses]
+        pos_frames = []
+        rot_frames = []
+        for pose in poses:
+            pos, rot = conversion.convert(pose)
+            if retarget is not None:
+                nodes, pos, rot = retarget.apply(pose.names, pos, rot)
+            pos_frames.append(pos)
+            rot_frames.append(rot)
+        if retarget is None:
+            nodes = [character.node_cache.get(name) for name in poses[0].names]
+        parents, spaces = character.baker.parent_spaces(nodes)
+        return {"nodes": nodes, "times": times, "pos_frames": pos_frames, "rot_frames": rot_frames,
+                "parents": parents, "spaces": spaces}
+
+    def bake_poses(self, character, poses, scale):
+        # Every frame keyed, no reduction (bulk transfer)
+        bake = self.prepare_bake(character, poses, scale)
+        pos_frames, rot_frames = local_frames(bake["parents"], bake["spaces"], bake["pos_frames"], bake["rot_frames"])
+        align_quaternions(rot_frames)
+        keep = [list(range(len(bake["times"])))] * len(bake["nodes"])
+        return character.baker.bake(bake["nodes"], bake["times"], pos_frames, rot_frames, keep)
+
+    # --- BULK TRANSFER ---
+    def begin_transfer(self, character, packet):
+        character.bulk = {
+            "first": packet.get("first", 0),
+            "last": packet.get("last", 0),
+            "frames": 0,
+            "keys": 0,
+            "start": time.perf_counter(),
+        }
+        self.lbl_status.setText("TRANSFER 0%")
+        self.lbl_status.setStyleSheet("background-color: #000; color: #00aaff; font-size: 26px; font-weight: bold; border: 2px solid #00aaff; border-radius: 8px; padding: 15px;")
+
+    def write_block(self, character, block, scale):
+        # Straight to the controllers: no sliderTime change, no redraw
+        poses = block.poses()
+        with pymxs.undo(False):
+            with pymxs.redraw(False):
+                keys = self.bake_poses(character, poses, scale)
+        bulk = character.bulk
+        if bulk is not None:
+            bulk["frames"] += len(poses)
+            bulk["keys"] += keys
+            total = max(bulk["last"] - bulk["first"] + 1, 1)
+            self.lbl_status.setText(f"TRANSFER {min(bulk['frames'] * 100 // total, 100)}%")
+
+    def end_transfer(self, character):
+        bulk = character.bulk
+        character.bulk = None
+        self.request_redraw()
+        self.lbl_status.setText("TRANSFERRED")
+        if bulk is not None:
+            elapsed = time.perf_counter() - bulk["start"]
+            print(f"Bulk transfer ({character.label()}): frames {bulk['first']}-{bulk['last']}, {bulk['frames']} frames -> {bulk['keys']} keys "
+                  f"in {elapsed:.2f}s ({bulk['frames'] / max(elapsed, 1e-9):.0f} frames/s)")
+
+    def drain_mailbox(self):
+        if not self.worker: return
+        mailbox = self.worker.mailbox
+        commands, poses = mailbox.drain()
+        for packet in commands:
+            self.process_caslive_data(packet)
+        if not poses:
+            self.flush_redraw()
+            return
+        # Newest pose of every sender, applied in one pass and shown by one redraw
+        costs = []
+        for pose in poses:
+            start = time.perf_counter()
+            if self.stats.enabled:
+                self.stats.add("queue", start - pose["_recv_time"])
+            self.process_caslive_data(pose)
+            mailbox.mark_applied(pose)
+            costs.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        self.flush_redraw()
+        redraw_share = (time.perf_counter() - start) / len(poses)
+        for pose, cost in zip(poses, costs):
+            link = pose.get("_link")
+            if link is None: continue
+            sent = pose.get("_sent")
+            if sent is not None:
+                latency = time.time() - sent
+                self.stats.add("latency", latency)
+                link.latency.add(latency * 1000.0)
+            # Reported cost per pose includes its part of the redraw
+            dropped = mailbox.dropped_by.get(link.id, 0)
+            report = link.feedback.record(pose.get("frame", 0), cost + redraw_share, dropped, sent)
+            if report is not None:
+                self.send_feedback(pose.get("_session"), report)
+
+    def flush_redraw(self):
+        # Redraws now if one is due, otherwise comes back when it is
+        delay = self.redraw.flush()
+        if delay > 0 and not self.redraw_timer.isActive():
+            self.redraw_timer.start(int(delay * 1000) + 1)
+
+    def request_redraw(self):
+        self.redraw.mark()
+        self.flush_redraw()
+
+    def send_feedback(self, session, report):
+        # Lets the sender pace itself to what Max keeps up with
+        if session is None or not session.reader.framed: return
+        try:
+            session.send_json(report)
+        except OSError as e:
+            print(f"Could not send feedback: {e}")
+
     # --- PROCESS DATA (This was missing!) ---
     def process_caslive_data(self, packet):
         cmd = packet.get("command")
         if packet.get("header", {}).get("signature") == "CLIVE": cmd = "LIVE_DATA"
         scale = packet.get("_runtime_scale", 1.0)
+        character = self.character_for(packet)
         
-        if cmd == "SYNC_MODEL":
+        if cmd == "LINK_CLOSED":
+            link = packet.get("_link")
+            if self.worker and not self.worker.server.links and "LINKED" in self.lbl_status.text():
+                self.lbl_status.setText("LISTENING")
+                self.lbl_status.setStyleSheet("background-color: #111; color: orange; font-size: 26px; font-weight: bold; border: 2px solid orange; border-radius: 8px; padding: 15px;")
+            if link is not None:
+                print(f"Link {link.id} ({character.label()}) closed after {link.messages} messages")
+
+        elif cmd == "SYNC_MODEL":
             fbx_path = packet.get("path")
             self.lbl_status.setText("SYNCING...")
             
             QtCore.QThread.msleep(100)
-            self.import_full_scene(fbx_path, scale)
+            if not fbx_path or not os.path.exists(fbx_path):
+                self.acknowledge(packet, False, error=f"File not found: {fbx_path}")
+                return
+            digest = packet.get("hash")
+            try:
+                imported = character.mesh_cache.sync(
+                    fbx_path, digest,
+                    lambda path: self.import_full_scene(character, path, scale, digest),
+                    lambda: self.synced_digest(character))
+                if not imported:
+                    self.rescale_synced(character, scale)
+            except Exception as e:
+                print(f"Import Error: {e}")
+                self.acknowledge(packet, False, error=str(e))
+                return
+            self.acknowledge(packet, True, skipped=not imported)
             
             self.lbl_status.setText("MODEL SYNCED")
             self.lbl_status.setStyleSheet("background-color: #000; color: #00aaff; font-size: 26px; font-weight: bold; border: 2px solid #00aaff; border-radius: 8px; padding: 15px;")
             
 
+        elif cmd == "BULK_BEGIN":
+            self.begin_transfer(character, packet)
+            self.acknowledge(packet, True)
+
+        elif cmd == "BULK_BLOCK":
+            try:
+                self.write_block(character, packet["block"], scale)
+            except Exception as e:
+                print(f"Bulk block Error: {e}")
+                self.acknowledge(packet, False, error=str(e))
+                return
+            self.acknowledge(packet, True)
+
+        elif cmd == "BULK_END":
+            self.end_transfer(character)
+            self.acknowledge(packet, True)
+
         elif cmd == "LIVE_DATA":
-            if "SYNC" in self.lbl_status.text() or "LISTENING" in self.lbl_status.text():
+            if "SYNC" in self.lbl_status.text() or "TRANSFER" in self.lbl_status.text() or "LISTENING" in self.lbl_status.text():
                  self.lbl_status.setText("LINKED")
                  self.lbl_status.setStyleSheet("background-color: #000; color: #00ff00; border: 2px solid #00ff00; padding: 15px;")
 
-            frame = packet.get("frame", 0)
-            data = packet.get("data", [])
-            self.update_scene_live(data, scale, frame)
+            pose = packet.get("pose")
+            if pose is None:
+                pose = PoseFrame.from_json(packet.get("frame", 0), packet.get("data", []))
+            # Several senders would fight over the time slider: only the
+            # first one connected moves it
+            link = packet.get("_link")
+            drive_time = link is None or link is self.worker.server.primary()
+            self.update_scene_live(character, pose, scale, drive_time)
+
+    def acknowledge(self, packet, ok, **info):
+        # Tells the sender a request has been handled (persistent sessions only)
+        session = packet.get("_session")
+        if session is None: return
+        try:
+            session.ack(packet, ok, **info)
+        except OSError as e:
+            print(f"Could not acknowledge {packet.get('command')}: {e}")
+
+    # --- RETARGETING ---
+    def retarget_path(self, character):
+        return os.path.join(RETARGET_DIR, f"{character.label()}.json")
+
+    def load_retarget(self, character):
+        path = self.retarget_path(character)
+        if not os.path.exists(path): return
+        try:
+            retarget = RetargetMap.load(path)
+        except (OSError, ValueError) as e:
+            print(f"Could not load retarget map {path}: {e}")
+            return
+        missing = retarget.bind(NodeCache(pymxs.runtime).get)
+        character.retarget = retarget
+        print(f"Retarget map for {character.label()}: {len(retarget)} bones from {path}, {missing} nodes not in the scene")
+
+    def retarget_character(self):
+        # The character the first sender drives
+        link = self.worker.server.primary() if self.worker else None
+        return self.character(link.namespace if link is not None else "")
+
+    def retarget_selection(self):
+        # Compiles the map once from the live pose and the selected rig in
+        # the same stance; from then on poses go through it
+        rt = pymxs.runtime
+        character = self.retarget_character()
+        pose = character.live_pose
+        if pose is None:
+            rt.messageBox("Stream a pose from Cascadeur first, in the same stance as the rig to drive.")
+            return
+        selection = list(rt.selection)
+        if not selection:
+            rt.messageBox("Select the nodes of the rig to drive.")
+            return
+        targets = [node.name for node in selection]
+        mapping = match_bones(pose.names, targets)
+        if not mapping:
+            rt.messageBox("No selected node matches a streamed joint name.")
+            return
+        pos, rot = character.conversion.convert(pose)
+        target_pos, target_rot = read_node_pose(selection)
+        parents = [node.parent.name if node.parent is not None else None for node in selection]
+        retarget = RetargetMap.compile(pose.names, pos, rot, targets, target_pos, target_rot, parents,
+                                       mapping, stretch=RETARGET_STRETCH)
+        retarget.bind(dict(zip(targets, selection)).get)
+        character.retarget = retarget
+        print(f"Retarget map for {character.label()}: {len(retarget)} of {len(targets)} selected nodes matched, "
+              f"{len(pose.names) - len(retarget)} joints unused")
+        path = self.retarget_path(character)
+        try:
+            if not os.path.exists(RETARGET_DIR): os.makedirs(RETARGET_DIR)
+            retarget.save(path)
+            print(f"Retarget map saved: {path}")
+        except OSError as e:
+            print(f"Could not save retarget map: {e}")
+
+    def clear_retarget(self):
+        character = self.retarget_character()
+        character.retarget = None
+        path = self.retarget_path(character)
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Could not remove {path}: {e}")
+        print(f"Retarget cleared for {character.label()}, joints drive nodes by name again")
 
     # --- CLEANUP & IMPORT LOGIC ---
-    def delete_previous_sync(self):
+    def delete_previous_sync(self, character):
         
         rt = pymxs.runtime
-        to_delete = []
-        for obj in rt.objects:
-            if rt.getUserProp(obj, "cas_bridge_tag") == True:
-                to_delete.append(obj)
+        character.node_cache.invalidate()
+        to_delete = character.registry.nodes()
+        root = character.registry.root
+        if root is not None:
+            to_delete.append(root)
+        character.registry.clear()
         
         if len(to_delete) > 0:
             rt.delete(to_delete)
             print(f"Deleted {len(to_delete)} old bridge objects.")
 
-    def import_full_scene(self, path, scale):
+    def synced_digest(self, character):
+        # Content hash of the FBX the synced objects came from
+        rt = pymxs.runtime
+        root = character.registry.find_root()
+        if root is None: return None
+        digest = rt.getUserProp(root, "cas_bridge_hash")
+        return str(digest) if digest else None
+
+    def rescale_synced(self, character, scale):
+        rt = pymxs.runtime
+        root = character.registry.find_root()
+        if root:
+            root.scale = rt.Point3(scale, scale, scale)
+            self.request_redraw()
+
+    def import_full_scene(self, character, path, scale, digest=None):
         if not os.path.exists(path): return
         rt = pymxs.runtime
+        registry = character.registry
         
         try:
             rt.FBXImporterSetParam("Mode", rt.name("create"))
@@ -294,57 +818,114 @@ class CasLiveDialog(QtWidgets.QDialog):
         except: pass
 
         with pymxs.redraw(False):
-            self.delete_previous_sync()
+            scale_root = None
+            synced = []
+            if SYNC_MODE == "incremental":
+                synced = registry.nodes()
+                scale_root = registry.root
+            else:
+                self.delete_previous_sync(character)
+            character.node_cache.invalidate()
             
-            existing_objects = set(rt.objects)
+            mark = registry.mark()
             rt.importFile(path, rt.name("noPrompt"))
-            imported_objects = [obj for obj in rt.objects if obj not in existing_objects]
+            imported_objects = registry.created_since(mark)
             
             if not imported_objects: return
 
-            
-            scale_root = rt.Dummy(name="CAS_SCALE_ROOT")
-            rt.setUserProp(scale_root, "cas_bridge_tag", True)
-            
-            
             for obj in imported_objects:
-                rt.setUserProp(obj, "cas_bridge_tag", True)
-                
                 if ":" in obj.name:
                     try: obj.name = obj.name.split(":")[-1]
                     except: pass
+
+            if scale_root is not None:
+                kept = character.incremental.merge(synced, imported_objects, scale_root)
+                if kept is None:
+                    # Skinned meshes changed: start over from the fresh import
+                    print("Incremental sync not possible, replacing the previous sync.")
+                    rt.delete(synced + [scale_root])
+                    registry.clear()
+                    scale_root = None
+                else:
+                    merged = len(imported_objects) - len(kept)
+                    print(f"Incremental sync: {len(kept)} new, {merged} merged, {len(synced) - merged} removed.")
+                    imported_objects = kept
+                    synced = [obj for obj in synced if rt.isValidNode(obj)]
+
+            if scale_root is None:
+                synced = []
+                scale_root = rt.Dummy(name=registry.root_name)
+                rt.setUserProp(scale_root, "cas_bridge_tag", True)
+            if digest:
+                rt.setUserProp(scale_root, "cas_bridge_hash", digest)
+            
+            
+            for obj in imported_objects:
+                rt.setUserProp(obj, "cas_bridge_tag", True)
                 
                 if obj.parent == None:
                     obj.parent = scale_root
             
+            registry.register(scale_root, synced + imported_objects)
             
             scale_root.scale = rt.Point3(scale, scale, scale)
+            character.node_cache.rebuild()
+            character.live_pose = None
                     
-        rt.redrawViews()
+        self.request_redraw()
 
-    def update_scene_live(self, bones_data, scale, frame_number):
+    def update_scene_live(self, character, pose, scale, drive_time=True):
+        # Applies only; the redraw scheduler decides when the views show it
+        conversion = character.conversion
+        if same_pose(character.live_pose, pose) and scale == conversion.scale:
+            self.redraw.applied(0.0, changed=False)
+            return
+        start = time.perf_counter()
         rt = pymxs.runtime
+        frame_number = pose.frame
+        names = pose.names
+        conversion.scale = scale
+        retarget = character.retarget
+        if retarget is not None:
+            # Bones follow their parents, so the map needs the full pose
+            self.merge_live_pose(character, pose)
+            pose = character.live_pose
+            if pose is None: return
+            pos, rot = conversion.convert(pose)
+            nodes, pos, rot = retarget.apply(pose.names, pos, rot)
+        else:
+            pos, rot = conversion.convert(pose)
+            # Deltas only carry the joints that moved
+            bones = [names[i] for i in pose.joints()]
+            nodes = list(map(character.node_cache.get, bones))
         with pymxs.undo(False):
             with pymxs.redraw(False):
-                if rt.sliderTime != frame_number:
+                if drive_time and rt.sliderTime != frame_number:
                     rt.sliderTime = frame_number
 
-                for bone in bones_data:
-                    name = bone.get("n")
-                    if ":" in name: name = name.split(":")[-1]
-
-                    node = rt.getNodeByName(name)
-                    if not node: continue
-                    
-                    raw_pos = bone.get("p")
-                    raw_rot = bone.get("r")
-                    
-                    node.pos = rt.Point3(raw_pos[0], raw_pos[2], raw_pos[1]) * scale
-                    node.rotation = rt.Quat(raw_rot[0], raw_rot[2], -raw_rot[1], raw_rot[3])
-            rt.redrawViews()
+                if character.applier.apply(nodes, pos, rot):
+                    # A node was deleted: look the nodes up again on the next frame
+                    if retarget is not None:
+                        if not all(rt.isValidNode(node) for node in retarget.nodes if node is not None):
+                            retarget.bind(NodeCache(rt).get)
+                    else:
+                        character.node_cache.evict([bones[k] for k in character.applier.failed])
+        if retarget is None:
+            self.merge_live_pose(character, pose)
+        elapsed = time.perf_counter() - start
+        self.redraw.applied(elapsed)
+        self.stats.add("apply", elapsed)
+
+    def merge_live_pose(self, character, pose):
+        # Full pose as last applied, deltas folded in
+        if pose.indices is None:
+            character.live_pose = pose
+        elif character.live_pose is not None and character.live_pose.names == pose.names:
+            cas_protocol.apply_delta(character.live_pose, pose)
 
     def closeEvent(self, event):
         self.stop_server()
+        self.write_bakes(wait=True)
         event.accept()
 
 
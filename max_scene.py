@@ -0,0 +1,875 @@
+# File: max_scene.py
+# Scene-side helpers for max_receiver.py. Everything here takes the pymxs
+# runtime as a parameter instead of importing pymxs, so it can be driven by
+# any object with the same attributes (see cas_bench.py).
+import time
+
+
+def short_name(name):
+    # Cascadeur joints come in as "Namespace:Joint", imported nodes drop the namespace
+    return name.split(":")[-1] if ":" in name else name
+
+
+# ---------------------------------------------------------
+# NODE CACHE (bone name -> node handle)
+# ---------------------------------------------------------
+class NodeCache:
+    # rt.getNodeByName walks the whole scene, so the scene is indexed once
+    # and incoming bone names are resolved against that index. Names that do
+    # not exist in the scene are cached too, so they cost nothing per frame.
+    # source() may return the nodes to index instead of the whole scene
+    # (None falls back to the scene), so each character sees its own nodes.
+    def __init__(self, rt, source=None):
+        self.rt = rt
+        self.source = source
+        self.by_name = {}
+        self.by_bone = {}
+        self.depths = {}
+        self.built = False
+
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.rebuild_time = 0.0
+        self.rebuild_total = 0.0
+        self.evictions = 0
+
+    def rebuild(self, nodes=None):
+        start = time.perf_counter()
+        if nodes is None and self.source is not None:
+            nodes = self.source()
+        by_name = {}
+        for obj in (self.rt.objects if nodes is None else nodes):
+            # getNodeByName returns the first match, keep the same rule
+            by_name.setdefault(obj.name, obj)
+        self.by_name = by_name
+        self.by_bone = {}
+        self.depths = {}
+        self.built = True
+        self.rebuilds += 1
+        self.rebuild_time = time.perf_counter() - start
+        self.rebuild_total += self.rebuild_time
+        # Later rebuilds can come every frame (a node keeps failing), so
+        # they only show up in stats()
+        if self.rebuilds == 1:
+            print(f"Node cache built: {len(by_name)} nodes in {self.rebuild_time * 1000:.1f} ms")
+
+    def invalidate(self):
+        self.by_name = {}
+        self.by_bone = {}
+        self.depths = {}
+        self.built = False
+
+    def evict(self, bone_names):
+        # Bones whose nodes could not be written. Only a deleted node means
+        # the scene index is stale (rebuilt on the next miss); a node that is
+        # still there just has its entries dropped. Returns True on a rebuild.
+        is_valid = self.rt.isValidNode
+        for name in bone_names:
+            node = self.by_bone.pop(name, None)
+            if node is None: continue
+            if not is_valid(node):
+                self.invalidate()
+                self.evictions += 1
+                return True
+            self.depths.pop(node, None)
+        return False
+
+    def get(self, bone_name):
+        try:
+            node = self.by_bone[bone_name]
+            self.hits += 1
+            return node
+        except KeyError:
+            pass
+
+        self.misses += 1
+        if not self.built:
+            self.rebuild()
+        node = self.by_name.get(short_name(bone_name))
+        self.by_bone[bone_name] = node
+        return node
+
+    def depth(self, node):
+        # Number of ancestors, cached with the node handles
+        try:
+            return self.depths[node]
+        except KeyError:
+            pass
+        parent = node.parent
+        depth = 0 if parent is None else self.depth(parent) + 1
+        self.depths[node] = depth
+        return depth
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "rebuilds": self.rebuilds,
+            "rebuild_ms": round(self.rebuild_time * 1000, 2),
+            "rebuild_total_ms": round(self.rebuild_total * 1000, 1),
+            "invalidations": self.evictions,
+            "nodes": len(self.by_name),
+        }
+
+
+# ---------------------------------------------------------
+# POSE APPLIER (converted pose -> node transforms)
+# ---------------------------------------------------------
+APPLY_BULK = "bulk"
+APPLY_PER_PROPERTY = "per_property"
+
+# One call per frame. Values are 7 floats per node: position xyz, then the
+# quaternion xyzw as it would be assigned to node.rotation. node.rotation
+# is the inverse of transform.rotation in MAXScript, hence the inverse.
+# The node's world scale is kept.
+# Returns the indices (1-based) of the nodes that could not be written.
+_APPLY_POSE_MXS = """
+fn casBridgeApplyPose nodes values = (
+    local failed = #()
+    for i = 1 to nodes.count do (
+        local node = nodes[i]
+        if isValidNode node then try (
+            local k = (i - 1) * 7
+            local tm = (scaleMatrix node.transform.scale) * ((inverse (quat values[k + 4] values[k + 5] values[k + 6] values[k + 7])) as matrix3)
+            tm.row4 = [values[k + 1], values[k + 2], values[k + 3]]
+            node.transform = tm
+        ) catch (append failed i) else append failed i
+    )
+    failed
+)
+"""
+
+
+class PoseApplier:
+    # Writes a converted pose to nodes. Bulk mode packs the frame into one
+    # flat list and crosses the pymxs bridge once, setting full matrices
+    # parents first. Per-property mode is the old node.pos/node.rotation path.
+    def __init__(self, rt, node_cache, mode=APPLY_BULK):
+        self.rt = rt
+        self.node_cache = node_cache
+        self.mode = mode
+        self._apply_fn = None
+        self.failed = []   # indices into the last apply's nodes that could not be written
+        self.frames = 0
+        self.calls = 0
+
+    def _compile(self):
+        try:
+            self.rt.execute(_APPLY_POSE_MXS)
+            self._apply_fn = self.rt.casBridgeApplyPose
+        except Exception as e:
+            print(f"Bulk pose apply unavailable ({e}), falling back to per-property mode")
+            self.mode = APPLY_PER_PROPERTY
+
+    def apply(self, nodes, pos, rot):
+        # nodes[k] gets pos[k*3:k*3+3] / rot[k*4:k*4+4], None entries are skipped.
+        # Returns the number of nodes that could not be written, their
+        # indices are left in self.failed.
+        self.frames += 1
+        if self.mode == APPLY_BULK and self._apply_fn is None:
+            self._compile()
+        if self.mode != APPLY_BULK:
+            self.failed = self._apply_per_property(nodes, pos, rot)
+        else:
+            try:
+                self.failed = self._apply_bulk(nodes, pos, rot)
+            except Exception:
+                # Usually a deleted node in the cache
+                self.failed = [k for k, node in enumerate(nodes) if node is not None]
+        return len(self.failed)
+
+    def _apply_bulk(self, nodes, pos, rot):
+        depth = self.node_cache.depth
+        order = sorted((k for k, node in enumerate(nodes) if node is not None), key=lambda k: depth(nodes[k]))
+        if not order: return []
+
+        ordered = []
+        values = []
+        for k in order:
+            ordered.append(nodes[k])
+            values.extend(pos[k * 3:k * 3 + 3])
+            values.extend(rot[k * 4:k * 4 + 4])
+        self.calls += 1
+        return [order[i - 1] for i in self._apply_fn(ordered, values)]
+
+    def _apply_per_property(self, nodes, pos, rot):
+        rt = self.rt
+        failed = []
+        for k, node in enumerate(nodes):
+            if node is None: continue
+            p = k * 3
+            r = k * 4
+            try:
+                node.pos = rt.Point3(pos[p], pos[p + 1], pos[p + 2])
+                node.rotation = rt.Quat(rot[r], rot[r + 1], rot[r + 2], rot[r + 3])
+            except Exception:
+                failed.append(k)
+            self.calls += 4
+        return failed
+
+
+def read_node_pose(nodes):
+    # World pose of nodes in the convention PoseApplier writes (flat pos
+    # xyz, quaternion xyzw as node.rotation), e.g. a rig's bind pose for
+    # max_stream.RetargetMap.compile
+    pos = []
+    rot = []
+    for node in nodes:
+        tm = node.transform
+        p = tm.row4
+        r = tm.rotation
+        pos.extend((p.x, p.y, p.z))
+        rot.extend((-r.x, -r.y, -r.z, r.w))
+    return pos, rot
+
+
+# ---------------------------------------------------------
+# REDRAW SCHEDULER (viewport redraws decoupled from pose application)
+# ---------------------------------------------------------
+REDRAW_FPS = 30.0
+
+# Disabled viewports are skipped by redrawViews; the ids are handed back so
+# exactly those are enabled again.
+_VIEWS_MXS = """
+fn casBridgeDisableInactiveViews = (
+    local active = viewport.activeViewport
+    local disabled = #()
+    for i = 1 to viewport.numViews where i != active do (
+        viewport.activeViewport = i
+        if viewport.IsEnabled() do (
+            viewport.enable false
+            append disabled i
+        )
+    )
+    viewport.activeViewport = active
+    disabled
+)
+fn casBridgeEnableViews ids = (
+    local active = viewport.activeViewport
+    for i in ids do (
+        viewport.activeViewport = i
+        viewport.enable true
+    )
+    viewport.activeViewport = active
+    ids.count
+)
+"""
+
+
+class RedrawScheduler:
+    # Poses are applied as they arrive and mark() the views dirty; flush()
+    # redraws at most max_fps times a second, and only when something was
+    # marked since the last redraw. flush() returns the seconds until a
+    # pending redraw is due (0 when none is), so the caller can come back
+    # on a timer. active_only disables the inactive viewports while the
+    # link runs (restore() enables them again).
+    # Time spent applying and redrawing is summed per second; redraw times
+    # also go to instruments (cas_stats.Instruments) when given.
+    def __init__(self, rt, max_fps=REDRAW_FPS, active_only=False, clock=time.perf_counter, instruments=None):
+        self.rt = rt
+        self.instruments = instruments
+        self.period = 1.0 / max_fps if max_fps else 0.0
+        self.active_only = active_only
+        self.clock = clock
+        self.dirty = False
+        self.last_redraw = None
+        self.disabled_views = None
+
+        self.marks = 0
+        self.unchanged = 0
+        self.redraws = 0
+        self.apply_time = 0.0
+        self.redraw_time = 0.0
+        self.window_start = clock()
+        self.window_apply = 0.0
+        self.window_redraw = 0.0
+        self.window_redraws = 0
+        self.apply_ms_per_s = 0.0
+        self.redraw_ms_per_s = 0.0
+        self.redraws_per_s = 0.0
+
+    def applied(self, seconds, changed=True):
+        # One pose went through the applier (changed=False: it matched the
+        # pose already in the scene and was not applied)
+        self.apply_time += seconds
+        self.window_apply += seconds
+        if changed:
+            self.mark()
+        else:
+            self.unchanged += 1
+        self._roll(self.clock())
+
+    def mark(self):
+        self.marks += 1
+        self.dirty = True
+
+    def flush(self):
+        if not self.dirty: return 0.0
+        now = self.clock()
+        if self.last_redraw is not None:
+            wait = self.last_redraw + self.period - now
+            if wait > 0: return wait
+        self.redraw()
+        return 0.0
+
+    def redraw(self):
+        if self.active_only and self.disabled_views is None:
+            self._disable_inactive()
+        start = self.clock()
+        self.rt.redrawViews()
+        end = self.clock()
+        self.dirty = False
+        self.last_redraw = start
+        self.redraws += 1
+        self.redraw_time += end - start
+        self.window_redraw += end - start
+        self.window_redraws += 1
+        if self.instruments is not None:
+            self.instruments.add("redraw", end - start)
+        self._roll(end)
+
+    def _roll(self, now):
+        elapsed = now - self.window_start
+        if elapsed < 1.0: return
+        self.apply_ms_per_s = self.window_apply * 1000 / elapsed
+        self.redraw_ms_per_s = self.window_redraw * 1000 / elapsed
+        self.redraws_per_s = self.window_redraws / elapsed
+        self.window_start = now
+        self.window_apply = 0.0
+        self.window_redraw = 0.0
+        self.window_redraws = 0
+
+    def _disable_inactive(self):
+        try:
+            self.rt.execute(_VIEWS_MXS)
+            self.disabled_views = self.rt.casBridgeDisableInactiveViews()
+        except Exception as e:
+            print(f"Active viewport only redraw unavailable ({e}), redrawing all views")
+            self.active_only = False
+
+    def restore(self):
+        views = self.disabled_views
+        self.disabled_views = None
+        if views is None: return
+        try:
+            self.rt.casBridgeEnableViews(views)
+        except Exception as e:
+            print(f"Could not enable the inactive viewports again: {e}")
+
+    def stats(self):
+        return {
+            "marks": self.marks,
+            "unchanged": self.unchanged,
+            "redraws": self.redraws,
+            "apply_s": round(self.apply_time, 3),
+            "redraw_s": round(self.redraw_time, 3),
+            "apply_ms_per_s": round(self.apply_ms_per_s, 1),
+            "redraw_ms_per_s": round(self.redraw_ms_per_s, 1),
+            "redraws_per_s": round(self.redraws_per_s, 1),
+        }
+
+
+# ---------------------------------------------------------
+# KEY BAKER (buffered take -> controller keys)
+# ---------------------------------------------------------
+# One call per commit. Nodes come parents first, each with counts[i] keys;
+# times and values (7 floats per key, as in casBridgeApplyPose) are the
+# keys of all nodes back to back.
+KEYS_REDUCIBLE = 3   # casBridgeKeyModes: linear positions (1) + slerped rotations (2)
+
+_BAKE_KEYS_MXS = """
+fn casBridgeKeyCount ctrl = (
+    if ctrl == undefined then 0 else (
+        local n = amax 0 (numKeys ctrl)
+        for s = 1 to ctrl.numSubs do n += casBridgeKeyCount (getSubAnim ctrl s).controller
+        n
+    )
+)
+fn casBridgeSwappable ctrl linearClass = (
+    -- Only an unkeyed default keyframe controller gives way to the linear
+    -- one; keys, constraints, lists and rigs stay as they are
+    local c = classOf ctrl
+    c != linearClass and (c == Bezier_Position or c == Position_XYZ or c == TCB_Position or c == Euler_XYZ or c == TCB_Rotation) \
+        and casBridgeKeyCount ctrl == 0
+)
+fn casBridgeKeyModes nodes = (
+    -- Per node, once the unkeyed controllers are swapped: +1 positions play
+    -- back as straight lines (linear tangents), +2 rotations are slerped
+    for node in nodes collect (
+        local mode = 0
+        if isValidNode node do try (
+            local pc = classOf node.pos.controller
+            if pc == Linear_Position or pc == Bezier_Position or pc == Position_XYZ do mode += 1
+            local rc = node.rotation.controller
+            if classOf rc == Linear_Rotation or casBridgeSwappable rc Linear_Rotation do mode += 2
+        ) catch ()
+        mode
+    )
+)
+fn casBridgeLinearTangents ctrl t = (
+    if ctrl != undefined do (
+        local i = try (getKeyIndex ctrl t) catch 0
+        if i > 0 do try (
+            local key = ctrl.keys[i]
+            key.inTangentType = #linear
+            key.outTangentType = #linear
+        ) catch ()
+        for s = 1 to ctrl.numSubs do casBridgeLinearTangents (getSubAnim ctrl s).controller t
+    )
+)
+fn casBridgeBakeKeys nodes counts times values = (
+    local k = 0
+    local written = 0
+    for i = 1 to nodes.count do (
+        local node = nodes[i]
+        if isValidNode node then (
+            try (
+                if casBridgeSwappable node.pos.controller Linear_Position do node.pos.controller = Linear_Position()
+                if casBridgeSwappable node.rotation.controller Linear_Rotation do node.rotation.controller = Linear_Rotation()
+            ) catch ()
+            local pc = try (node.pos.controller) catch undefined
+            local rc = try (node.rotation.controller) catch undefined
+            with animate on (
+                for n = 1 to counts[i] do (
+                    k += 1
+                    local v = (k - 1) * 7
+                    local t = times[k]
+                    at time t (
+                        in coordsys parent node.rotation = quat values[v + 4] values[v + 5] values[v + 6] values[v + 7]
+                        in coordsys parent node.pos = [values[v + 1], values[v + 2], values[v + 3]]
+                    )
+                    -- New keys in the user's own controllers get linear tangents
+                    if classOf pc != Linear_Position do casBridgeLinearTangents pc t
+                    if classOf rc != Linear_Rotation do casBridgeLinearTangents rc t
+                )
+            )
+            written += counts[i]
+        ) else k += counts[i]
+    )
+    written
+)
+"""
+
+
+class KeyBaker:
+    # Writes a reduced take as keys, all nodes and frames in one bridge call.
+    # Keys are parent-space values (max_stream.local_frames). A node whose
+    # position/rotation controller has no keys yet gets Linear_Position /
+    # Linear_Rotation, so keys interpolate exactly as reduce_keys assumes;
+    # keyed controllers are kept and the new keys get linear tangents.
+    # key_modes() tells which nodes play back that way.
+    def __init__(self, rt, node_cache):
+        self.rt = rt
+        self.node_cache = node_cache
+        self._bake_fn = None
+        self._modes_fn = None
+        self.commits = 0
+        self.keys = 0
+        self.commit_time = 0.0
+
+    def parent_spaces(self, nodes):
+        # (parents, spaces) for max_stream.local_frames: a parent that is not
+        # being baked is read once, as it stands now
+        index = {node.inode.handle: j for j, node in enumerate(nodes) if node is not None}
+        parents = []
+        spaces = []
+        for node in nodes:
+            parent = node.parent if node is not None else None
+            if parent is None:
+                parents.append(-1)
+                spaces.append(None)
+                continue
+            s = parent.transform.scale
+            scale = (s.x or 1.0, s.y or 1.0, s.z or 1.0)
+            j = index.get(parent.inode.handle, -1)
+            parents.append(j)
+            if j >= 0:
+                spaces.append((None, None, scale))
+            else:
+                pos, rot = read_node_pose([parent])
+                spaces.append((pos, rot, scale))
+        return parents, spaces
+
+    def _compile(self):
+        if self._bake_fn is None:
+            self.rt.execute(_BAKE_KEYS_MXS)
+            self._bake_fn = self.rt.casBridgeBakeKeys
+            self._modes_fn = self.rt.casBridgeKeyModes
+
+    def key_modes(self, nodes):
+        # Per node: True when its keys play back as reduce_keys measures them
+        # (linear positions, slerped rotations). The others need every frame.
+        self._compile()
+        present = [node for node in nodes if node is not None]
+        modes = iter(self._modes_fn(present) if present else ())
+        return [node is not None and next(modes) == KEYS_REDUCIBLE for node in nodes]
+
+    def bake(self, nodes, times, pos_frames, rot_frames, keep):
+        # nodes[j] is keyed at times[f] for every f in keep[j], None entries
+        # are skipped; frames are parent-space (see parent_spaces). Returns
+        # the number of keys written.
+        self._compile()
+
+        start = time.perf_counter()
+        ordered = []
+        counts = []
+        key_times = []
+        values = []
+        for j, node in enumerate(nodes):
+            if node is None or not keep[j]: continue
+            ordered.append(node)
+            counts.append(len(keep[j]))
+            for f in keep[j]:
+                key_times.append(times[f])
+                values.extend(pos_frames[f][j * 3:j * 3 + 3])
+                values.extend(rot_frames[f][j * 4:j * 4 + 4])
+        written = self._bake_fn(ordered, counts, key_times, values) if ordered else 0
+        self.commits += 1
+        self.keys += written
+        self.commit_time += time.perf_counter() - start
+        return written
+
+    def stats(self):
+        return {"commits": self.commits, "keys": self.keys, "commit_s": round(self.commit_time, 3)}
+
+
+# ---------------------------------------------------------
+# MESH SYNC CACHE (skip re-importing an unchanged export)
+# ---------------------------------------------------------
+class MeshSyncCache:
+    # SYNC_MODEL carries a content hash of the exported FBX. When the scene
+    # already holds that version the import is skipped. scene_digest()
+    # returns the hash stored with the synced objects (None if there are none).
+    def __init__(self):
+        self.import_times = {}
+        self.hits = 0
+        self.misses = 0
+        self.time_saved = 0.0
+
+    def sync(self, path, digest, importer, scene_digest):
+        # Returns True if importer(path) ran, False if it was skipped
+        if digest and scene_digest() == digest:
+            self.hits += 1
+            saved = self.import_times.get(digest, 0.0)
+            self.time_saved += saved
+            print(f"Mesh sync cache hit ({digest[:8]}), skipped import" + (f", saved {saved:.2f}s" if saved else ""))
+            return False
+
+        self.misses += 1
+        start = time.perf_counter()
+        importer(path)
+        elapsed = time.perf_counter() - start
+        if digest:
+            self.import_times[digest] = elapsed
+        print(f"Mesh sync cache miss ({(digest or 'no hash')[:8]}), imported in {elapsed:.2f}s")
+        return True
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "time_saved_s": round(self.time_saved, 2)}
+
+
+# ---------------------------------------------------------
+# INCREMENTAL SYNC (merge a fresh import into the synced nodes)
+# ---------------------------------------------------------
+# Content signature of a base object in one call: vertex positions, faces,
+# smoothing groups and texture vertices. 0 for objects without a mesh
+# (dummies, helpers), undefined when the mesh could not be read.
+_GEOMETRY_HASH_MXS = """
+fn casBridgeGeometryHash obj = (
+    if not canConvertTo obj TriMeshGeometry then return 0
+    try (
+        local m = obj.mesh
+        local h = getHashValue m.numverts 0
+        h = getHashValue m.numfaces h
+        for i = 1 to m.numverts do h = getHashValue (getVert m i) h
+        for i = 1 to m.numfaces do (
+            h = getHashValue (getFace m i) h
+            h = getHashValue (getFaceSmoothGroup m i) h
+        )
+        for i = 1 to m.numtverts do h = getHashValue (getTVert m i) h
+        h
+    ) catch undefined
+)
+"""
+
+
+class IncrementalSync:
+    # Matches freshly imported nodes to the nodes of the previous sync by
+    # name. Unchanged nodes are left alone (user modifiers, links and
+    # controllers stay), changed geometry is swapped in as the base object
+    # under the existing modifier stack, hierarchy changes are relinked and
+    # only the differences are created or deleted.
+    # Skin bindings refer to the imported bones, so when a skinned mesh is
+    # new or changed, merge() gives up and the caller does a full replace.
+    # Geometry is compared by content (casBridgeGeometryHash), so moved
+    # vertices or UV edits with the same counts are picked up; geometry that
+    # cannot be hashed always counts as changed.
+    def __init__(self, rt):
+        self.rt = rt
+        self._hash_fn = None
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.relinked = 0
+        self.deleted = 0
+        self.fallbacks = 0
+
+    def _compile(self):
+        try:
+            self.rt.execute(_GEOMETRY_HASH_MXS)
+            self._hash_fn = self.rt.casBridgeGeometryHash
+        except Exception as e:
+            print(f"Geometry hash unavailable ({e}), every matched mesh counts as changed")
+            self._hash_fn = False
+
+    def geometry(self, node):
+        # (class, content hash), or None when the content is unknown
+        if self._hash_fn is None:
+            self._compile()
+        if not self._hash_fn: return None
+        base = node.baseObject
+        try:
+            digest = self._hash_fn(base)
+        except Exception:
+            return None
+        if digest is None: return None
+        return str(self.rt.classOf(base)), digest
+
+    def same_geometry(self, node, old):
+        geometry = self.geometry(node)
+        return geometry is not None and geometry == self.geometry(old)
+
+    def is_skinned(self, node):
+        rt = self.rt
+        return any(rt.classOf(mod) == rt.Skin for mod in node.modifiers)
+
+    def merge(self, existing, imported, root):
+        # existing: nodes of the previous sync (without root), imported: new
+        # nodes. Returns the imported nodes that were kept, or None if a full
+        # replace is needed. Nothing is touched in that case.
+        old_by_name = {node.name: node for node in existing}
+        kept = []
+        matched = {}
+        changed = []
+        for node in imported:
+            old = old_by_name.pop(node.name, None)
+            if old is None:
+                if self.is_skinned(node): return self._fallback()
+                kept.append(node)
+                continue
+            matched[node] = old
+            if not self.same_geometry(node, old):
+                if self.is_skinned(node) or self.is_skinned(old): return self._fallback()
+                changed.append((node, old))
+
+        for node, old in changed:
+            old.baseObject = node.baseObject
+        self.updated += len(changed)
+        self.unchanged += len(matched) - len(changed)
+        self.created += len(kept)
+
+        # Hierarchy: point everything at the surviving counterparts
+        for node in kept:
+            parent = node.parent
+            if parent in matched:
+                node.parent = matched[parent]
+        for node, old in matched.items():
+            parent = node.parent
+            target = root if parent is None else matched.get(parent, parent)
+            if old.parent != target:
+                old.parent = target
+                self.relinked += 1
+
+        stale = list(old_by_name.values())
+        self.deleted += len(stale)
+        doomed = list(matched) + stale
+        if doomed:
+            self.rt.delete(doomed)
+        return kept
+
+    def _fallback(self):
+        self.fallbacks += 1
+        return None
+
+    def stats(self):
+        return {
+            "created": self.created,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "relinked": self.relinked,
+            "deleted": self.deleted,
+            "fallbacks": self.fallbacks,
+        }
+
+
+# ---------------------------------------------------------
+# SYNC REGISTRY (which nodes belong to the bridge)
+# ---------------------------------------------------------
+SYNC_ROOT_NAME = "CAS_SCALE_ROOT"
+SYNC_TAG = "cas_bridge_tag"
+SYNC_HANDLES = "cas_bridge_handles"
+
+
+class SyncRegistry:
+    # Node handles of the synced objects, stored as a user property on the
+    # scale root so they survive saving and reopening the scene. Finding the
+    # synced nodes costs one lookup per synced node instead of a user
+    # property read per scene object. Handles are only trusted while the
+    # node they resolve to carries the sync tag: merging or XRef-ing the
+    # scene renumbers handles, and an unrelated node must never be taken
+    # for (and deleted as) a synced one. Any mismatch, and scenes synced
+    # before the registry existed, rescan the root's hierarchy once.
+    def __init__(self, rt, root_name=SYNC_ROOT_NAME):
+        self.rt = rt
+        self.root_name = root_name
+        self.root = None
+        self.handles = None
+        self.loads = 0
+        self.scans = 0
+        self.stale = 0
+
+    def handle(self, node):
+        return node.inode.handle
+
+    def find_root(self):
+        rt = self.rt
+        if self.root is not None and rt.isValidNode(self.root):
+            return self.root
+        self.root = None
+        self.handles = None
+        root = rt.getNodeByName(self.root_name)
+        if root and rt.getUserProp(root, SYNC_TAG) == True:
+            self.root = root
+        return self.root
+
+    def nodes(self):
+        # Synced nodes without the root; deleted ones are dropped
+        rt = self.rt
+        root = self.find_root()
+        if root is None: return []
+        if self.handles is None:
+            self._load(root)
+
+        get_node = rt.maxOps.getNodeByHandle
+        get_prop = rt.getUserProp
+        nodes = []
+        for handle in self.handles:
+            node = get_node(handle)
+            if node is not None and get_prop(node, SYNC_TAG) == True:
+                nodes.append(node)
+        if len(nodes) != len(self.handles):
+            # Deleted, or renumbered: take only tagged nodes under the root
+            self.stale += 1
+            nodes = self._scan(root)
+            self.register(root, nodes)
+        return nodes
+
+    def _scan(self, root):
+        rt = self.rt
+        self.scans += 1
+        nodes = []
+        pending = list(root.children)
+        while pending:
+            node = pending.pop()
+            pending.extend(node.children)
+            if rt.getUserProp(node, SYNC_TAG) == True:
+                nodes.append(node)
+        return nodes
+
+    def _load(self, root):
+        rt = self.rt
+        self.loads += 1
+        stored = rt.getUserProp(root, SYNC_HANDLES)
+        if stored is not None and stored != "":
+            try:
+                self.handles = [int(h) for h in str(stored).split(",") if h]
+                return
+            except ValueError:
+                pass
+        # Synced before the registry existed, or the property was edited
+        self.register(root, self._scan(root))
+
+    def register(self, root, nodes):
+        self.root = root
+        self.handles = [self.handle(node) for node in nodes]
+        self.rt.setUserProp(root, SYNC_HANDLES, ",".join(map(str, self.handles)))
+
+    def clear(self):
+        self.root = None
+        self.handles = None
+
+    # Handles are handed out in creation order, so the nodes an import added
+    # are the ones between a probe node made before and one made after it.
+    def mark(self):
+        rt = self.rt
+        probe = rt.Dummy()
+        handle = self.handle(probe)
+        rt.delete(probe)
+        return handle
+
+    def created_since(self, mark):
+        end = self.mark()
+        get_node = self.rt.maxOps.getNodeByHandle
+        nodes = []
+        for handle in range(mark + 1, end):
+            node = get_node(handle)
+            if node is not None:
+                nodes.append(node)
+        return nodes
+
+    def stats(self):
+        return {
+            "nodes": len(self.handles or ()),
+            "loads": self.loads,
+            "scans": self.scans,
+            "stale": self.stale,
+        }
+
+
+# ---------------------------------------------------------
+# CHARACTER SCENE (per streamed character: its nodes and caches)
+# ---------------------------------------------------------
+def sync_root_name(namespace=""):
+    # The default character keeps the root name older versions created
+    return f"{SYNC_ROOT_NAME}_{namespace}" if namespace else SYNC_ROOT_NAME
+
+
+class CharacterScene:
+    # Everything the receiver keeps per character (one per sender namespace):
+    # the synced nodes under their own scale root, a node cache over just
+    # those nodes, and the applier, key baker and caches bound to it. Two
+    # characters with the same joint names drive separate nodes.
+    def __init__(self, rt, namespace="", apply_mode=APPLY_BULK, conversion=None):
+        self.rt = rt
+        self.namespace = namespace
+        self.conversion = conversion
+        self.registry = SyncRegistry(rt, sync_root_name(namespace))
+        self.node_cache = NodeCache(rt, self.synced_nodes)
+        self.applier = PoseApplier(rt, self.node_cache, apply_mode)
+        self.baker = KeyBaker(rt, self.node_cache)
+        self.incremental = IncrementalSync(rt)
+        self.mesh_cache = MeshSyncCache()
+        self.live_pose = None
+        self.bulk = None
+        self.retarget = None   # max_stream.RetargetMap bound to another rig's nodes
+
+    def synced_nodes(self):
+        # None until this character has been synced: then the whole scene,
+        # for rigs that were built in Max with matching names
+        root = self.registry.find_root()
+        if root is None: return None
+        return self.registry.nodes() + [root]
+
+    def label(self):
+        return self.namespace or "default"
+
+    def stats(self):
+        return {
+            "node_cache": self.node_cache.stats(),
+            "mesh_sync": self.mesh_cache.stats(),
+            "incremental": self.incremental.stats(),
+            "registry": self.registry.stats(),
+            "baker": self.baker.stats(),
+            "retarget": self.retarget.stats() if self.retarget is not None else None,
+        }
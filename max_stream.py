@@ -0,0 +1,1148 @@
+# File: max_stream.py
+# Receiver-side stream stages that run without 3ds Max (no pymxs/Qt imports).
+import json
+import math
+import bisect
+import time
+import socket
+import selectors
+import threading
+from array import array
+from collections import deque
+
+import cas_stats
+from cas_protocol import PoseFrame, Session, merge_poses, apply_delta
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+LIVE_COMMAND = "LIVE_DATA"
+TAKE_MAX_FRAMES = 100000
+KEY_POS_TOLERANCE = 0.01     # scene units
+KEY_ROT_TOLERANCE = 0.0005   # quaternion components, about 0.06 degrees
+FEEDBACK_INTERVAL = 0.25     # seconds between FEEDBACK reports to the sender
+RETARGET_VERSION = 1
+RETARGET_PREFIXES = ("bip001", "bip01")   # rig prefixes ignored when matching bone names
+READ_BUDGET = 64 * 1024      # bytes read from one connection before the next gets its turn
+SEND_TIMEOUT = 2.0           # acks and feedback to a sender that stopped reading
+
+
+# ---------------------------------------------------------
+# LINK SERVER (all sender connections on one selector loop)
+# ---------------------------------------------------------
+class Link:
+    # One sender connection. namespace and scale come from its HELLO and
+    # pick the character in Max it drives ("" is the default character).
+    _ids = 0
+
+    def __init__(self, sock, addr):
+        Link._ids += 1
+        self.id = Link._ids
+        self.sock = sock
+        self.addr = addr
+        self.session = Session(sock, framed=False)
+        self.layouts = {}
+        self.namespace = ""
+        self.scale = None
+        self.opened = time.perf_counter()
+        self.messages = 0
+        # Filled on the main thread as this link's poses are applied
+        self.feedback = ApplyFeedback()
+        self.latency = cas_stats.Histogram()
+
+    def __repr__(self):
+        return f"<Link {self.id} {self.namespace or 'default'} {self.addr[0]}:{self.addr[1]}>"
+
+
+class LinkServer:
+    # Runs on the receiver's worker thread. One selector watches the
+    # listening socket, every sender connection and a wakeup socket pair,
+    # so stop() ends serve() at once instead of after a socket timeout.
+    # A ready connection gets one read of at most read_budget bytes per turn
+    # and its messages are handled before the next connection's, so a sender
+    # pushing a bulk transfer cannot starve a live stream.
+    # handler gets on_open(link), on_message(link, channel, payload) (raise
+    # ValueError for a malformed message, anything else closes the link)
+    # and on_close(link).
+    def __init__(self, host, port, handler, read_budget=READ_BUDGET, backlog=16):
+        self.host = host
+        self.port = port
+        self.handler = handler
+        self.read_budget = read_budget
+        self.backlog = backlog
+        self.selector = selectors.DefaultSelector()
+        self.links = {}
+        self.first = None
+        self.running = False
+        self.listener = None
+        # socketpair rather than os.pipe: select() on Windows only takes sockets
+        self.wake_recv, self.wake_send = socket.socketpair()
+        self.wake_recv.setblocking(False)
+        self.wake_send.setblocking(False)
+
+        self.accepted = 0
+        self.closed = 0
+        self.turns = 0
+        self.malformed = 0
+
+    def open(self):
+        # Raises OSError when the port is taken
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            listener.bind((self.host, self.port))
+            listener.listen(self.backlog)
+        except OSError:
+            listener.close()
+            raise
+        listener.setblocking(False)
+        self.listener = listener
+        self.port = listener.getsockname()[1]
+        self.selector.register(listener, selectors.EVENT_READ, "listen")
+        self.selector.register(self.wake_recv, selectors.EVENT_READ, "wake")
+        self.running = True
+
+    def serve(self):
+        try:
+            while self.running:
+                for key, _ in self.selector.select():
+                    if key.data == "listen":
+                        self._accept()
+                    elif key.data == "wake":
+                        self._drain_wake()
+                    else:
+                        self._read(key.data)
+                    if not self.running: break
+                self.turns += 1
+        finally:
+            for link in list(self.links.values()):
+                self._close(link)
+            self.selector.close()
+            if self.listener is not None:
+                self.listener.close()
+            self.wake_recv.close()
+            self.wake_send.close()
+
+    def stop(self):
+        # Any thread
+        self.running = False
+        try:
+            self.wake_send.send(b"x")
+        except OSError:
+            pass
+
+    def primary(self):
+        # The longest connected link, e.g. the one that drives the time
+        # slider. Safe to call from the main thread.
+        return self.first
+
+    def _accept(self):
+        while True:
+            try:
+                sock, addr = self.listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            # Blocking with a timeout: reads only happen once the selector
+            # says there is data, sends (acks, feedback) may wait a little
+            sock.setblocking(True)
+            sock.settimeout(SEND_TIMEOUT)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            link = Link(sock, addr)
+            self.links[link.id] = link
+            if self.first is None:
+                self.first = link
+            self.selector.register(sock, selectors.EVENT_READ, link)
+            self.accepted += 1
+            self.handler.on_open(link)
+
+    def _drain_wake(self):
+        try:
+            while self.wake_recv.recv(64): pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _read(self, link):
+        reader = link.session.reader
+        try:
+            if not reader.recv_from(link.sock, self.read_budget):
+                self._close(link)
+                return
+        except OSError:
+            self._close(link)
+            return
+        try:
+            for channel, payload in reader.messages():
+                link.messages += 1
+                try:
+                    self.handler.on_message(link, channel, payload)
+                except ValueError:
+                    reader.malformed += 1
+                    self.malformed += 1
+        except OSError:
+            self._close(link)
+        except Exception as e:
+            # A bug in one sender's handling must not take down the others
+            print(f"Link {link.id} error: {e}")
+            self._close(link)
+
+    def _close(self, link):
+        if self.links.pop(link.id, None) is None: return
+        if self.first is link:
+            self.first = next(iter(self.links.values()), None)
+        try:
+            self.selector.unregister(link.sock)
+        except (KeyError, ValueError):
+            pass
+        link.sock.close()
+        self.closed += 1
+        self.handler.on_close(link)
+
+    def stats(self):
+        return {
+            "links": len(self.links),
+            "accepted": self.accepted,
+            "closed": self.closed,
+            "turns": self.turns,
+            "malformed": self.malformed,
+        }
+
+
+# ---------------------------------------------------------
+# POSE MAILBOX (worker thread -> Max main thread)
+# ---------------------------------------------------------
+class PoseMailbox:
+    # Only the newest LIVE_DATA pose per session (packet["_link_id"]) is
+    # kept; older ones are dropped when a newer one of the same session
+    # arrives before the main thread got to them. Every other command is
+    # queued and delivered in order.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = deque()
+        self.poses = {}
+
+        self.received = 0
+        self.applied = 0
+        self.dropped = 0
+        self.dropped_by = {}
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def put(self, packet):
+        # Returns True when the mailbox was empty, i.e. the main thread has
+        # to be woken up. Otherwise a wake-up is already pending.
+        packet["_recv_time"] = time.perf_counter()
+        with self.lock:
+            was_empty = not self.poses and not self.commands
+            self.received += 1
+            if packet.get("command") == LIVE_COMMAND:
+                slot = packet.get("_link_id", 0)
+                pending = self.poses.get(slot)
+                if pending is not None:
+                    self.dropped += 1
+                    self.dropped_by[slot] = self.dropped_by.get(slot, 0) + 1
+                    # A delta only carries the joints that moved, so keep the
+                    # ones from the dropped pose as well
+                    older = pending.get("pose")
+                    newer = packet.get("pose")
+                    if older is not None and newer is not None:
+                        packet["pose"] = merge_poses(older, newer)
+                self.poses[slot] = packet
+            else:
+                self.commands.append(packet)
+        return was_empty
+
+    def drain(self):
+        # Returns (commands in arrival order, newest pose of each session)
+        with self.lock:
+            commands = list(self.commands)
+            self.commands.clear()
+            poses = list(self.poses.values())
+            self.poses = {}
+        return commands, poses
+
+    def mark_applied(self, packet):
+        wait = time.perf_counter() - packet.get("_recv_time", time.perf_counter())
+        self.applied += 1
+        self.wait_total += wait
+        if wait > self.wait_max:
+            self.wait_max = wait
+
+    def stats(self):
+        avg = self.wait_total / self.applied if self.applied else 0.0
+        return {
+            "received": self.received,
+            "applied": self.applied,
+            "dropped": self.dropped,
+            "avg_wait_ms": round(avg * 1000, 2),
+            "max_wait_ms": round(self.wait_max * 1000, 2),
+        }
+
+
+# ---------------------------------------------------------
+# APPLY FEEDBACK (receiver load, reported back to the sender)
+# ---------------------------------------------------------
+class ApplyFeedback:
+    # The main thread records every applied pose with the time it took
+    # (apply plus redraw). At most every `interval` seconds record() returns
+    # a FEEDBACK packet for the sender's pacer: last applied frame, poses
+    # applied and dropped since the previous report, average apply time, and
+    # the sender's stamp of the last applied pose (t) when it had one.
+    # applied counts since the last report; total_applied never resets.
+    def __init__(self, interval=FEEDBACK_INTERVAL, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self.start = clock()
+        self.applied = 0
+        self.total_applied = 0
+        self.apply_total = 0.0
+        self.dropped_seen = 0
+        self.sent = None
+        self.reports = 0
+
+    def record(self, frame, seconds, dropped_total, sent=None):
+        self.applied += 1
+        self.total_applied += 1
+        if sent is not None:
+            self.sent = sent
+        self.apply_total += seconds
+        now = self.clock()
+        elapsed = now - self.start
+        if elapsed < self.interval: return None
+        report = {
+            "command": "FEEDBACK",
+            "frame": frame,
+            "applied": self.applied,
+            "dropped": dropped_total - self.dropped_seen,
+            "apply_ms": round(self.apply_total / self.applied * 1000, 3),
+            "interval": round(elapsed, 4),
+        }
+        if self.sent is not None:
+            report["t"] = self.sent
+            self.sent = None
+        self.start = now
+        self.applied = 0
+        self.apply_total = 0.0
+        self.dropped_seen = dropped_total
+        self.reports += 1
+        return report
+
+
+# ---------------------------------------------------------
+# AXIS CONVERSION (Cascadeur space -> Max space)
+# ---------------------------------------------------------
+# Cascadeur is Y-up, Max is Z-up: position (x, y, z) -> (x, z, y),
+# rotation (x, y, z, w) -> (x, z, -y, w).
+CASCADEUR_TO_MAX_POS = ((0, 2, 1), (1.0, 1.0, 1.0))
+CASCADEUR_TO_MAX_ROT = ((0, 2, 1, 3), (1.0, 1.0, -1.0, 1.0))
+
+
+class AxisConversion:
+    # Converts whole pose arrays at once (NumPy when available, otherwise
+    # strided slices) and returns flat float lists ready to apply:
+    # pos[k*3:k*3+3] and rot[k*4:k*4+4] for the k-th joint carried in the pose.
+    # Positions are scaled, then the optional per-bone offset is added.
+    def __init__(self, pos_axes=CASCADEUR_TO_MAX_POS, rot_axes=CASCADEUR_TO_MAX_ROT, scale=1.0, offsets=None):
+        self.pos_axes = pos_axes
+        self.rot_axes = rot_axes
+        self.scale = scale
+        self.set_offsets(offsets)
+
+    def with_scale(self, scale):
+        # Same axes and offsets at another scale, leaving this one untouched
+        copy = AxisConversion(self.pos_axes, self.rot_axes, scale)
+        copy.offsets = self.offsets
+        return copy
+
+    def set_offsets(self, offsets):
+        # offsets: {bone name: (x, y, z)} in Max space, after scaling
+        self.offsets = dict(offsets) if offsets else None
+        self._offset_names = None
+        self._offset_values = None
+
+    def _layout_offsets(self, names):
+        if names is not self._offset_names:
+            values = []
+            for name in names:
+                values.extend(self.offsets.get(name, (0.0, 0.0, 0.0)))
+            self._offset_names = names
+            self._offset_values = numpy.array(values, dtype=numpy.float64).reshape(-1, 3) if numpy else values
+        return self._offset_values
+
+    def convert(self, pose):
+        pos = self._swizzle(pose.pos, self.pos_axes, self.scale)
+        rot = self._swizzle(pose.rot, self.rot_axes, 1.0)
+        if self.offsets:
+            pos = self._add_offsets(pos, pose)
+        if numpy is not None:
+            return pos.ravel().tolist(), rot.ravel().tolist()
+        return pos, rot
+
+    def _swizzle(self, values, axes, scale):
+        order, signs = axes
+        stride = len(order)
+        if numpy is not None:
+            src = numpy.frombuffer(values, dtype=numpy.float32).reshape(-1, stride)
+            return src[:, order] * (numpy.array(signs) * scale)
+
+        out = [0.0] * len(values)
+        for c in range(stride):
+            k = signs[c] * scale
+            column = values[order[c]::stride]
+            out[c::stride] = column if k == 1.0 else [v * k for v in column]
+        return out
+
+    def _add_offsets(self, pos, pose):
+        offsets = self._layout_offsets(pose.names)
+        if numpy is not None:
+            joints = slice(None) if pose.indices is None else numpy.asarray(pose.indices)
+            return pos + offsets[joints]
+        for k, i in enumerate(pose.joints()):
+            pos[k * 3] += offsets[i * 3]
+            pos[k * 3 + 1] += offsets[i * 3 + 1]
+            pos[k * 3 + 2] += offsets[i * 3 + 2]
+        return pos
+
+
+# ---------------------------------------------------------
+# RETARGET MAP (converted pose -> another rig's nodes)
+# ---------------------------------------------------------
+# Quaternions are node.rotation values as streamed (see PoseApplier): a
+# world rotation q takes a vector v from the bone's space to world space
+# as q*v*q^-1, and a child's world rotation is parent * local.
+def quat_mul(a, b):
+    ax, ay, az, aw = a
+    bx, by, bz, bw = b
+    return (aw * bx + ax * bw + ay * bz - az * by,
+            aw * by - ax * bz + ay * bw + az * bx,
+            aw * bz + ax * by - ay * bx + az * bw,
+            aw * bw - ax * bx - ay * by - az * bz)
+
+
+def quat_conj(q):
+    return (-q[0], -q[1], -q[2], q[3])
+
+
+def quat_rotate(q, v):
+    x, y, z, w = q
+    tx = 2.0 * (y * v[2] - z * v[1])
+    ty = 2.0 * (z * v[0] - x * v[2])
+    tz = 2.0 * (x * v[1] - y * v[0])
+    return (v[0] + w * tx + y * tz - z * ty,
+            v[1] + w * ty + z * tx - x * tz,
+            v[2] + w * tz + x * ty - y * tx)
+
+
+def quat_slerp(a, b, u):
+    # Constant-speed rotation from a to b (what Max's Linear_Rotation
+    # controller plays back between two keys), the short way round
+    d = a[0] * b[0] + a[1] * b[1] + a[2] * b[2] + a[3] * b[3]
+    if d < 0.0:
+        b = (-b[0], -b[1], -b[2], -b[3])
+        d = -d
+    if d > 0.9995:
+        return _quat_normalize(tuple(x + (y - x) * u for x, y in zip(a, b)))
+    theta = math.acos(d)
+    s = math.sin(theta)
+    wa = math.sin((1.0 - u) * theta) / s
+    wb = math.sin(u * theta) / s
+    return tuple(x * wa + y * wb for x, y in zip(a, b))
+
+
+def _quat_normalize(q):
+    n = sum(c * c for c in q) ** 0.5 or 1.0
+    return tuple(c / n for c in q)
+
+
+def _quat_mul_rows(a, b):
+    ax, ay, az, aw = a.T
+    bx, by, bz, bw = b.T
+    return numpy.stack((aw * bx + ax * bw + ay * bz - az * by,
+                        aw * by - ax * bz + ay * bw + az * bx,
+                        aw * bz + ax * by - ay * bx + az * bw,
+                        aw * bw - ax * bx - ay * by - az * bz), axis=1)
+
+
+def _cross_rows(a, b):
+    # numpy.cross is slow on small arrays
+    ax, ay, az = a.T
+    bx, by, bz = b.T
+    return numpy.stack((ay * bz - az * by, az * bx - ax * bz, ax * by - ay * bx), axis=1)
+
+
+def _quat_rotate_rows(q, v):
+    u = q[:, :3]
+    t = 2.0 * _cross_rows(u, v)
+    return v + q[:, 3:] * t + _cross_rows(u, t)
+
+
+def match_bones(source_names, target_names):
+    # {target name: source joint name}: same name without namespace first,
+    # then case, separators and rig prefixes ("Bip001 L Thigh" ~ "l_thigh")
+    # ignored. Each source joint drives one target at most.
+    def key(name):
+        key = "".join(c for c in name.split(":")[-1].lower() if c.isalnum())
+        for prefix in RETARGET_PREFIXES:
+            if key.startswith(prefix) and len(key) > len(prefix):
+                return key[len(prefix):]
+        return key
+
+    exact = {}
+    loose = {}
+    for name in source_names:
+        exact.setdefault(name.split(":")[-1], name)
+        loose.setdefault(key(name), name)
+    mapping = {}
+    used = set()
+    for rule, table in ((lambda n: n.split(":")[-1], exact), (key, loose)):
+        for target in target_names:
+            if target in mapping: continue
+            source = table.get(rule(target))
+            if source is not None and source not in used:
+                mapping[target] = source
+                used.add(source)
+    return mapping
+
+
+class RetargetMap:
+    # Built once per target rig, from the source and the target in the same
+    # stance (compile), or read back from its file (load). Per bone k, with
+    # s the source joint it follows:
+    #   rot[k] = rot[s] * rot_offset[k]
+    #   pos[k] = pos[s] + rot[s] applied to pos_offset[k]          (roots)
+    #   pos[k] = pos[parent] + rot[parent] applied to local[k]     (the rest)
+    # so the target keeps its own proportions. Bones are stored parents
+    # first. With NumPy a frame is a few array expressions over all bones,
+    # the offsets summed down the hierarchy with one product by a
+    # precomputed ancestor matrix; there are no name lookups per frame.
+    def __init__(self, source_names, bones):
+        # bones: dicts with target, source, parent (index, -1 for roots),
+        # rot (x, y, z, w), pos and local (x, y, z)
+        self.source_names = list(source_names)
+        self.bones = bones
+        self.targets = [bone["target"] for bone in bones]
+        self.sources = [bone["source"] for bone in bones]
+        self.parents = [bone["parent"] for bone in bones]
+        self.rot_offsets = [tuple(bone["rot"]) for bone in bones]
+        self.pos_offsets = [tuple(bone["pos"]) for bone in bones]
+        self.local_offsets = [tuple(bone["local"]) for bone in bones]
+
+        depths = []
+        for k, parent in enumerate(self.parents):
+            if parent >= k:
+                raise ValueError(f"Bone {self.targets[k]} comes before its parent")
+            depths.append(0 if parent < 0 else depths[parent] + 1)
+        self.depth = max(depths, default=-1) + 1
+        self.roots = [k for k, parent in enumerate(self.parents) if parent < 0]
+        # Without NumPy: roots and the other bones (parents first) are two
+        # separate passes, each bone with its offsets and flat array slots
+        self._root_bones = [(k, k * 3) + self.pos_offsets[k] for k in self.roots]
+        self._child_bones = [(k * 3, parent * 3, parent * 4) + self.local_offsets[k]
+                             for k, parent in enumerate(self.parents) if parent >= 0]
+        if numpy is not None:
+            count = len(bones)
+            roots = numpy.array([parent < 0 for parent in self.parents], dtype=bool).reshape(-1, 1)
+            # ancestors[k, j] = 1 when j is k or one of its ancestors
+            ancestors = numpy.zeros((count, count))
+            for k, parent in enumerate(self.parents):
+                if parent >= 0:
+                    ancestors[k] = ancestors[parent]
+                ancestors[k, k] = 1.0
+            self._ancestors = ancestors
+            self._roots = roots
+            self._parents = numpy.array([max(parent, 0) for parent in self.parents], dtype=numpy.intp)
+            self._rot_offsets = numpy.array(self.rot_offsets, dtype=numpy.float64).reshape(-1, 4)
+            self._pos_offsets = numpy.array(self.pos_offsets, dtype=numpy.float64).reshape(-1, 3) * roots
+            self._local_offsets = numpy.array(self.local_offsets, dtype=numpy.float64).reshape(-1, 3) * ~roots
+        self.nodes = [None] * len(bones)
+        self._layout_names = None
+        self._layout = None
+
+        self.frames = 0
+        self.layouts = 0
+
+    def __len__(self):
+        return len(self.bones)
+
+    @classmethod
+    def compile(cls, source_names, source_pos, source_rot, targets, target_pos, target_rot, target_parents,
+                mapping, corrections=None, stretch=False):
+        # source_*: a converted pose (as AxisConversion returns it) of every
+        # joint in source_names. targets: node names of the target rig with
+        # their world pose in the same convention and their parents' names
+        # (None for roots). mapping: {target name: source joint name}.
+        # corrections: {target name: quaternion} turned on the target bone's
+        # own side, for rigs whose bone axes differ from their bind pose.
+        # stretch: every bone follows its source joint's position.
+        corrections = corrections or {}
+        source_at = {name: i for i, name in enumerate(source_names)}
+        target_at = {name: k for k, name in enumerate(targets)}
+        parent_of = dict(zip(targets, target_parents))
+        mapped = [name for name in targets if mapping.get(name) in source_at]
+        mapped_set = set(mapped)
+
+        def mapped_parent(name):
+            parent = parent_of.get(name)
+            while parent is not None and parent not in mapped_set:
+                parent = parent_of.get(parent)
+            return parent
+
+        depth = {}
+        def depth_of(name):
+            if name not in depth:
+                parent = mapped_parent(name)
+                depth[name] = 0 if parent is None else depth_of(parent) + 1
+            return depth[name]
+        order = sorted(mapped, key=depth_of)
+        index = {name: k for k, name in enumerate(order)}
+
+        def source_bind(i):
+            return tuple(source_pos[i * 3:i * 3 + 3]), _quat_normalize(source_rot[i * 4:i * 4 + 4])
+
+        def target_bind(name):
+            k = target_at[name]
+            rot = quat_mul(_quat_normalize(target_rot[k * 4:k * 4 + 4]), corrections.get(name, (0.0, 0.0, 0.0, 1.0)))
+            return tuple(target_pos[k * 3:k * 3 + 3]), _quat_normalize(rot)
+
+        bones = []
+        for name in order:
+            source = mapping[name]
+            s_pos, s_rot = source_bind(source_at[source])
+            t_pos, t_rot = target_bind(name)
+            parent = None if stretch else mapped_parent(name)
+            local = (0.0, 0.0, 0.0)
+            if parent is not None:
+                p_pos, p_rot = target_bind(parent)
+                local = quat_rotate(quat_conj(p_rot), [t_pos[c] - p_pos[c] for c in range(3)])
+            bones.append({
+                "target": name,
+                "source": source,
+                "parent": -1 if parent is None else index[parent],
+                "rot": quat_mul(quat_conj(s_rot), t_rot),
+                "pos": quat_rotate(quat_conj(s_rot), [t_pos[c] - s_pos[c] for c in range(3)]),
+                "local": local,
+            })
+        return cls(source_names, bones)
+
+    # --- File ---
+    def to_dict(self):
+        bones = []
+        for bone in self.bones:
+            bones.append({
+                "target": bone["target"],
+                "source": bone["source"],
+                "parent": bone["parent"],
+                "rot": [round(v, 7) for v in bone["rot"]],
+                "pos": [round(v, 5) for v in bone["pos"]],
+                "local": [round(v, 5) for v in bone["local"]],
+            })
+        return {"version": RETARGET_VERSION, "source": self.source_names, "bones": bones}
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        # Raises OSError, or ValueError for a file that is not a retarget map
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or data.get("version") != RETARGET_VERSION:
+            raise ValueError(f"{path} is not a retarget map")
+        try:
+            return cls(data.get("source", []), data["bones"])
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"{path}: bad bone entry ({e})")
+
+    # --- Per frame ---
+    def bind(self, lookup):
+        # lookup(target name) -> node or None, once per map.
+        # Returns the number of targets that were not found.
+        self.nodes = [lookup(name) for name in self.targets]
+        self._layout_names = None
+        # A bone below an unbound one is never written (see _layout_index)
+        skipped = []
+        dropped = []
+        for k, parent in enumerate(self.parents):
+            dropped.append(self.nodes[k] is None or (parent >= 0 and dropped[parent]))
+            if dropped[k] and self.nodes[k] is not None:
+                skipped.append(self.targets[k])
+        if skipped:
+            more = f" and {len(skipped) - 5} more" if len(skipped) > 5 else ""
+            print(f"Retarget map: {len(skipped)} bound bones skipped, a parent node is not bound: {', '.join(skipped[:5])}{more}")
+        return self.nodes.count(None)
+
+    def _layout_index(self, names):
+        # Source joint of each bone in this layout, and the nodes to write:
+        # None for bones whose joint (or parent) the layout does not carry
+        if names is not self._layout_names:
+            at = {name: i for i, name in enumerate(names)}
+            index = []
+            nodes = []
+            for k, source in enumerate(self.sources):
+                i = at.get(source)
+                parent = self.parents[k]
+                missing = i is None or (parent >= 0 and nodes[parent] is None)
+                index.append(0 if i is None else i)
+                nodes.append(None if missing else self.nodes[k])
+            self._layout_names = names
+            self._layout = (numpy.array(index, dtype=numpy.intp) if numpy is not None else index, nodes)
+            self.layouts += 1
+        return self._layout
+
+    def apply(self, names, pos, rot):
+        # names/pos/rot: a full converted pose. Returns (nodes, pos, rot)
+        # for PoseApplier.apply, one entry per bone.
+        self.frames += 1
+        index, nodes = self._layout_index(names)
+        if numpy is not None:
+            return (nodes,) + self._apply_arrays(index, pos, rot)
+
+        # Without NumPy: every rotation, then the root positions, then the
+        # other bones parents first. Each pass is straight-line quaternion
+        # math over flat lists, with no per-bone branching or calls.
+        out_rot = []
+        for i, (bx, by, bz, bw) in zip(index, self.rot_offsets):
+            r = i * 4
+            ax, ay, az, aw = rot[r], rot[r + 1], rot[r + 2], rot[r + 3]
+            out_rot += (aw * bx + ax * bw + ay * bz - az * by,
+                        aw * by - ax * bz + ay * bw + az * bx,
+                        aw * bz + ax * by - ay * bx + az * bw,
+                        aw * bw - ax * bx - ay * by - az * bz)
+        out_pos = [0.0] * (len(index) * 3)
+        for k, p, vx, vy, vz in self._root_bones:
+            i = index[k]
+            r = i * 4
+            x, y, z, w = rot[r], rot[r + 1], rot[r + 2], rot[r + 3]
+            tx = 2.0 * (y * vz - z * vy)
+            ty = 2.0 * (z * vx - x * vz)
+            tz = 2.0 * (x * vy - y * vx)
+            out_pos[p] = pos[i * 3] + vx + w * tx + y * tz - z * ty
+            out_pos[p + 1] = pos[i * 3 + 1] + vy + w * ty + z * tx - x * tz
+            out_pos[p + 2] = pos[i * 3 + 2] + vz + w * tz + x * ty - y * tx
+        for p, pp, r, vx, vy, vz in self._child_bones:
+            x, y, z, w = out_rot[r], out_rot[r + 1], out_rot[r + 2], out_rot[r + 3]
+            tx = 2.0 * (y * vz - z * vy)
+            ty = 2.0 * (z * vx - x * vz)
+            tz = 2.0 * (x * vy - y * vx)
+            out_pos[p] = out_pos[pp] + vx + w * tx + y * tz - z * ty
+            out_pos[p + 1] = out_pos[pp + 1] + vy + w * ty + z * tx - x * tz
+            out_pos[p + 2] = out_pos[pp + 2] + vz + w * tz + x * ty - y * tx
+        return nodes, out_pos, out_rot
+
+    def _apply_arrays(self, index, pos, rot):
+        src_pos = numpy.asarray(pos, dtype=numpy.float64).reshape(-1, 3)[index]
+        src_rot = numpy.asarray(rot, dtype=numpy.float64).reshape(-1, 4)[index]
+        out_rot = _quat_mul_rows(src_rot, self._rot_offsets)
+        # Roots: source position plus their offset. Other bones: their
+        # offset from the parent. Summed from each bone up to its root.
+        steps = numpy.where(self._roots, src_pos + _quat_rotate_rows(src_rot, self._pos_offsets),
+                            _quat_rotate_rows(out_rot[self._parents], self._local_offsets))
+        out_pos = self._ancestors @ steps
+        return out_pos.ravel().tolist(), out_rot.ravel().tolist()
+
+    def stats(self):
+        return {
+            "bones": len(self.bones),
+            "bound": len(self.nodes) - self.nodes.count(None),
+            "depth": self.depth,
+            "frames": self.frames,
+            "layouts": self.layouts,
+        }
+
+
+# ---------------------------------------------------------
+# TAKE BUFFER (every streamed frame, for baking to keys)
+# ---------------------------------------------------------
+class _TakeSegment:
+    # Frames of one joint layout, packed into flat arrays. A frame number
+    # that comes in again (scrubbing) overwrites its slot.
+    def __init__(self, names):
+        self.names = names
+        self.frames = array("i")
+        self.pos = array("f")
+        self.rot = array("f")
+        self.slots = {}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def store(self, pose):
+        # Returns False when the frame was already buffered and got overwritten
+        joints = len(self.names)
+        slot = self.slots.get(pose.frame)
+        if slot is None:
+            self.slots[pose.frame] = len(self.frames)
+            self.frames.append(pose.frame)
+            self.pos.extend(pose.pos)
+            self.rot.extend(pose.rot)
+            return True
+        self.pos[slot * joints * 3:(slot + 1) * joints * 3] = pose.pos
+        self.rot[slot * joints * 4:(slot + 1) * joints * 4] = pose.rot
+        return False
+
+    def ordered(self):
+        # Full poses sorted by frame number
+        joints = len(self.names)
+        poses = []
+        for frame in sorted(self.slots):
+            slot = self.slots[frame]
+            poses.append(PoseFrame(frame, self.names,
+                                   self.pos[slot * joints * 3:(slot + 1) * joints * 3],
+                                   self.rot[slot * joints * 4:(slot + 1) * joints * 4]))
+        return poses
+
+    def nbytes(self):
+        return sum(a.itemsize * len(a) for a in (self.frames, self.pos, self.rot))
+
+
+class TakeBuffer:
+    # Filled on the worker thread, before the mailbox drops frames; deltas
+    # are folded into the last full pose so every buffered frame is complete.
+    # The main thread takes the segments out in one go to commit them as keys.
+    # scale is the sender's scale when recording started, the take is baked
+    # at that scale.
+    def __init__(self, max_frames=TAKE_MAX_FRAMES, scale=1.0):
+        self.lock = threading.Lock()
+        self.max_frames = max_frames
+        self.scale = scale
+        self.segments = []
+        self.current = None
+        self.frames = 0
+        self.last_add = time.perf_counter()
+
+        self.received = 0
+        self.overwritten = 0
+        self.dropped = 0
+        self.peak_bytes = 0
+
+    def __len__(self):
+        return self.frames
+
+    def add(self, pose):
+        with self.lock:
+            self.received += 1
+            current = self.current
+            if pose.indices is not None:
+                if current is None or current.names != pose.names:
+                    # Delta without a keyframe to build on
+                    self.dropped += 1
+                    return False
+                apply_delta(current, pose)
+            else:
+                current = PoseFrame(pose.frame, pose.names, array("f", pose.pos), array("f", pose.rot))
+                self.current = current
+
+            if self.frames >= self.max_frames:
+                self.dropped += 1
+                return False
+            if not self.segments or self.segments[-1].names != current.names:
+                self.segments.append(_TakeSegment(current.names))
+            if self.segments[-1].store(current):
+                self.frames += 1
+            else:
+                self.overwritten += 1
+            self.last_add = time.perf_counter()
+            return True
+
+    def take(self):
+        # Returns the buffered segments and empties the buffer. The last full
+        # pose is kept, so deltas that follow still have a base.
+        with self.lock:
+            self.peak_bytes = max(self.peak_bytes, self._nbytes())
+            segments = self.segments
+            self.segments = []
+            self.frames = 0
+        return segments
+
+    def idle_for(self):
+        return time.perf_counter() - self.last_add
+
+    def _nbytes(self):
+        return sum(segment.nbytes() for segment in self.segments)
+
+    def stats(self):
+        with self.lock:
+            nbytes = self._nbytes()
+            return {
+                "frames": self.frames,
+                "segments": len(self.segments),
+                "memory_kb": round(nbytes / 1024, 1),
+                "peak_memory_kb": round(max(self.peak_bytes, nbytes) / 1024, 1),
+                "received": self.received,
+                "overwritten": self.overwritten,
+                "dropped": self.dropped,
+            }
+
+
+# ---------------------------------------------------------
+# KEY REDUCTION (drop keys that interpolation reproduces)
+# ---------------------------------------------------------
+def local_frames(parents, spaces, pos_frames, rot_frames):
+    # World pose frames -> the parent-space values a node's position and
+    # rotation controllers hold. parents[j] is the index of joint j's parent
+    # among the joints, or -1. spaces[j] is that parent's (pos, rot, scale),
+    # with pos/rot only read for a parent outside the joints (held fixed
+    # over the frames), or None for a joint at the scene root.
+    links = []
+    for j, parent in enumerate(parents):
+        space = spaces[j]
+        if space is None: continue
+        links.append((j, parent, space[0], quat_conj(space[1]) if parent < 0 else None, space[2]))
+    local_pos = []
+    local_rot = []
+    for pos, rot in zip(pos_frames, rot_frames):
+        lpos = list(pos)
+        lrot = list(rot)
+        for j, parent, ppos, inv, (sx, sy, sz) in links:
+            if parent >= 0:
+                ppos = pos[parent * 3:parent * 3 + 3]
+                r = parent * 4
+                inv = (-rot[r], -rot[r + 1], -rot[r + 2], rot[r + 3])
+            p = quat_rotate(inv, (pos[j * 3] - ppos[0], pos[j * 3 + 1] - ppos[1], pos[j * 3 + 2] - ppos[2]))
+            lpos[j * 3:j * 3 + 3] = (p[0] / sx, p[1] / sy, p[2] / sz)
+            lrot[j * 4:j * 4 + 4] = quat_mul(inv, rot[j * 4:j * 4 + 4])
+        local_pos.append(lpos)
+        local_rot.append(lrot)
+    return local_pos, local_rot
+
+
+def align_quaternions(rot_frames):
+    # Flips each joint's quaternion into the hemisphere of the previous frame,
+    # in place, so neighbouring keys interpolate the short way
+    for prev, rot in zip(rot_frames, rot_frames[1:]):
+        for r in range(0, len(rot), 4):
+            if prev[r] * rot[r] + prev[r + 1] * rot[r + 1] + prev[r + 2] * rot[r + 2] + prev[r + 3] * rot[r + 3] < 0.0:
+                rot[r:r + 4] = [-rot[r], -rot[r + 1], -rot[r + 2], -rot[r + 3]]
+
+
+def reduce_keys(times, pos_frames, rot_frames, pos_tolerance=KEY_POS_TOLERANCE, rot_tolerance=KEY_ROT_TOLERANCE,
+                exact=None, parents=None, spaces=None):
+    # pos_frames[f] / rot_frames[f] are flat xyz / xyzw lists per joint, in
+    # time order, in the space the keys are written in (see local_frames).
+    # Returns, per joint, the frame indices to key: a frame is dropped when
+    # the straight line between the surrounding keys passes within tolerance
+    # of it and of every other dropped frame in between. The bound is kept as
+    # a cone of allowed slopes from the last key, so each frame is looked at
+    # once. Positions then play back exactly as Linear_Position does; for
+    # rotations the keys are checked again against slerp (Linear_Rotation).
+    # Joints flagged in exact (controllers that interpolate otherwise, see
+    # KeyBaker.key_modes) keep every frame. With the parents/spaces that went
+    # into local_frames, keys are then added until the played-back pose is
+    # within tolerance in world space as well (see _world_keys).
+    count = len(times)
+    joints = len(pos_frames[0]) // 3 if count else 0
+    if count <= 2:
+        return [list(range(count)) for _ in range(joints)]
+
+    inf = float("inf")
+    keep = []
+    for j in range(joints):
+        if exact is not None and exact[j]:
+            keep.append(list(range(count)))
+            continue
+        series = [[frame[j * 3 + c] for frame in pos_frames] for c in range(3)]
+        series += [[frame[j * 4 + c] for frame in rot_frames] for c in range(4)]
+        tolerances = (pos_tolerance,) * 3 + (rot_tolerance,) * 4
+        channels = list(zip(series, tolerances))
+
+        kept = [0]
+        anchor = 0
+        lo = [-inf] * 7
+        hi = [inf] * 7
+        for b in range(1, count):
+            dt = times[b] - times[anchor]
+            for c, (values, tol) in enumerate(channels):
+                slope = (values[b] - values[anchor]) / dt
+                if slope < lo[c] or slope > hi[c]:
+                    # b is too far off the line: the frame before it is a key
+                    anchor = b - 1
+                    kept.append(anchor)
+                    lo = [-inf] * 7
+                    hi = [inf] * 7
+                    dt = times[b] - times[anchor]
+                    break
+            for c, (values, tol) in enumerate(channels):
+                base = values[anchor]
+                low = (values[b] - tol - base) / dt
+                high = (values[b] + tol - base) / dt
+                if low > lo[c]: lo[c] = low
+                if high < hi[c]: hi[c] = high
+        kept.append(count - 1)
+        keep.append(_slerp_keys(kept, times, list(zip(*series[3:])), rot_tolerance))
+    if parents is not None:
+        _world_keys(keep, times, pos_frames, rot_frames, parents, spaces, pos_tolerance, rot_tolerance)
+    return keep
+
+
+def _world_keys(keep, times, pos_frames, rot_frames, parents, spaces, pos_tolerance, rot_tolerance):
+    # Each channel is only checked on its own, so the errors of a chain add
+    # up: a hand can be off by the sum of every bone above it. This plays the
+    # keys back (lerp / slerp), runs them down the hierarchy and compares the
+    # world pose with the sampled one. A joint that is off at a frame gets a
+    # key there, and so do its baked parents, which makes that frame exact;
+    # only the frames between the neighbouring keys are checked again.
+    count = len(times)
+    joints = len(parents)
+    depth = [0] * joints
+    for j in range(joints):
+        p = parents[j]
+        while p >= 0:
+            depth[j] += 1
+            p = parents[p]
+    order = sorted(range(joints), key=depth.__getitem__)
+
+    def world(lpos, lrot):
+        wpos = [None] * joints
+        wrot = [None] * joints
+        for j in order:
+            space = spaces[j]
+            if space is None:
+                wpos[j] = lpos[j]
+                wrot[j] = lrot[j]
+                continue
+            p = parents[j]
+            if p >= 0:
+                ppos, prot = wpos[p], wrot[p]
+            else:
+                ppos, prot = space[0], space[1]
+            sx, sy, sz = space[2]
+            x, y, z = lpos[j]
+            o = quat_rotate(prot, (x * sx, y * sy, z * sz))
+            wpos[j] = (ppos[0] + o[0], ppos[1] + o[1], ppos[2] + o[2])
+            wrot[j] = quat_mul(prot, lrot[j])
+        return wpos, wrot
+
+    pos_series = [[tuple(frame[j * 3:j * 3 + 3]) for frame in pos_frames] for j in range(joints)]
+    rot_series = [[tuple(frame[j * 4:j * 4 + 4]) for frame in rot_frames] for j in range(joints)]
+    sampled = [world([s[f] for s in pos_series], [s[f] for s in rot_series]) for f in range(count)]
+
+    def playback(j):
+        pos = pos_series[j]
+        rot = rot_series[j]
+        out_pos = list(pos)
+        out_rot = list(rot)
+        keys = keep[j]
+        for a, b in zip(keys, keys[1:]):
+            pa, pb, ra, rb = pos[a], pos[b], rot[a], rot[b]
+            t0 = times[a]
+            span = times[b] - t0
+            for f in range(a + 1, b):
+                u = (times[f] - t0) / span
+                out_pos[f] = (pa[0] + (pb[0] - pa[0]) * u, pa[1] + (pb[1] - pa[1]) * u, pa[2] + (pb[2] - pa[2]) * u)
+                out_rot[f] = quat_slerp(ra, rb, u)
+        return out_pos, out_rot
+
+    played = [playback(j) for j in range(joints)]
+    dirty = range(count)
+    while True:
+        added = {}
+        for f in dirty:
+            wpos, wrot = world([pos[f] for pos, _ in played], [rot[f] for _, rot in played])
+            spos, srot = sampled[f]
+            for j in range(joints):
+                a, b = wpos[j], spos[j]
+                q, r = wrot[j], srot[j]
+                if q[0] * r[0] + q[1] * r[1] + q[2] * r[2] + q[3] * r[3] < 0.0:
+                    r = (-r[0], -r[1], -r[2], -r[3])
+                if ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2 > pos_tolerance * pos_tolerance
+                        or max(abs(q[0] - r[0]), abs(q[1] - r[1]), abs(q[2] - r[2]), abs(q[3] - r[3])) > rot_tolerance):
+                    k = j
+                    while k >= 0:
+                        added.setdefault(k, set()).add(f)
+                        k = parents[k]
+        if not added:
+            return
+        dirty = set()
+        for j, frames in added.items():
+            keys = keep[j]
+            for f in frames:
+                i = bisect.bisect_left(keys, f)
+                if i < len(keys) and keys[i] == f: continue
+                dirty.update(range(keys[i - 1] + 1, keys[i]))
+                keys.insert(i, f)
+            played[j] = playback(j)
+        dirty = sorted(dirty)
+
+
+def _slerp_keys(kept, times, quats, tolerance):
+    # Splits each span at its worst frame until slerp between neighbouring
+    # keys stays within tolerance of every dropped frame
+    out = []
+    pending = list(zip(kept, kept[1:]))[::-1]
+    while pending:
+        a, b = pending.pop()
+        worst, at = tolerance, -1
+        if b - a > 1:
+            qa, qb = quats[a], quats[b]
+            d = sum(x * y for x, y in zip(qa, qb))
+            if d < 0.0:
+                qb = tuple(-c for c in qb)
+                d = -d
+            theta = math.acos(min(d, 1.0))
+            s = math.sin(theta)
+            t0 = times[a]
+            span = times[b] - t0
+            for f in range(a + 1, b):
+                u = (times[f] - t0) / span
+                if s < 1e-6:
+                    wa, wb = 1.0 - u, u
+                else:
+                    wa = math.sin((1.0 - u) * theta) / s
+                    wb = math.sin(u * theta) / s
+                q = quats[f]
+                err = max(abs(qa[0] * wa + qb[0] * wb - q[0]), abs(qa[1] * wa + qb[1] * wb - q[1]),
+                          abs(qa[2] * wa + qb[2] * wb - q[2]), abs(qa[3] * wa + qb[3] * wb - q[3]))
+                if err > worst: worst, at = err, f
+        if at < 0:
+            out.append(a)
+        else:
+            pending.append((at, b))
+            pending.append((a, at))
+    out.append(kept[-1])
+    return out
+
+
+class ReductionJob:
+    # Turns the frames of a take into keys on a thread of its own, so the
+    # dialog stays responsive; the main thread polls done() and writes them.
+    # Each segment is a dict of times, world pos_frames/rot_frames and the
+    # parents/spaces from KeyBaker.parent_spaces (plus exact, see
+    # reduce_keys); its frames are replaced by the parent-space ones the keys
+    # are written with. keep[i] is reduce_keys' result for segments[i], or
+    # every frame when reduce is off.
+    def __init__(self, segments, reduce=True, pos_tolerance=KEY_POS_TOLERANCE, rot_tolerance=KEY_ROT_TOLERANCE):
+        self.segments = segments
+        self.reduce = reduce
+        self.pos_tolerance = pos_tolerance
+        self.rot_tolerance = rot_tolerance
+        self.keep = None
+        self.error = None
+        self.elapsed = 0.0
+        self.thread = threading.Thread(target=self._run, name="cas_reduce_keys", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            keep = []
+            for s in self.segments:
+                s["pos_frames"], s["rot_frames"] = local_frames(s["parents"], s["spaces"], s["pos_frames"], s["rot_frames"])
+                align_quaternions(s["rot_frames"])
+                if self.reduce:
+                    keep.append(reduce_keys(s["times"], s["pos_frames"], s["rot_frames"], self.pos_tolerance,
+                                            self.rot_tolerance, s.get("exact"), s["parents"], s["spaces"]))
+                else:
+                    keep.append([list(range(len(s["times"])))] * len(s["parents"]))
+            self.keep = keep
+        except Exception as e:
+            self.error = e
+        self.elapsed = time.perf_counter() - start
+
+    def done(self):
+        return not self.thread.is_alive()
+
+    def wait(self, timeout=None):
+        self.thread.join(timeout)
+        return self.done()
@@ -0,0 +1,96 @@
+# File: tests/test_conversion.py
+# AxisConversion against the per-bone conversion the receiver started with:
+# node.pos = Point3(p.x, p.z, p.y) * scale, node.rotation = Quat(r.x, r.z, -r.y, r.w).
+# Run with and without NumPy.
+import random
+import unittest
+from array import array
+
+import max_stream
+from cas_protocol import PoseFrame
+from max_stream import AxisConversion
+
+
+def per_bone(pose, scale, offsets=None):
+    pos = []
+    rot = []
+    for k, i in enumerate(pose.joints()):
+        p = pose.pos[k * 3:k * 3 + 3]
+        r = pose.rot[k * 4:k * 4 + 4]
+        off = offsets.get(pose.names[i], (0.0, 0.0, 0.0)) if offsets else (0.0, 0.0, 0.0)
+        pos.extend((p[0] * scale + off[0], p[2] * scale + off[1], p[1] * scale + off[2]))
+        rot.extend((r[0], r[2], -r[1], r[3]))
+    return pos, rot
+
+
+def random_pose(joints, rnd, indices=None):
+    names = tuple(f"Rig:Joint_{i:03d}" for i in range(joints))
+    count = joints if indices is None else len(indices)
+    pos = array("f", [rnd.uniform(-300.0, 300.0) for _ in range(count * 3)])
+    rot = array("f", [rnd.uniform(-1.0, 1.0) for _ in range(count * 4)])
+    return PoseFrame(0, names, pos, rot, indices)
+
+
+class ConversionTest(unittest.TestCase):
+    # Strided-slice path; NumpyConversionTest runs the same cases on NumPy
+    numpy = None
+
+    def setUp(self):
+        self.saved = max_stream.numpy
+        max_stream.numpy = self.numpy
+        self.rnd = random.Random(8)
+
+    def tearDown(self):
+        max_stream.numpy = self.saved
+
+    def assertClose(self, got, expected):
+        self.assertEqual(len(got), len(expected))
+        for a, b in zip(got, expected):
+            self.assertAlmostEqual(a, b, delta=1e-9 + abs(b) * 1e-12)
+
+    def check(self, pose, scale, offsets=None):
+        pos, rot = AxisConversion(scale=scale, offsets=offsets).convert(pose)
+        expected_pos, expected_rot = per_bone(pose, scale, offsets)
+        self.assertClose(list(pos), expected_pos)
+        self.assertClose(list(rot), expected_rot)
+
+    def test_full_pose(self):
+        for scale in (1.0, 2.54, 0.01):
+            with self.subTest(scale=scale):
+                self.check(random_pose(150, self.rnd), scale)
+
+    def test_delta_pose(self):
+        self.check(random_pose(150, self.rnd, [3, 0, 149, 77]), 2.54)
+
+    def test_offsets(self):
+        offsets = {"Rig:Joint_000": (1.0, 2.0, 3.0), "Rig:Joint_042": (-5.0, 0.5, 0.0)}
+        self.check(random_pose(50, self.rnd), 2.54, offsets)
+        self.check(random_pose(50, self.rnd, [42, 7]), 2.54, offsets)
+
+    def test_layout_change_picks_up_new_offsets(self):
+        conversion = AxisConversion(offsets={"Rig:Joint_001": (10.0, 0.0, 0.0), "B": (0.0, 10.0, 0.0)})
+        first = random_pose(2, self.rnd)
+        conversion.convert(first)
+        other = PoseFrame(0, ("B", "Rig:Joint_001"), first.pos, first.rot)
+        pos, _ = conversion.convert(other)
+        self.assertClose(list(pos), per_bone(other, 1.0, conversion.offsets)[0])
+
+    def test_with_scale_leaves_the_original(self):
+        conversion = AxisConversion(scale=1.0, offsets={"Rig:Joint_000": (1.0, 0.0, 0.0)})
+        pose = random_pose(4, self.rnd)
+        baked = conversion.with_scale(2.54)
+        self.assertEqual(conversion.scale, 1.0)
+        self.assertClose(list(baked.convert(pose)[0]), per_bone(pose, 2.54, conversion.offsets)[0])
+
+    def test_empty_pose(self):
+        pos, rot = AxisConversion().convert(random_pose(0, self.rnd))
+        self.assertEqual((list(pos), list(rot)), ([], []))
+
+
+@unittest.skipIf(max_stream.numpy is None, "NumPy is not installed")
+class NumpyConversionTest(ConversionTest):
+    numpy = max_stream.numpy
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+# File: tests/test_delta.py
+# DeltaTracker: idle ticks, per-joint epsilon, keyframes once most joints
+# moved and the per-joint flags behind them.
+import random
+import unittest
+from array import array
+
+from cas_stream import DeltaTracker, _row_flags
+
+
+def pose(joints, seed=1):
+    rnd = random.Random(seed)
+    pos = array("f", (rnd.uniform(-50.0, 50.0) for _ in range(joints * 3)))
+    rot = array("f", (rnd.uniform(-1.0, 1.0) for _ in range(joints * 4)))
+    return pos, rot
+
+
+class RowFlagsTest(unittest.TestCase):
+    def test_matches_row_compare(self):
+        rnd = random.Random(7)
+        for width in (12, 16):
+            for _ in range(200):
+                rows = [bytes(rnd.randrange(256) for _ in range(width)) for _ in range(rnd.randint(1, 40))]
+                # Single flipped bits anywhere in a row, including its last byte
+                other = [bytearray(row) for row in rows]
+                for row in other:
+                    if rnd.random() < 0.5:
+                        row[rnd.randrange(width)] ^= 1 << rnd.randrange(8)
+                flags = _row_flags(b"".join(rows), b"".join(other), width).to_bytes(len(rows), "little")
+                self.assertEqual([bool(flag) for flag in flags], [a != b for a, b in zip(rows, other)])
+
+
+class DeltaTrackerTest(unittest.TestCase):
+    joints = 40
+
+    def setUp(self):
+        self.tracker = DeltaTracker(epsilon=1e-3, keyframe_interval=1000)
+        self.pos, self.rot = pose(self.joints)
+        self.assertEqual(self.tracker.update(self.pos, self.rot), (True, None))
+
+    def test_idle(self):
+        keyframe, indices = self.tracker.update(array("f", self.pos), array("f", self.rot))
+        self.assertFalse(keyframe)
+        self.assertEqual(list(indices), [])
+        self.assertEqual(self.tracker.idle, 1)
+
+    def test_moved_joints(self):
+        # Position only, rotation only (last component) and below epsilon
+        self.pos[3 * 3] += 0.5
+        self.rot[17 * 4 + 3] += 0.5
+        self.pos[25 * 3 + 2] += 1e-4
+        keyframe, indices = self.tracker.update(self.pos, self.rot)
+        self.assertFalse(keyframe)
+        self.assertEqual(list(indices), [3, 17])
+        # The sub-epsilon joint is measured against the last sent value
+        self.assertEqual(list(self.tracker.update(self.pos, self.rot)[1]), [])
+        self.pos[25 * 3 + 2] += 2e-3
+        self.assertEqual(list(self.tracker.update(self.pos, self.rot)[1]), [25])
+
+    def test_most_joints_moved_is_keyframe(self):
+        for i in range(0, len(self.pos), 3):
+            self.pos[i] += 1.0
+        self.assertEqual(self.tracker.update(self.pos, self.rot), (True, None))
+        self.assertEqual(self.tracker.last_pos, self.pos)
+        self.assertEqual(self.tracker.keyframes, 2)
+
+    def test_most_joints_jitter_is_keyframe(self):
+        # Changed bytes on most joints go out as a full pose without a
+        # per-joint diff, even when every change is below epsilon
+        for i in range(0, len(self.rot), 4):
+            self.rot[i] += 1e-5
+        self.assertEqual(self.tracker.update(self.pos, self.rot), (True, None))
+
+    def test_list_input(self):
+        self.pos[0] += 1.0
+        keyframe, indices = self.tracker.update(list(self.pos), list(self.rot))
+        self.assertEqual((keyframe, list(indices)), (False, [0]))
+
+    def test_keyframe_interval(self):
+        tracker = DeltaTracker(keyframe_interval=2)
+        results = [tracker.update(self.pos, self.rot)[0] for _ in range(6)]
+        self.assertEqual(results, [True, False, False, True, False, False])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+# File: tests/test_framing.py
+# FrameReader: framed and unframed streams however the bytes are split,
+# oversized frames, malformed JSON and recovery afterwards.
+import json
+import unittest
+
+from cas_protocol import FrameReader, frame, CHANNEL_CONTROL, CHANNEL_POSE, CHANNEL_MESH
+
+
+def read_all(reader, data, chunk):
+    # Feeds data in chunk-sized pieces, copying every payload out before
+    # the next feed (views are only valid until then)
+    out = []
+    for i in range(0, len(data), chunk):
+        reader.feed(data[i:i + chunk])
+        out.extend((channel, bytes(payload)) for channel, payload in reader.messages())
+    return out
+
+
+class FramedTest(unittest.TestCase):
+    def setUp(self):
+        self.messages = [(CHANNEL_POSE, bytes(range(256)) * 3), (CHANNEL_CONTROL, b'{"command": "PING"}'),
+                         (CHANNEL_MESH, b""), (CHANNEL_POSE, b"x" * 70000)]
+        self.stream = b"".join(frame(payload, channel) for channel, payload in self.messages)
+
+    def reader(self, **kwargs):
+        reader = FrameReader(capacity=1024, **kwargs)
+        reader.framed = True
+        return reader
+
+    def test_any_split(self):
+        for chunk in (1, 3, 5, 4096, len(self.stream)):
+            with self.subTest(chunk=chunk):
+                reader = self.reader()
+                self.assertEqual(read_all(reader, self.stream, chunk), self.messages)
+                self.assertEqual(reader.frames, len(self.messages))
+                self.assertEqual(reader.pending(), 0)
+
+    def test_incomplete_frame_waits(self):
+        reader = self.reader()
+        data = frame(b"abcdef")
+        self.assertEqual(read_all(reader, data[:-1], 1024), [])
+        self.assertEqual(read_all(reader, data[-1:], 1024), [(CHANNEL_POSE, b"abcdef")])
+
+    def test_oversized_frame_is_skipped(self):
+        # The oversized payload is dropped however it arrives and the next
+        # frame is read from the right offset
+        big = frame(b"y" * 5000)
+        after = frame(b"after", CHANNEL_CONTROL)
+        for chunk in (1, 7, 1000, 10000):
+            with self.subTest(chunk=chunk):
+                reader = self.reader(max_size=4096)
+                got = read_all(reader, frame(b"before") + big + after, chunk)
+                self.assertEqual(got, [(CHANNEL_POSE, b"before"), (CHANNEL_CONTROL, b"after")])
+                self.assertEqual(reader.oversized, 1)
+
+
+class UnframedTest(unittest.TestCase):
+    def setUp(self):
+        self.objects = [{"command": "HELLO", "namespace": "a{b}"}, {"command": "LIVE_DATA", "data": [[1, 2.5], {"x": "}\"{"}]},
+                        {"text": "back\\slash é }"}, {}]
+        # Legacy senders write objects back to back, sometimes with newlines
+        self.stream = b"\n".join(json.dumps(obj).encode("utf-8") for obj in self.objects)
+
+    def decode(self, got):
+        return [json.loads(payload) for _, payload in got]
+
+    def test_any_split(self):
+        for chunk in (1, 2, 13, len(self.stream)):
+            with self.subTest(chunk=chunk):
+                reader = FrameReader(capacity=64)
+                got = read_all(reader, self.stream, chunk)
+                self.assertEqual(self.decode(got), self.objects)
+                self.assertTrue(all(channel == CHANNEL_CONTROL for channel, _ in got))
+                self.assertEqual(reader.malformed, 0)
+
+    def test_malformed_object_is_dropped(self):
+        reader = FrameReader()
+        got = read_all(reader, b'{"a": }{"b": 1}', 4)
+        self.assertEqual(self.decode(got), [{"b": 1}])
+        self.assertEqual(reader.malformed, 1)
+
+    def test_garbage_is_dropped_and_reading_resumes(self):
+        reader = FrameReader()
+        self.assertEqual(read_all(reader, b"not json at all", 1024), [])
+        self.assertEqual(reader.malformed, 1)
+        self.assertEqual(self.decode(read_all(reader, b'{"b": 1}', 3)), [{"b": 1}])
+
+    def test_oversized_object_is_dropped(self):
+        reader = FrameReader(max_size=1024)
+        got = read_all(reader, json.dumps({"path": "x" * 4096}).encode("utf-8"), 512)
+        self.assertEqual(got, [])
+        self.assertEqual(reader.oversized, 1)
+
+    def test_switch_to_framed_mid_buffer(self):
+        # A HELLO switches the reader to framed mode; frames can already be
+        # in the same buffer behind it
+        reader = FrameReader()
+        reader.feed(b'{"command": "HELLO"}' + frame(b"pose"))
+        messages = reader.messages()
+        channel, payload = next(messages)
+        self.assertEqual(json.loads(bytes(payload)), {"command": "HELLO"})
+        reader.framed = True
+        self.assertEqual([(c, bytes(p)) for c, p in messages], [(CHANNEL_POSE, b"pose")])
+
+
+if __name__ == "__main__":
+    unittest.main()
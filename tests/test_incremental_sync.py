@@ -0,0 +1,112 @@
+# File: tests/test_incremental_sync.py
+# IncrementalSync.merge on the fake scene from cas_bench: what is kept,
+# updated, relinked and deleted, and when it falls back to a full replace.
+import unittest
+
+import max_scene
+from cas_bench import FakeNode, FakeSyncRuntime, _fake_import
+
+BONES = 5
+MESHES = 3
+
+
+class IncrementalSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.rt = FakeSyncRuntime(10)
+        self.root = self.rt.add(FakeNode("CAS_SCALE_ROOT", self.rt))
+        self.previous = _fake_import(self.rt, BONES, MESHES)
+        for node in self.previous:
+            if node.parent is None: node.parent = self.root
+        self.sync = max_scene.IncrementalSync(self.rt)
+
+    def by_name(self, nodes):
+        return {node.name: node for node in nodes}
+
+    def merge(self, imported, existing=None):
+        return self.sync.merge(self.previous if existing is None else existing, imported, self.root)
+
+    def assertInScene(self, nodes, present=True):
+        for node in nodes:
+            self.assertEqual(node.handle in self.rt.scene, present, node.name)
+
+    def test_unchanged(self):
+        imported = _fake_import(self.rt, BONES, MESHES)
+        old = self.by_name(self.previous)
+        bases = {name: node.baseObject for name, node in old.items()}
+        self.assertEqual(self.merge(imported), [])
+        # The previous nodes stay as they were, the fresh import is removed
+        self.assertInScene(self.previous)
+        self.assertInScene(imported, False)
+        self.assertEqual({name: node.baseObject for name, node in old.items()}, bases)
+        self.assertEqual(self.sync.stats()["unchanged"], BONES + MESHES)
+        self.assertEqual(self.sync.stats()["relinked"], 0)
+
+    def test_changed_and_edited_meshes_swap_the_base_object(self):
+        old = self.by_name(self.previous)
+        object.__setattr__(old["Mesh_1"], "modifiers", ("TurboSmooth",))
+        imported = _fake_import(self.rt, BONES, MESHES, changed=("Mesh_1",), edited=("Mesh_2",))
+        new = self.by_name(imported)
+        self.assertEqual(self.merge(imported), [])
+        for name in ("Mesh_1", "Mesh_2"):
+            self.assertIs(old[name].baseObject, new[name].baseObject)
+        # The user's modifier stack stays on the surviving node
+        self.assertEqual(old["Mesh_1"].modifiers, ("TurboSmooth",))
+        self.assertEqual(self.sync.stats()["updated"], 2)
+
+    def test_added_node_is_kept_under_the_surviving_parent(self):
+        imported = _fake_import(self.rt, BONES, MESHES, added=("Joint_extra",))
+        kept = self.merge(imported)
+        self.assertEqual([node.name for node in kept], ["Joint_extra"])
+        self.assertIs(kept[0].parent, self.by_name(self.previous)["Joint_000"])
+        self.assertInScene(kept)
+        self.assertEqual(self.sync.stats()["created"], 1)
+
+    def test_removed_node_is_deleted(self):
+        imported = [node for node in _fake_import(self.rt, BONES, MESHES) if node.name != "Mesh_0"]
+        self.merge(imported)
+        old = self.by_name(self.previous)
+        self.assertInScene([old["Mesh_0"]], False)
+        self.assertInScene([node for node in self.previous if node.name != "Mesh_0"])
+        self.assertEqual(self.sync.stats()["deleted"], 1)
+
+    def test_hierarchy_change_is_relinked(self):
+        imported = _fake_import(self.rt, BONES, MESHES)
+        new = self.by_name(imported)
+        new["Mesh_0"].parent = new["Joint_002"]
+        new["Joint_003"].parent = None
+        self.merge(imported)
+        old = self.by_name(self.previous)
+        self.assertIs(old["Mesh_0"].parent, old["Joint_002"])
+        self.assertIs(old["Joint_003"].parent, self.root)
+        self.assertEqual(self.sync.stats()["relinked"], 2)
+
+    def test_skinned_change_falls_back_without_touching_the_scene(self):
+        imported = _fake_import(self.rt, BONES, MESHES, changed=("Mesh_1",))
+        object.__setattr__(self.by_name(imported)["Mesh_1"], "modifiers", ("Skin",))
+        before = dict(self.rt.scene)
+        self.assertIsNone(self.merge(imported))
+        self.assertEqual(self.rt.scene, before)
+        self.assertEqual(self.sync.stats()["fallbacks"], 1)
+
+    def test_new_skinned_mesh_falls_back(self):
+        imported = _fake_import(self.rt, BONES, MESHES + 1)
+        object.__setattr__(self.by_name(imported)[f"Mesh_{MESHES}"], "modifiers", ("Skin",))
+        self.assertIsNone(self.merge(imported))
+
+    def test_unchanged_skinned_mesh_is_merged(self):
+        for node in self.previous:
+            if node.name == "Mesh_1": object.__setattr__(node, "modifiers", ("Skin",))
+        imported = _fake_import(self.rt, BONES, MESHES)
+        object.__setattr__(self.by_name(imported)["Mesh_1"], "modifiers", ("Skin",))
+        self.assertEqual(self.merge(imported), [])
+
+    def test_unhashable_geometry_counts_as_changed(self):
+        self.rt.casBridgeGeometryHash = lambda base: None
+        self.sync._hash_fn = self.rt.casBridgeGeometryHash
+        imported = _fake_import(self.rt, BONES, MESHES)
+        self.merge(imported)
+        self.assertEqual(self.sync.stats()["updated"], BONES + MESHES)
+
+
+if __name__ == "__main__":
+    unittest.main()
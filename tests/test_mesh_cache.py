@@ -0,0 +1,117 @@
+# File: tests/test_mesh_cache.py
+# Content-hashed mesh sync: fbx_digest ignores what changes on every
+# export, ExportCache keeps one file per content, MeshSyncCache skips the
+# import of a version the scene already holds.
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import cas_stream
+import max_scene
+from cas_bench import _fake_fbx
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+class DigestTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def digest(self, data):
+        return cas_stream.fbx_digest(write(os.path.join(self.tmp.name, "export.fbx"), data))
+
+    def test_reexport_of_the_same_scene(self):
+        # Fresh file id and timestamps, same content
+        for ascii in (False, True):
+            with self.subTest(ascii=ascii):
+                self.assertEqual(self.digest(_fake_fbx("A", 1, ascii)), self.digest(_fake_fbx("A", 2, ascii)))
+
+    def test_changed_scene(self):
+        for ascii in (False, True):
+            with self.subTest(ascii=ascii):
+                self.assertNotEqual(self.digest(_fake_fbx("A", 1, ascii)), self.digest(_fake_fbx("B", 1, ascii)))
+
+    def test_small_chunks(self):
+        path = write(os.path.join(self.tmp.name, "export.fbx"), _fake_fbx("A", 1))
+        self.assertEqual(cas_stream.fbx_digest(path, chunk_size=7), cas_stream.fbx_digest(path))
+
+
+class ExportCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.exports = 0
+
+    def export(self, version):
+        self.exports += 1
+        return write(os.path.join(self.tmp.name, "cas_sync.fbx"), _fake_fbx(version, self.exports, size=1024))
+
+    def test_same_content_is_one_file(self):
+        cache = cas_stream.ExportCache(os.path.join(self.tmp.name, "cache"))
+        first = cache.store(self.export("A"))
+        second = cache.store(self.export("A"))
+        self.assertEqual(first, second)
+        self.assertTrue(os.path.exists(first[1]))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "cas_sync.fbx")))
+        self.assertEqual(len(cache.entries()), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_least_recently_used_are_evicted(self):
+        size = len(_fake_fbx("A", 1, size=1024))
+        cache = cas_stream.ExportCache(os.path.join(self.tmp.name, "cache"), max_bytes=2 * size)
+        paths = {}
+        for version in ("A", "B", "C"):
+            paths[version] = cache.store(self.export(version))[1]
+            # mtime resolution: make the order unambiguous
+            os.utime(paths[version], (self.exports, self.exports))
+        self.assertFalse(os.path.exists(paths["A"]))
+        self.assertTrue(os.path.exists(paths["B"]) and os.path.exists(paths["C"]))
+        self.assertEqual(cache.evicted, 1)
+
+    def test_newest_is_kept_over_the_limit(self):
+        cache = cas_stream.ExportCache(os.path.join(self.tmp.name, "cache"), max_bytes=1)
+        digest, path = cache.store(self.export("A"))
+        self.assertTrue(os.path.exists(path))
+
+
+class MeshSyncCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = max_scene.MeshSyncCache()
+        self.imported = []
+        self.scene = None
+
+    def sync(self, digest):
+        def importer(path):
+            self.imported.append(path)
+            self.scene = digest
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.cache.sync(f"{digest}.fbx", digest, importer, lambda: self.scene)
+
+    def test_import_skipped_when_the_scene_has_the_version(self):
+        self.assertTrue(self.sync("aaaa"))
+        self.assertFalse(self.sync("aaaa"))
+        self.assertTrue(self.sync("bbbb"))
+        self.assertFalse(self.sync("bbbb"))
+        self.assertEqual(self.imported, ["aaaa.fbx", "bbbb.fbx"])
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+    def test_import_when_the_scene_lost_its_objects(self):
+        self.sync("aaaa")
+        self.scene = None   # synced objects deleted by the user
+        self.assertTrue(self.sync("aaaa"))
+
+    def test_no_digest_always_imports(self):
+        self.assertTrue(self.sync(None))
+        self.assertTrue(self.sync(None))
+        self.assertEqual(self.cache.hits, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
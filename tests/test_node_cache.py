@@ -0,0 +1,113 @@
+# File: tests/test_node_cache.py
+# NodeCache lookups and when the scene index is rebuilt: once up front,
+# again only after a cached node was deleted, not for nodes that merely
+# fail to apply. PoseApplier reports which nodes failed.
+import contextlib
+import io
+import unittest
+
+import max_scene
+from cas_bench import FakeNode, FakeRuntime
+
+BONES = ("Rig:Hips", "Rig:Spine", "Rig:Head")
+
+
+class NodeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.rt = FakeRuntime(20, BONES)
+        self.cache = max_scene.NodeCache(self.rt)
+        self.out = io.StringIO()
+        # The first build is printed; captured to count the lines
+        quiet = contextlib.redirect_stdout(self.out)
+        quiet.__enter__()
+        self.addCleanup(quiet.__exit__, None, None, None)
+
+    def node(self, name):
+        return self.rt.getNodeByName(max_scene.short_name(name))
+
+    def test_lookup_strips_the_namespace(self):
+        self.assertIs(self.cache.get("Rig:Spine"), self.node("Spine"))
+        self.assertIs(self.cache.get("Spine"), self.node("Spine"))
+
+    def test_scene_indexed_once(self):
+        for _ in range(3):
+            for name in BONES + ("Rig:Missing",):
+                self.cache.get(name)
+        stats = self.cache.stats()
+        self.assertEqual(stats["rebuilds"], 1)
+        self.assertEqual(stats["misses"], len(BONES) + 1)
+        self.assertIsNone(self.cache.get("Rig:Missing"))
+
+    def test_first_name_wins(self):
+        # getNodeByName returns the first match, so does the cache
+        first = self.node("Head")
+        self.rt.objects.append(FakeNode("Head", self.rt))
+        self.assertIs(self.cache.get("Rig:Head"), first)
+
+    def test_only_the_first_build_is_logged(self):
+        self.cache.get("Rig:Hips")
+        self.cache.invalidate()
+        self.cache.get("Rig:Hips")
+        self.assertEqual(self.cache.stats()["rebuilds"], 2)
+        self.assertEqual(len(self.out.getvalue().splitlines()), 1)
+
+    def test_evict_a_live_node_keeps_the_index(self):
+        spine = self.cache.get("Rig:Spine")
+        self.cache.depth(spine)
+        self.assertFalse(self.cache.evict(["Rig:Spine"]))
+        self.assertNotIn("Rig:Spine", self.cache.by_bone)
+        self.assertNotIn(spine, self.cache.depths)
+        self.assertIs(self.cache.get("Rig:Spine"), spine)
+        self.assertEqual(self.cache.stats()["rebuilds"], 1)
+
+    def test_evict_a_deleted_node_rebuilds(self):
+        head = self.cache.get("Rig:Head")
+        self.rt.delete(head)
+        self.assertTrue(self.cache.evict(["Rig:Hips", "Rig:Head"]))
+        self.assertIsNone(self.cache.get("Rig:Head"))
+        self.assertEqual(self.cache.stats()["rebuilds"], 2)
+        self.assertEqual(self.cache.stats()["invalidations"], 1)
+
+    def test_evict_unknown_names(self):
+        self.assertFalse(self.cache.evict(["Rig:Never", "Rig:Missing"]))
+
+    def test_depth(self):
+        nodes = [self.cache.get(name) for name in BONES]
+        self.assertEqual([self.cache.depth(node) for node in nodes], [0, 1, 2])
+
+
+class PoseApplierFailuresTest(unittest.TestCase):
+    def setUp(self):
+        self.rt = FakeRuntime(0, BONES)
+        self.cache = max_scene.NodeCache(self.rt)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.nodes = [self.cache.get(name) for name in BONES]
+        self.pos = [0.0] * 9
+        self.rot = [0.0, 0.0, 0.0, 1.0] * 3
+
+    def test_failed_indices_refer_to_the_nodes_passed_in(self):
+        applier = max_scene.PoseApplier(self.rt, self.cache)
+        self.nodes[2].__dict__["locked"] = True
+        # Reversed: the bulk call sorts parents first, failures map back
+        nodes = self.nodes[::-1] + [None]
+        self.assertEqual(applier.apply(nodes, self.pos + [0.0] * 3, self.rot + [0.0] * 4), 1)
+        self.assertEqual(applier.failed, [0])
+
+    def test_bridge_error_fails_every_node(self):
+        applier = max_scene.PoseApplier(self.rt, self.cache)
+        applier.apply(self.nodes, self.pos, self.rot)
+
+        def broken(nodes, values):
+            raise RuntimeError("bridge")
+        applier._apply_fn = broken
+        self.assertEqual(applier.apply(self.nodes[:2] + [None], self.pos, self.rot), 2)
+        self.assertEqual(applier.failed, [0, 1])
+
+    def test_nothing_failed(self):
+        applier = max_scene.PoseApplier(self.rt, self.cache)
+        self.assertEqual(applier.apply(self.nodes, self.pos, self.rot), 0)
+        self.assertEqual(applier.failed, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+# File: tests/test_quantize.py
+# Quantized poses: decoded values stay within Quantizer's error bounds,
+# fields are bit-packed (message size follows the bit widths) and the
+# block and delta paths round-trip.
+import math
+import random
+import unittest
+from array import array
+
+import cas_protocol
+from cas_protocol import Quantizer
+from cas_bench import _pose_errors, _random_pose
+
+NAMES = tuple(f"Joint_{i:03d}" for i in range(150))
+SETTINGS = ((12, 8), (16, 10), (20, 14), (24, 20), (32, 20), (2, 2))
+
+
+class PackBitsTest(unittest.TestCase):
+    def test_round_trip(self):
+        rnd = random.Random(3)
+        for bits in (1, 2, 7, 8, 12, 16, 31, 32, 62):
+            for count in (0, 1, 7, 8, 9, 450):
+                with self.subTest(bits=bits, count=count):
+                    values = [rnd.getrandbits(bits) for _ in range(count)]
+                    data = cas_protocol._pack_bits(values, bits)
+                    self.assertEqual(len(data), (count * bits + 7) // 8)
+                    self.assertEqual(list(cas_protocol._unpack_bits(data, bits, count, "Q")), values)
+
+
+class QuantizerTest(unittest.TestCase):
+    def setUp(self):
+        self.rnd = random.Random(11)
+        self.samples = [_random_pose(len(NAMES), self.rnd) for _ in range(20)]
+        self.layouts = {}
+        cas_protocol.decode_binary(cas_protocol.encode_layout(1, NAMES), self.layouts)
+
+    def quantizer(self, pos_bits, rot_bits):
+        quantizer = Quantizer.around(self.samples[0][0], 200.0, pos_bits, rot_bits)
+        cas_protocol.decode_binary(cas_protocol.encode_range(1, quantizer), self.layouts)
+        return quantizer
+
+    def test_errors_within_bounds(self):
+        for pos_bits, rot_bits in SETTINGS:
+            with self.subTest(pos_bits=pos_bits, rot_bits=rot_bits):
+                quantizer = self.quantizer(pos_bits, rot_bits)
+                for pos, rot in self.samples:
+                    decoded = cas_protocol.decode_binary(cas_protocol.encode_qpose(1, 7, pos, rot, quantizer), self.layouts)
+                    self.assertEqual(decoded.frame, 7)
+                    pos_err, ang_err = _pose_errors(pos, rot, decoded)
+                    self.assertLessEqual(pos_err, quantizer.pos_error())
+                    self.assertLessEqual(ang_err, quantizer.rot_error())
+
+    def test_bounds_shrink_with_bits(self):
+        errors = [(self.quantizer(p, r).pos_error(), self.quantizer(p, r).rot_error()) for p, r in SETTINGS[:4]]
+        for coarse, fine in zip(errors, errors[1:]):
+            self.assertLess(fine[0], coarse[0])
+            self.assertLess(fine[1], coarse[1])
+
+    def test_identity_and_axis_rotations_are_exact(self):
+        quantizer = self.quantizer(16, 10)
+        h = math.sqrt(0.5)
+        rot = array("f", [0, 0, 0, 1, 1, 0, 0, 0, 0, -1, 0, 0, h, 0, 0, h])
+        pos = array("f", [0.0] * 12)
+        decoded = cas_protocol.decode_qpose(cas_protocol.encode_qpose(1, 0, pos, rot, quantizer), NAMES[:4], quantizer)
+        for r in range(0, 16, 4):
+            q = decoded.rot[r:r + 4]
+            sign = 1.0 if sum(a * b for a, b in zip(q, rot[r:r + 4])) >= 0 else -1.0
+            for a, b in zip(q, rot[r:r + 4]):
+                self.assertAlmostEqual(a * sign, b, places=3)
+
+    def test_message_size_follows_the_bit_widths(self):
+        pos, rot = self.samples[0]
+        joints = len(NAMES)
+        header = cas_protocol.QPOSE_HEADER.size
+        for pos_bits, rot_bits in SETTINGS:
+            with self.subTest(pos_bits=pos_bits, rot_bits=rot_bits):
+                quantizer = self.quantizer(pos_bits, rot_bits)
+                msg = cas_protocol.encode_qpose(1, 0, pos, rot, quantizer)
+                expected = (joints * 3 * pos_bits + 7) // 8 + (joints * (2 + 3 * rot_bits) + 7) // 8
+                self.assertEqual(len(msg), header + expected)
+        small = cas_protocol.encode_qpose(1, 0, pos, rot, self.quantizer(12, 8))
+        default = cas_protocol.encode_qpose(1, 0, pos, rot, self.quantizer(16, 10))
+        self.assertLess(len(small), len(default))
+
+    def test_delta_pose(self):
+        quantizer = self.quantizer(16, 10)
+        pos, rot = self.samples[1]
+        indices = [5, 0, 149]
+        sub_pos = array("f", [pos[i * 3 + c] for i in indices for c in range(3)])
+        sub_rot = array("f", [rot[i * 4 + c] for i in indices for c in range(4)])
+        msg = cas_protocol.encode_qpose(1, 3, sub_pos, sub_rot, quantizer, indices)
+        decoded = cas_protocol.decode_binary(msg, self.layouts)
+        self.assertEqual(list(decoded.indices), indices)
+        pos_err, ang_err = _pose_errors(sub_pos, sub_rot, decoded)
+        self.assertLessEqual(pos_err, quantizer.pos_error())
+        self.assertLessEqual(ang_err, quantizer.rot_error())
+
+    def test_out_of_range_positions_are_clamped(self):
+        quantizer = Quantizer((0.0, 0.0, 0.0), (1.0, 1.0, 1.0), 8, 8)
+        self.assertFalse(quantizer.contains([2.0, 0.5, 0.5]))
+        decoded = quantizer.dequantize_pos(quantizer.quantize_pos([2.0, -1.0, 0.5]))
+        self.assertAlmostEqual(decoded[0], 1.0, places=6)
+        self.assertAlmostEqual(decoded[1], 0.0, places=6)
+
+    def test_block_round_trip(self):
+        frames = 5
+        pos = array("f")
+        rot = array("f")
+        for p, r in self.samples[:frames]:
+            pos.extend(p)
+            rot.extend(r)
+        quantizer = Quantizer.around(pos, 0.0, 16, 10)
+        for level in (0, 1):
+            with self.subTest(level=level):
+                block = cas_protocol.decode_binary(cas_protocol.encode_block(1, 9, 100, frames, pos, rot, level, quantizer),
+                                                   self.layouts)
+                self.assertEqual((block.block_id, block.first, block.count), (9, 100, frames))
+                for f, pose in enumerate(block.poses()):
+                    self.assertEqual(pose.frame, 100 + f)
+                    pos_err, ang_err = _pose_errors(*self.samples[f], pose)
+                    self.assertLessEqual(pos_err, quantizer.pos_error())
+                    self.assertLessEqual(ang_err, quantizer.rot_error())
+
+    def test_truncated_payload_is_rejected(self):
+        quantizer = self.quantizer(16, 10)
+        msg = bytearray(cas_protocol.encode_qpose(1, 0, *self.samples[0], quantizer))
+        payload_size = len(msg) - cas_protocol.QPOSE_HEADER.size
+        cas_protocol.QPOSE_HEADER.pack_into(msg, 0, cas_protocol.QPOSE_MAGIC, cas_protocol.PROTOCOL_VERSION, 0, 1, 0,
+                                            len(NAMES), payload_size - 1)
+        with self.assertRaises(ValueError):
+            cas_protocol.decode_binary(bytes(msg[:-1]), self.layouts)
+
+    def test_unsupported_precision(self):
+        with self.assertRaises(ValueError):
+            Quantizer((0, 0, 0), (1, 1, 1), 33, 10)
+        with self.assertRaises(ValueError):
+            Quantizer((0, 0, 0), (1, 1, 1), 16, 21)
+
+
+if __name__ == "__main__":
+    unittest.main()
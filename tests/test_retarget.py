@@ -0,0 +1,216 @@
+# File: tests/test_retarget.py
+# RetargetMap against its per-bone definition, on NumPy and on the
+# pure-Python passes, plus compile/bind/layout/file behaviour and
+# match_bones.
+import contextlib
+import io
+import os
+import random
+import tempfile
+import unittest
+
+import max_stream
+from max_stream import RetargetMap, match_bones, quat_mul, quat_rotate, _quat_normalize
+
+SOURCE = ["Rig:Hips", "Rig:Spine", "Rig:Chest", "Rig:Neck", "Rig:Head", "Rig:LeftArm", "Rig:LeftHand"]
+# Target rig: Bip-style names, an unmapped twist bone between arm and hand
+TARGETS = ["Bip001 Pelvis", "Bip001 Spine", "Bip001 Chest", "Bip001 Neck", "Bip001 Head",
+           "Bip001 L UpperArm", "Bip001 L Twist", "Bip001 L Hand"]
+PARENTS = [None, "Bip001 Pelvis", "Bip001 Spine", "Bip001 Chest", "Bip001 Neck",
+           "Bip001 Chest", "Bip001 L UpperArm", "Bip001 L Twist"]
+MAPPING = {"Bip001 Pelvis": "Rig:Hips", "Bip001 Spine": "Rig:Spine", "Bip001 Chest": "Rig:Chest",
+           "Bip001 Neck": "Rig:Neck", "Bip001 Head": "Rig:Head", "Bip001 L UpperArm": "Rig:LeftArm",
+           "Bip001 L Hand": "Rig:LeftHand"}
+
+
+def random_quat(rnd):
+    return _quat_normalize([rnd.gauss(0.0, 1.0) for _ in range(4)])
+
+
+def random_pose(count, rnd):
+    pos = [rnd.uniform(-100.0, 100.0) for _ in range(count * 3)]
+    rot = [c for _ in range(count) for c in random_quat(rnd)]
+    return pos, rot
+
+
+def per_bone(retarget, names, pos, rot):
+    # The mapping as RetargetMap's description states it, one bone at a time
+    at = {name: i for i, name in enumerate(names)}
+    out_pos = []
+    out_rot = []
+    for k, bone in enumerate(retarget.bones):
+        i = at[bone["source"]]
+        s_rot = rot[i * 4:i * 4 + 4]
+        r = quat_mul(s_rot, bone["rot"])
+        if bone["parent"] < 0:
+            o = quat_rotate(s_rot, bone["pos"])
+            p = [pos[i * 3 + c] + o[c] for c in range(3)]
+        else:
+            parent = bone["parent"]
+            o = quat_rotate(out_rot[parent * 4:parent * 4 + 4], bone["local"])
+            p = [out_pos[parent * 3 + c] + o[c] for c in range(3)]
+        out_pos.extend(p)
+        out_rot.extend(r)
+    return out_pos, out_rot
+
+
+class RetargetTest(unittest.TestCase):
+    # Pure-Python passes; NumpyRetargetTest runs the same cases on NumPy
+    numpy = None
+
+    def setUp(self):
+        self.saved = max_stream.numpy
+        max_stream.numpy = self.numpy
+        self.addCleanup(setattr, max_stream, "numpy", self.saved)
+        self.rnd = random.Random(24)
+        self.source_pos, self.source_rot = random_pose(len(SOURCE), self.rnd)
+        self.target_pos, self.target_rot = random_pose(len(TARGETS), self.rnd)
+
+    def compile(self, **kwargs):
+        return RetargetMap.compile(SOURCE, self.source_pos, self.source_rot, TARGETS, self.target_pos,
+                                   self.target_rot, PARENTS, MAPPING, **kwargs)
+
+    def bind(self, retarget, lookup=None):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            missing = retarget.bind(lookup or (lambda name: name))
+        return missing, out.getvalue()
+
+    def assertClose(self, got, expected, delta=1e-6):
+        self.assertEqual(len(got), len(expected))
+        for a, b in zip(got, expected):
+            self.assertAlmostEqual(a, b, delta=delta)
+
+    def assertSameRotations(self, got, expected):
+        for r in range(0, len(expected), 4):
+            q, e = got[r:r + 4], expected[r:r + 4]
+            sign = 1.0 if sum(a * b for a, b in zip(q, e)) >= 0.0 else -1.0
+            self.assertClose([c * sign for c in q], e)
+
+    def target_pose(self, retarget):
+        at = {name: k for k, name in enumerate(TARGETS)}
+        pos = [self.target_pos[at[name] * 3 + c] for name in retarget.targets for c in range(3)]
+        rot = [self.target_rot[at[name] * 4 + c] for name in retarget.targets for c in range(4)]
+        return pos, rot
+
+    def test_parents_first_and_unmapped_bones_skipped(self):
+        retarget = self.compile()
+        self.assertEqual(len(retarget), len(MAPPING))
+        self.assertNotIn("Bip001 L Twist", retarget.targets)
+        for k, parent in enumerate(retarget.parents):
+            self.assertLess(parent, k)
+        hand = retarget.targets.index("Bip001 L Hand")
+        self.assertEqual(retarget.targets[retarget.parents[hand]], "Bip001 L UpperArm")
+
+    def test_bind_pose_gives_the_target_bind_pose(self):
+        for stretch in (False, True):
+            with self.subTest(stretch=stretch):
+                retarget = self.compile(stretch=stretch)
+                self.bind(retarget)
+                nodes, pos, rot = retarget.apply(SOURCE, self.source_pos, self.source_rot)
+                self.assertEqual(nodes, retarget.targets)
+                expected_pos, expected_rot = self.target_pose(retarget)
+                self.assertClose(pos, expected_pos, 1e-4)
+                self.assertSameRotations(rot, expected_rot)
+
+    def test_matches_the_per_bone_definition(self):
+        retarget = self.compile()
+        self.bind(retarget)
+        for _ in range(5):
+            pos, rot = random_pose(len(SOURCE), self.rnd)
+            _, out_pos, out_rot = retarget.apply(SOURCE, pos, rot)
+            expected_pos, expected_rot = per_bone(retarget, SOURCE, pos, rot)
+            self.assertClose(out_pos, expected_pos, 1e-6)
+            self.assertClose(out_rot, expected_rot, 1e-9)
+
+    def test_rigid_motion_moves_the_rig_rigidly(self):
+        # Turning and moving the whole source pose does the same to the rig
+        retarget = self.compile()
+        self.bind(retarget)
+        turn = random_quat(self.rnd)
+        shift = [10.0, -20.0, 5.0]
+        pos = []
+        rot = []
+        for i in range(len(SOURCE)):
+            p = quat_rotate(turn, self.source_pos[i * 3:i * 3 + 3])
+            pos.extend(p[c] + shift[c] for c in range(3))
+            rot.extend(quat_mul(turn, self.source_rot[i * 4:i * 4 + 4]))
+        _, out_pos, out_rot = retarget.apply(SOURCE, pos, rot)
+        bind_pos, bind_rot = self.target_pose(retarget)
+        for k in range(len(retarget)):
+            p = quat_rotate(turn, bind_pos[k * 3:k * 3 + 3])
+            self.assertClose(out_pos[k * 3:k * 3 + 3], [p[c] + shift[c] for c in range(3)], 1e-4)
+            self.assertSameRotations(out_rot[k * 4:k * 4 + 4], quat_mul(turn, bind_rot[k * 4:k * 4 + 4]))
+
+    def test_keeps_target_proportions(self):
+        # Moving a source joint along its bone does not stretch the rig
+        retarget = self.compile()
+        self.bind(retarget)
+        pos = list(self.source_pos)
+        neck = SOURCE.index("Rig:Neck")
+        pos[neck * 3] += 50.0
+        _, out_pos, _ = retarget.apply(SOURCE, pos, self.source_rot)
+        bind_pos, _ = self.target_pose(retarget)
+        self.assertClose(out_pos, bind_pos, 1e-4)
+
+    def test_layout_without_a_joint(self):
+        retarget = self.compile()
+        self.bind(retarget)
+        names = [name for name in SOURCE if name != "Rig:LeftArm"]
+        pos, rot = random_pose(len(names), self.rnd)
+        nodes, _, _ = retarget.apply(names, pos, rot)
+        unwritten = {retarget.targets[k] for k, node in enumerate(nodes) if node is None}
+        self.assertEqual(unwritten, {"Bip001 L UpperArm", "Bip001 L Hand"})
+
+    def test_bind_reports_missing_and_skipped(self):
+        retarget = self.compile()
+        missing, out = self.bind(retarget, lambda name: None if name == "Bip001 Chest" else name)
+        self.assertEqual(missing, 1)
+        # Neck, Head, UpperArm and Hand hang below the chest
+        self.assertIn("4 bound bones skipped", out)
+
+    def test_save_and_load(self):
+        retarget = self.compile()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "rig.json")
+            retarget.save(path)
+            loaded = RetargetMap.load(path)
+            with open(path, "w") as f:
+                f.write("[]")
+            with self.assertRaises(ValueError):
+                RetargetMap.load(path)
+        self.bind(retarget)
+        self.bind(loaded)
+        pos, rot = random_pose(len(SOURCE), self.rnd)
+        a = retarget.apply(SOURCE, pos, rot)
+        b = loaded.apply(SOURCE, pos, rot)
+        self.assertEqual(a[0], b[0])
+        self.assertClose(a[1], b[1], 1e-3)
+        self.assertClose(a[2], b[2], 1e-5)
+
+    def test_child_before_parent_is_rejected(self):
+        bone = {"target": "a", "source": "x", "rot": (0, 0, 0, 1), "pos": (0, 0, 0), "local": (0, 0, 0)}
+        with self.assertRaises(ValueError):
+            RetargetMap(["x"], [dict(bone, parent=1), dict(bone, target="b", parent=-1)])
+
+
+@unittest.skipIf(max_stream.numpy is None, "NumPy is not installed")
+class NumpyRetargetTest(RetargetTest):
+    numpy = max_stream.numpy
+
+
+class MatchBonesTest(unittest.TestCase):
+    def test_exact_then_loose(self):
+        source = ["Rig:Hips", "Rig:l_thigh", "Rig:L_Thigh", "Rig:Spine"]
+        mapping = match_bones(source, ["Hips", "Bip001 L Thigh", "spine", "Tail"])
+        self.assertEqual(mapping["Hips"], "Rig:Hips")
+        self.assertEqual(mapping["spine"], "Rig:Spine")
+        self.assertIn(mapping["Bip001 L Thigh"], ("Rig:l_thigh", "Rig:L_Thigh"))
+        self.assertNotIn("Tail", mapping)
+
+    def test_each_joint_drives_one_target(self):
+        mapping = match_bones(["Rig:Hand"], ["Hand", "hand"])
+        self.assertEqual(list(mapping.values()), ["Rig:Hand"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+# File: tests/test_stats.py
+# Instruments recorded from several threads at once, and the per-link
+# applied count that outlives the FEEDBACK interval.
+import threading
+import unittest
+
+import cas_stats
+from max_stream import ApplyFeedback
+
+
+class InstrumentsThreadsTest(unittest.TestCase):
+    def test_concurrent_recording(self):
+        # Worker and main thread record different stages into one instance
+        # while a third reads snapshots, as the stats panel does
+        stats = cas_stats.Instruments(True, trace=100)
+        threads = 4
+        samples = 5000
+        stop = threading.Event()
+        errors = []
+
+        def record(i):
+            for _ in range(samples):
+                stats.add(f"stage{i % 2}", 0.001)
+                stats.count("poses")
+
+        def read():
+            try:
+                while not stop.is_set():
+                    stats.snapshot()
+            except Exception as e:
+                errors.append(e)
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        workers = [threading.Thread(target=record, args=(i,)) for i in range(threads)]
+        for t in workers: t.start()
+        for t in workers: t.join()
+        stop.set()
+        reader.join()
+
+        snap = stats.snapshot()
+        self.assertEqual(errors, [])
+        self.assertEqual(snap["counters"]["poses"], threads * samples)
+        self.assertEqual(sum(s["count"] for s in snap["stages"].values()), threads * samples)
+        self.assertEqual(len(stats.trace), 100)
+
+
+class ApplyFeedbackTest(unittest.TestCase):
+    def test_total_applied_survives_reports(self):
+        now = [0.0]
+        feedback = ApplyFeedback(interval=0.25, clock=lambda: now[0])
+        reports = []
+        for frame in range(100):
+            now[0] += 0.01
+            report = feedback.record(frame, 0.001, 0)
+            if report: reports.append(report)
+        self.assertEqual(len(reports), 4)
+        self.assertEqual(sum(r["applied"] for r in reports) + feedback.applied, 100)
+        self.assertEqual(feedback.total_applied, 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,252 @@
+# File: tests/test_take.py
+# Record mode: TakeBuffer folds deltas into full frames, reduce_keys keeps
+# the played-back keys within tolerance per channel and, given the
+# hierarchy, in world space; ReductionJob runs it on a thread.
+import math
+import random
+import unittest
+from array import array
+
+import max_stream
+from cas_protocol import PoseFrame
+from max_stream import (KEY_POS_TOLERANCE, KEY_ROT_TOLERANCE, ReductionJob, TakeBuffer, align_quaternions,
+                        local_frames, quat_mul, quat_rotate, quat_slerp, reduce_keys)
+
+NAMES = ("A", "B", "C")
+
+
+def full(frame, value, names=NAMES):
+    count = len(names)
+    return PoseFrame(frame, names, array("f", [value] * count * 3), array("f", [0.0, 0.0, 0.0, 1.0] * count))
+
+
+def delta(frame, indices, value):
+    return PoseFrame(frame, NAMES, array("f", [value] * len(indices) * 3),
+                     array("f", [0.0, 0.0, 0.0, 1.0] * len(indices)), indices)
+
+
+class TakeBufferTest(unittest.TestCase):
+    def test_deltas_are_folded_into_full_frames(self):
+        take = TakeBuffer()
+        self.assertTrue(take.add(full(0, 1.0)))
+        self.assertTrue(take.add(delta(1, [1], 5.0)))
+        self.assertTrue(take.add(delta(2, [2], 7.0)))
+        poses = take.take()[0].ordered()
+        self.assertEqual([pose.frame for pose in poses], [0, 1, 2])
+        self.assertEqual(list(poses[1].pos), [1.0] * 3 + [5.0] * 3 + [1.0] * 3)
+        self.assertEqual(list(poses[2].pos), [1.0] * 3 + [5.0] * 3 + [7.0] * 3)
+        # The buffered frames are copies, not the pose objects passed in
+        self.assertEqual(list(poses[0].pos), [1.0] * 9)
+
+    def test_delta_without_keyframe_is_dropped(self):
+        take = TakeBuffer()
+        self.assertFalse(take.add(delta(0, [0], 1.0)))
+        take.add(full(1, 0.0, ("X",)))
+        self.assertFalse(take.add(delta(2, [0], 1.0)))   # other layout
+        self.assertEqual(take.stats()["dropped"], 2)
+
+    def test_scrubbed_frame_is_overwritten(self):
+        take = TakeBuffer()
+        take.add(full(5, 1.0))
+        take.add(full(3, 2.0))
+        take.add(full(5, 3.0))
+        self.assertEqual(len(take), 2)
+        self.assertEqual(take.stats()["overwritten"], 1)
+        poses = take.take()[0].ordered()
+        self.assertEqual([pose.frame for pose in poses], [3, 5])
+        self.assertEqual(poses[1].pos[0], 3.0)
+
+    def test_layout_change_starts_a_segment(self):
+        take = TakeBuffer()
+        take.add(full(0, 1.0))
+        take.add(full(1, 1.0, ("X", "Y")))
+        segments = take.take()
+        self.assertEqual([segment.names for segment in segments], [NAMES, ("X", "Y")])
+
+    def test_take_empties_but_keeps_the_base_for_deltas(self):
+        take = TakeBuffer(scale=2.54)
+        take.add(full(0, 1.0))
+        self.assertEqual(len(take.take()), 1)
+        self.assertEqual((len(take), take.take()), (0, []))
+        self.assertTrue(take.add(delta(1, [0], 4.0)))
+        self.assertEqual(list(take.take()[0].ordered()[0].pos[:3]), [4.0] * 3)
+        self.assertEqual(take.scale, 2.54)
+
+    def test_max_frames(self):
+        take = TakeBuffer(max_frames=2)
+        for frame in range(4):
+            take.add(full(frame, 0.0))
+        self.assertEqual(len(take), 2)
+        self.assertEqual(take.stats()["dropped"], 2)
+
+
+def play(keep, times, frames, stride):
+    # What Linear_Position / Linear_Rotation give back between the kept keys
+    out = [[None] * (len(keep) * stride) for _ in times]
+    for j, kept in enumerate(keep):
+        for a, b in zip(kept, kept[1:]):
+            va = frames[a][j * stride:j * stride + stride]
+            vb = frames[b][j * stride:j * stride + stride]
+            for f in range(a, b + 1):
+                u = (times[f] - times[a]) / (times[b] - times[a])
+                if stride == 4:
+                    value = quat_slerp(va, vb, u)
+                else:
+                    value = [x + (y - x) * u for x, y in zip(va, vb)]
+                out[f][j * stride:j * stride + stride] = value
+    return out
+
+
+def world(parents, pos, rot):
+    # Chain FK, parents first, no fixed parents
+    wpos = [None] * len(parents)
+    wrot = [None] * len(parents)
+    for j, parent in enumerate(parents):
+        p = pos[j * 3:j * 3 + 3]
+        r = rot[j * 4:j * 4 + 4]
+        if parent < 0:
+            wpos[j], wrot[j] = p, r
+        else:
+            o = quat_rotate(wrot[parent], p)
+            wpos[j] = [wpos[parent][c] + o[c] for c in range(3)]
+            wrot[j] = quat_mul(wrot[parent], r)
+    return wpos
+
+
+class ReduceKeysTest(unittest.TestCase):
+    def setUp(self):
+        self.rnd = random.Random(16)
+
+    def chain(self, joints=10, count=200, length=3.0, noise=0.0004):
+        # Bones bending slowly about z, with wobble just under the
+        # per-channel rotation tolerance
+        times = list(range(count))
+        pos_frames = [[0.0, 0.0, 0.0] + [0.0, length, 0.0] * (joints - 1) for _ in times]
+        rot_frames = []
+        for t in times:
+            rot = []
+            for j in range(joints):
+                half = 0.5 * (0.3 * math.sin(t * 0.05 + j) + self.rnd.uniform(-noise, noise))
+                rot += [0.0, 0.0, math.sin(half), math.cos(half)]
+            rot_frames.append(rot)
+        return times, pos_frames, rot_frames, [j - 1 for j in range(joints)]
+
+    def test_linear_motion_keeps_the_ends(self):
+        times = [0, 1, 2, 5, 6]
+        pos_frames = [[t * 2.0, 1.0, -t] for t in times]
+        rot_frames = [[0.0, 0.0, 0.0, 1.0] for _ in times]
+        self.assertEqual(reduce_keys(times, pos_frames, rot_frames), [[0, 4]])
+
+    def test_short_takes_keep_every_frame(self):
+        self.assertEqual(reduce_keys([0, 1], [[0.0] * 3] * 2, [[0.0, 0.0, 0.0, 1.0]] * 2), [[0, 1]])
+
+    def test_within_tolerance_per_channel(self):
+        times = list(range(300))
+        pos_frames = []
+        rot_frames = []
+        for t in times:
+            pos_frames.append([10.0 * math.sin(t * 0.03) + self.rnd.uniform(-0.003, 0.003), t * 0.1, 0.0])
+            half = 0.4 * math.sin(t * 0.02)
+            rot_frames.append([math.sin(half), 0.0, 0.0, math.cos(half)])
+        keep = reduce_keys(times, pos_frames, rot_frames)
+        self.assertLess(len(keep[0]), len(times) // 2)
+        self.assertEqual((keep[0][0], keep[0][-1]), (0, len(times) - 1))
+        for frames, played, stride, tolerance in ((pos_frames, play(keep, times, pos_frames, 3), 3, KEY_POS_TOLERANCE),
+                                                  (rot_frames, play(keep, times, rot_frames, 4), 4, KEY_ROT_TOLERANCE)):
+            for f in times:
+                for a, b in zip(played[f], frames[f]):
+                    self.assertLessEqual(abs(a - b), tolerance + 1e-12)
+
+    def test_exact_joints_keep_every_frame(self):
+        times, pos_frames, rot_frames, parents = self.chain(joints=3, count=50)
+        keep = reduce_keys(times, pos_frames, rot_frames, exact=[False, True, False])
+        self.assertEqual(keep[1], times)
+        self.assertLess(len(keep[0]), len(times))
+
+    def test_world_tolerance_down_a_chain(self):
+        times, pos_frames, rot_frames, parents = self.chain()
+        spaces = [None] + [(None, None, (1.0, 1.0, 1.0))] * (len(parents) - 1)
+
+        def world_error(keep):
+            played_pos = play(keep, times, pos_frames, 3)
+            played_rot = play(keep, times, rot_frames, 4)
+            error = 0.0
+            for f in times:
+                sampled = world(parents, pos_frames[f], rot_frames[f])
+                got = world(parents, played_pos[f], played_rot[f])
+                for a, b in zip(got, sampled):
+                    error = max(error, math.dist(a, b))
+            return error
+
+        # Per channel only, the wobble of every bone adds up at the tip
+        local = reduce_keys(times, pos_frames, rot_frames)
+        self.assertGreater(world_error(local), KEY_POS_TOLERANCE)
+        keep = reduce_keys(times, pos_frames, rot_frames, parents=parents, spaces=spaces)
+        self.assertLessEqual(world_error(keep), KEY_POS_TOLERANCE + 1e-9)
+        self.assertLess(sum(map(len, keep)), len(times) * len(parents))
+        # Keys are only ever added to the per-channel ones
+        for j in range(len(parents)):
+            self.assertTrue(set(local[j]) <= set(keep[j]))
+
+    def test_local_frames_round_trip(self):
+        # World frames -> parent space -> FK gives the world frames back
+        times, pos_frames, rot_frames, parents = self.chain(joints=4, count=3)
+        world_pos = []
+        world_rot = []
+        for f in times:
+            wpos = world(parents, pos_frames[f], rot_frames[f])
+            world_pos.append([c for p in wpos for c in p])
+            wrot = []
+            for j, parent in enumerate(parents):
+                r = rot_frames[f][j * 4:j * 4 + 4]
+                wrot.extend(r if parent < 0 else quat_mul(wrot[parent * 4:parent * 4 + 4], r))
+            world_rot.append(wrot)
+        spaces = [None] + [(None, None, (1.0, 1.0, 1.0))] * 3
+        lpos, lrot = local_frames(parents, spaces, world_pos, world_rot)
+        for f in times:
+            for a, b in zip(lpos[f], pos_frames[f]):
+                self.assertAlmostEqual(a, b, places=9)
+            for a, b in zip(lrot[f], rot_frames[f]):
+                self.assertAlmostEqual(a, b, places=9)
+
+    def test_align_quaternions(self):
+        rot_frames = [[0.0, 0.0, 0.0, 1.0], [0.0, 0.0, -0.1, -0.99], [0.0, 0.0, 0.2, 0.98]]
+        align_quaternions(rot_frames)
+        self.assertEqual(rot_frames[1], [-0.0, -0.0, 0.1, 0.99])
+        self.assertEqual(rot_frames[2], [0.0, 0.0, 0.2, 0.98])
+
+
+class ReductionJobTest(unittest.TestCase):
+    def segment(self, count=30):
+        times = list(range(count))
+        pos = [[float(t), 0.0, 0.0, float(t), 10.0, 0.0] for t in times]
+        rot = [[0.0, 0.0, 0.0, 1.0] * 2 for _ in times]
+        return {"times": times, "pos_frames": pos, "rot_frames": rot, "parents": [-1, 0],
+                "spaces": [None, (None, None, (1.0, 1.0, 1.0))]}
+
+    def test_reduces_in_parent_space(self):
+        segment = self.segment()
+        job = ReductionJob([segment])
+        self.assertTrue(job.wait(10.0))
+        self.assertIsNone(job.error)
+        # The child moves with its parent: constant in parent space
+        self.assertEqual(segment["pos_frames"][7][3:], [0.0, 10.0, 0.0])
+        self.assertEqual(job.keep, [[[0, 29], [0, 29]]])
+
+    def test_without_reduction(self):
+        job = ReductionJob([self.segment(5)], reduce=False)
+        job.wait()
+        self.assertEqual(job.keep, [[list(range(5))] * 2])
+
+    def test_error_is_kept(self):
+        segment = self.segment()
+        del segment["parents"]
+        job = ReductionJob([segment])
+        job.wait()
+        self.assertTrue(job.done())
+        self.assertIsInstance(job.error, KeyError)
+        self.assertIsNone(job.keep)
+
+
+if __name__ == "__main__":
+    unittest.main()